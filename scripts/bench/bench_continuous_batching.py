@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Continuous Batching Benchmark
+Локальный генератор нагрузки против детерминированного бэкенда: throughput, TTFT, заполнение батча
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict, Any, List
+
+import mini_model  # noqa: F401  (добавляет src в sys.path)
+from oracle.core.serve.backends import DeterministicBackend, SamplingParams, Sequence
+from oracle.core.serve.engine import InferenceEngine
+from oracle.core.serve.metrics import REGISTRY
+from oracle.core.serve.tokenizer import OracleTokenizer
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль без numpy (nearest-rank)"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def _sample(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0.0
+
+
+async def run_load(max_batch_size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Пуассоновский поток запросов через InferenceEngine"""
+    backend = DeterministicBackend(
+        OracleTokenizer(), max_batch_size=max_batch_size, response_tokens=args.max_output_len,
+        prefill_ms_per_token=args.prefill_ms_per_token, decode_ms_per_step=args.decode_ms_per_step
+    )
+    engine = InferenceEngine(backend, max_num_batched_tokens=args.token_budget)
+    rng = random.Random(0)
+    occupancy_sum, steps = _sample("oracle_batch_occupancy_sum"), _sample("oracle_batch_occupancy_count")
+
+    async def one_request(delay: float) -> Sequence:
+        await asyncio.sleep(delay)
+        prompt = [rng.randrange(6, 262) for _ in range(rng.randint(*args.prompt_len))]
+        sampling = SamplingParams(max_tokens=rng.randint(1, args.max_output_len))
+        return await engine.submit(Sequence(prompt, sampling))
+
+    arrivals, t = [], 0.0
+    for _ in range(args.num_requests):
+        t += rng.expovariate(args.rate)
+        arrivals.append(t)
+
+    start = time.perf_counter()
+    seqs = await asyncio.gather(*[one_request(delay) for delay in arrivals])
+    elapsed = time.perf_counter() - start
+    await engine.stop()
+
+    occupancy_sum = _sample("oracle_batch_occupancy_sum") - occupancy_sum
+    steps = _sample("oracle_batch_occupancy_count") - steps
+    ttft = [seq.first_token_time - seq.arrival_time for seq in seqs]
+    e2e = [seq.finish_time - seq.arrival_time for seq in seqs]
+    tokens = sum(len(seq.output_ids) for seq in seqs)
+    return {
+        "max_batch_size": max_batch_size,
+        "throughput_tok_s": tokens / elapsed,
+        "ttft_p50_ms": percentile(ttft, 50) * 1000,
+        "ttft_p95_ms": percentile(ttft, 95) * 1000,
+        "e2e_p50_ms": percentile(e2e, 50) * 1000,
+        "e2e_p95_ms": percentile(e2e, 95) * 1000,
+        "mean_occupancy": occupancy_sum / steps if steps else 0.0,
+        "steps": int(steps),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B continuous batching benchmark")
+    parser.add_argument("--num-requests", type=int, default=200, help="Количество запросов")
+    parser.add_argument("--rate", type=float, default=50.0, help="Интенсивность запросов, req/s")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32], help="max_batch_size")
+    parser.add_argument("--prompt-len", type=int, nargs=2, default=[32, 512], help="Диапазон длины промпта")
+    parser.add_argument("--max-output-len", type=int, default=128, help="Максимум токенов ответа")
+    parser.add_argument("--token-budget", type=int, default=2048, help="Бюджет токенов на шаг")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.02, help="Имитация prefill, мс/токен")
+    parser.add_argument("--decode-ms-per-step", type=float, default=5.0, help="Имитация decode-шага, мс")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_load(batch_size, args)) for batch_size in args.batch_sizes]
+
+    print(f"{'batch':>5} {'tok/s':>9} {'TTFT p50':>9} {'TTFT p95':>9} {'e2e p50':>9} {'e2e p95':>9} "
+          f"{'occupancy':>9} {'steps':>6}")
+    for r in results:
+        print(f"{r['max_batch_size']:>5} {r['throughput_tok_s']:>9.1f} {r['ttft_p50_ms']:>9.1f} "
+              f"{r['ttft_p95_ms']:>9.1f} {r['e2e_p50_ms']:>9.1f} {r['e2e_p95_ms']:>9.1f} "
+              f"{r['mean_occupancy']:>9.2f} {r['steps']:>6}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Fair Scheduling Benchmark
+Синтетическая multi-tenant нагрузка: batch-клиент против интерактивного чата, FIFO и приоритеты+WFQ
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict, Any, List, Tuple
+
+import mini_model  # noqa: F401  (добавляет src в sys.path)
+from oracle.core.serve.backends import DeterministicBackend, SamplingParams, Sequence
+from oracle.core.serve.engine import InferenceEngine
+from oracle.core.serve.tokenizer import OracleTokenizer
+from bench_continuous_batching import percentile
+
+
+def workload(args: argparse.Namespace) -> List[Tuple[float, str, str, int, int]]:
+    """(время прихода, класс, арендатор, длина промпта, длина ответа) для всех запросов"""
+    rng = random.Random(args.seed)
+    requests = []
+    # Batch-клиент выгружает всю пачку сразу
+    for _ in range(args.batch_requests):
+        requests.append((0.0, "batch", "bulk", rng.randint(*args.batch_prompt_len), args.batch_output_len))
+    # Интерактивные арендаторы: пуассоновский поток на всё время теста
+    for tenant in range(args.chat_tenants):
+        t = 0.0
+        while True:
+            t += rng.expovariate(args.chat_rate / args.chat_tenants)
+            if t > args.duration:
+                break
+            requests.append((t, "interactive", f"chat-{tenant}", rng.randint(*args.chat_prompt_len),
+                             rng.randint(*args.chat_output_len)))
+    return sorted(requests)
+
+
+async def run_mode(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """fifo: одна очередь без классов; fair: классы приоритета, WFQ и лимит слотов batch"""
+    backend = DeterministicBackend(
+        OracleTokenizer(), max_batch_size=args.max_batch_size, response_tokens=10 ** 9,
+        prefill_ms_per_token=args.prefill_ms_per_token, decode_ms_per_step=args.decode_ms_per_step
+    )
+    if mode == "fifo":
+        engine = InferenceEngine(backend, max_num_batched_tokens=args.token_budget,
+                                 tenant_weights={}, class_slot_limits={})
+    else:
+        engine = InferenceEngine(backend, max_num_batched_tokens=args.token_budget, tenant_weights={},
+                                 class_slot_limits={"batch": args.batch_max_slots})
+
+    async def one_request(arrival: float, cls: str, tenant: str, prompt_len: int, output_len: int):
+        await asyncio.sleep(arrival)
+        priority, tenant = (cls, tenant) if mode == "fair" else ("interactive", "all")
+        seq = Sequence([6 + i % 256 for i in range(prompt_len)], SamplingParams(max_tokens=output_len),
+                       priority=priority, tenant=tenant)
+        return cls, await engine.submit(seq)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one_request(*request) for request in workload(args)])
+    elapsed = time.perf_counter() - start
+    await engine.stop()
+
+    report = {"mode": mode, "throughput_tok_s": sum(len(s.output_ids) for _, s in results) / elapsed}
+    for cls in ("interactive", "batch"):
+        seqs = [seq for c, seq in results if c == cls]
+        ttft = [seq.first_token_time - seq.arrival_time for seq in seqs]
+        e2e = [seq.finish_time - seq.arrival_time for seq in seqs]
+        report[cls] = {
+            "requests": len(seqs),
+            "ttft_p50_ms": percentile(ttft, 50) * 1000,
+            "ttft_p95_ms": percentile(ttft, 95) * 1000,
+            "ttft_p99_ms": percentile(ttft, 99) * 1000,
+            "e2e_p50_ms": percentile(e2e, 50) * 1000,
+            "e2e_p95_ms": percentile(e2e, 95) * 1000,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B fair scheduling benchmark")
+    parser.add_argument("--modes", nargs="+", default=["fifo", "fair"], choices=["fifo", "fair"], help="Режимы")
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность интерактивного потока, с")
+    parser.add_argument("--chat-tenants", type=int, default=4, help="Интерактивных арендаторов")
+    parser.add_argument("--chat-rate", type=float, default=10.0, help="Суммарная интенсивность чата, req/s")
+    parser.add_argument("--chat-prompt-len", type=int, nargs=2, default=[32, 256], help="Диапазон промпта чата")
+    parser.add_argument("--chat-output-len", type=int, nargs=2, default=[8, 64], help="Диапазон ответа чата")
+    parser.add_argument("--batch-requests", type=int, default=100, help="Запросов batch-клиента (все в t=0)")
+    parser.add_argument("--batch-prompt-len", type=int, nargs=2, default=[512, 1024], help="Диапазон промпта batch")
+    parser.add_argument("--batch-output-len", type=int, default=128, help="Длина ответа batch")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="max_batch_size")
+    parser.add_argument("--batch-max-slots", type=int, default=12, help="Мест в батче для batch-класса (fair)")
+    parser.add_argument("--token-budget", type=int, default=4096, help="Бюджет токенов на шаг")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.01, help="Имитация prefill, мс/токен")
+    parser.add_argument("--decode-ms-per-step", type=float, default=5.0, help="Имитация decode-шага, мс")
+    parser.add_argument("--seed", type=int, default=0, help="Seed нагрузки")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_mode(mode, args)) for mode in args.modes]
+
+    print(f"{'mode':>5} {'class':>12} {'req':>5} {'TTFT p50':>9} {'TTFT p95':>9} {'TTFT p99':>9} "
+          f"{'e2e p50':>9} {'e2e p95':>9} {'tok/s':>9}")
+    for r in results:
+        for cls in ("interactive", "batch"):
+            c = r[cls]
+            print(f"{r['mode']:>5} {cls:>12} {c['requests']:>5} {c['ttft_p50_ms']:>9.1f} {c['ttft_p95_ms']:>9.1f} "
+                  f"{c['ttft_p99_ms']:>9.1f} {c['e2e_p50_ms']:>9.1f} {c['e2e_p95_ms']:>9.1f} "
+                  f"{r['throughput_tok_s']:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Oracle850B lm_head Memory Benchmark
+Пиковая память: полные логиты vs чанкованный lm_head/loss vs return_logits="last"
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import resource
+import argparse
+import multiprocessing as mp
+from typing import Dict, Any
+
+import mini_model  # noqa: F401  (добавляет src в sys.path)
+
+
+def _peak_rss_mib() -> float:
+    """Пиковый RSS процесса в MiB (Linux: ru_maxrss в KiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_case(case: str, args: Dict[str, Any], queue: mp.Queue):
+    """Один сценарий в отдельном процессе, чтобы пики не смешивались"""
+    import torch
+    import torch.nn.functional as F
+    from oracle.moe850b.modeling.transformer_moe import chunked_cross_entropy
+
+    torch.manual_seed(0)
+    dtype = torch.bfloat16 if args["bf16"] else torch.float32
+    hidden = torch.randn(1, args["seq_len"], args["d_model"], dtype=dtype, requires_grad=True)
+    weight = (torch.randn(args["vocab_size"], args["d_model"], dtype=dtype) * 0.02).requires_grad_()
+    labels = torch.randint(0, args["vocab_size"], (1, args["seq_len"]))
+
+    baseline = _peak_rss_mib()
+    start = time.perf_counter()
+
+    if case == "full_loss":
+        logits = F.linear(hidden, weight).float()
+        loss = F.cross_entropy(logits.view(-1, args["vocab_size"]), labels.view(-1))
+        loss.backward()
+    elif case == "chunked_loss":
+        loss = chunked_cross_entropy(hidden, weight, labels, chunk_size=args["chunk_size"])
+        loss.backward()
+    elif case == "full_logits":
+        with torch.inference_mode():
+            F.linear(hidden, weight)
+    elif case == "last_logits":
+        with torch.inference_mode():
+            F.linear(hidden[:, -1:], weight)
+
+    queue.put({
+        "case": case,
+        "peak_delta_mib": _peak_rss_mib() - baseline,
+        "time_s": time.perf_counter() - start,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B lm_head memory benchmark")
+    parser.add_argument("--seq-len", type=int, default=2048, help="Длина последовательности")
+    parser.add_argument("--vocab-size", type=int, default=131072, help="Размер словаря")
+    parser.add_argument("--d-model", type=int, default=256, help="Размер скрытого состояния")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Размер чанка lm_head")
+    parser.add_argument("--bf16", action="store_true", help="bf16 hidden/weight")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+    params = vars(args)
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for case in ("full_loss", "chunked_loss", "full_logits", "last_logits"):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_case, args=(case, params, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            results.append({"case": case, "error": f"exit code {proc.exitcode}"})
+            continue
+        results.append(queue.get())
+
+    logits_gib = args.seq_len * args.vocab_size * 4 / 2**30
+    print(f"fp32 логиты [1, {args.seq_len}, {args.vocab_size}]: {logits_gib:.2f} GiB")
+    print(f"{'case':<14} {'peak Δ MiB':>12} {'time s':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<14} {r['error']}")
+        else:
+            print(f"{r['case']:<14} {r['peak_delta_mib']:>12.1f} {r['time_s']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "results": results}, f, indent=2)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Oracle850B MoE torch.compile Benchmark
+Eager vs. compiled на мини-конфиге (CPU)
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import argparse
+from typing import Dict, Any
+
+import torch
+
+from mini_model import add_mini_args, build_mini_config
+from oracle.moe850b.modeling.transformer_moe import Oracle850BTransformer
+
+
+def time_forward(model, input_ids: torch.Tensor, iters: int, warmup: int) -> float:
+    """Среднее время forward в миллисекундах"""
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(input_ids)
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(input_ids)
+    return (time.perf_counter() - start) / iters * 1000
+
+
+def count_graphs(model, input_ids: torch.Tensor) -> Dict[str, Any]:
+    """Подсчитать графы и разрывы графа через torch._dynamo.explain"""
+    torch._dynamo.reset()
+    with torch.inference_mode():
+        explain = torch._dynamo.explain(model)(input_ids)
+    return {
+        "graph_count": explain.graph_count,
+        "graph_break_count": explain.graph_break_count,
+        "break_reasons": sorted({str(reason.reason).splitlines()[0] for reason in explain.break_reasons})[:5]
+    }
+
+
+def run_mode(config: Dict[str, Any], dispatch: str, input_ids: torch.Tensor,
+             iters: int, warmup: int) -> Dict[str, Any]:
+    """Бенчмарк одного режима диспетчеризации"""
+    config["moe"]["dispatch"] = dispatch
+    torch.manual_seed(0)
+    # capacity-диспетчеризация действует только в train-режиме (обучение с torch.compile)
+    model = Oracle850BTransformer(config).train()
+
+    result = {"dispatch": dispatch, "eager_ms": time_forward(model, input_ids, iters, warmup)}
+    result.update(count_graphs(model, input_ids))
+
+    torch._dynamo.reset()
+    compiled = torch.compile(model)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        compiled(input_ids)
+    result["compile_s"] = time.perf_counter() - start
+    result["compiled_ms"] = time_forward(compiled, input_ids, iters, warmup)
+    result["speedup"] = result["eager_ms"] / result["compiled_ms"]
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B MoE torch.compile benchmark")
+    add_mini_args(parser)
+    parser.add_argument("--batch-size", type=int, default=1, help="Размер батча")
+    parser.add_argument("--seq-len", type=int, default=128, help="Длина последовательности")
+    parser.add_argument("--iters", type=int, default=10, help="Итерации замера")
+    parser.add_argument("--warmup", type=int, default=2, help="Итерации прогрева")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = build_mini_config(args)
+    input_ids = torch.randint(0, config["vocab_size"], (args.batch_size, args.seq_len))
+
+    results = [
+        run_mode(config, dispatch, input_ids, args.iters, args.warmup)
+        for dispatch in ("dropless", "capacity")
+    ]
+
+    print(f"{'dispatch':<10} {'graphs':>6} {'breaks':>6} {'eager ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for r in results:
+        print(f"{r['dispatch']:<10} {r['graph_count']:>6} {r['graph_break_count']:>6} "
+              f"{r['eager_ms']:>10.2f} {r['compiled_ms']:>12.2f} {r['speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
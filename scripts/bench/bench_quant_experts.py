@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Quantized Experts Benchmark
+Память и CPU decode-throughput: bf16 vs int8 vs int4 на мини-конфиге
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import argparse
+from typing import Dict, Any
+
+import torch
+
+from mini_model import add_mini_args, build_mini_config
+from oracle.moe850b.modeling.transformer_moe import Oracle850BTransformer
+from oracle.moe850b.modeling.quantization import quantize_moe_experts, module_nbytes
+
+
+def experts_nbytes(model: Oracle850BTransformer) -> int:
+    """Память всех экспертов модели"""
+    return sum(module_nbytes(layer.moe.experts) for layer in model.layers)
+
+
+def decode_throughput(model, batch_size: int, steps: int, warmup: int, vocab_size: int) -> float:
+    """Токенов/с для одношаговых forward [batch_size, 1]"""
+    input_ids = torch.randint(0, vocab_size, (batch_size, 1))
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(input_ids)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model(input_ids)
+    return batch_size * steps / (time.perf_counter() - start)
+
+
+def run_variant(config: Dict[str, Any], bits: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Бенчмарк одного варианта весов"""
+    torch.manual_seed(0)
+    model = Oracle850BTransformer(config).eval().to(torch.bfloat16)
+    reference_ids = torch.randint(0, config["vocab_size"], (1, 16))
+
+    with torch.inference_mode():
+        reference = model(reference_ids).float()
+
+    if bits:
+        quantize_moe_experts(model, bits=bits, group_size=args.group_size)
+
+    with torch.inference_mode():
+        logits = model(reference_ids).float()
+
+    return {
+        "variant": f"int{bits}" if bits else "bf16",
+        "model_mib": module_nbytes(model) / 2**20,
+        "experts_mib": experts_nbytes(model) / 2**20,
+        "logits_max_abs_err": (logits - reference).abs().max().item(),
+        "decode_tok_s": decode_throughput(model, args.batch_size, args.steps, args.warmup, config["vocab_size"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B quantized experts benchmark")
+    add_mini_args(parser)
+    parser.add_argument("--batch-size", type=int, default=1, help="Размер decode-батча")
+    parser.add_argument("--steps", type=int, default=20, help="Decode-шагов для замера")
+    parser.add_argument("--warmup", type=int, default=3, help="Шагов прогрева")
+    parser.add_argument("--group-size", type=int, default=128, help="Размер группы int4")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = build_mini_config(args)
+    results = [run_variant(config, bits, args) for bits in (0, 8, 4)]
+
+    baseline = results[0]
+    print(f"{'variant':<8} {'model MiB':>10} {'experts MiB':>12} {'saving':>8} {'tok/s':>8} {'max err':>8}")
+    for r in results:
+        saving = baseline["experts_mib"] / r["experts_mib"]
+        print(f"{r['variant']:<8} {r['model_mib']:>10.1f} {r['experts_mib']:>12.1f} {saving:>7.2f}x "
+              f"{r['decode_tok_s']:>8.1f} {r['logits_max_abs_err']:>8.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
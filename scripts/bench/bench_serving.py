@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Serving Load Test
+Открытый пуассоновский поток chat-запросов к FastAPI-приложению (in-process или по HTTP): TTFT, ITL, throughput
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import socket
+import threading
+import subprocess
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from mini_model import ROOT  # (добавляет src в sys.path)
+from oracle.core.serve.tokenizer import load_tokenizer
+from bench_continuous_batching import percentile
+
+SCHEMA_VERSION = 1
+
+WORDS = {
+    "ru": ("модель", "данные", "обучение", "эксперт", "запрос", "ответ", "вопрос", "система", "память",
+           "скорость", "качество", "текст", "перевод", "задача", "пример", "объясни", "почему", "как"),
+    "en": ("model", "data", "training", "expert", "request", "answer", "question", "system", "memory",
+           "latency", "quality", "text", "translate", "task", "example", "explain", "why", "how"),
+}
+
+
+def parse_mixture(spec: str) -> List[Tuple[int, float]]:
+    """"64:0.5,512:0.3,2048:0.2" -> [(64, 0.5), (512, 0.3), (2048, 0.2)]"""
+    mixture = []
+    for item in spec.split(","):
+        value, _, weight = item.partition(":")
+        mixture.append((int(value), float(weight or 1.0)))
+    return mixture
+
+
+def _choose(rng: random.Random, mixture: List[Tuple[int, float]]) -> int:
+    values, weights = zip(*mixture)
+    return rng.choices(values, weights)[0]
+
+
+def load_payloads(path: str, max_tokens: Optional[int]) -> List[Dict[str, Any]]:
+    """Тела запросов из JSONL.
+
+    Строка — тело /v1/chat/completions, запись OpenAI Batch API
+    ({"custom_id": ..., "body": {...}}) или запись со строковым body
+    (как requests.jsonl), которое становится сообщением пользователя.
+    """
+    payloads = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            body = record.get("body", record)
+            if isinstance(body, str):
+                body = {"messages": [{"role": "user", "content": body}]}
+            payload = dict(body)
+            if max_tokens is not None:
+                payload["max_tokens"] = max_tokens
+            payloads.append(payload)
+    return payloads
+
+
+def synthetic_payloads(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Синтетика: длины промпта и ответа из смесей, язык RU/EN с долей --ru-fraction"""
+    rng = random.Random(args.seed)
+    tokenizer = load_tokenizer(args.model_path)
+    prompt_mix, output_mix = parse_mixture(args.prompt_len_mix), parse_mixture(args.output_len_mix)
+
+    payloads = []
+    for _ in range(args.num_requests):
+        words = WORDS["ru" if rng.random() < args.ru_fraction else "en"]
+        target = _choose(rng, prompt_mix)
+        text = " ".join(rng.choice(words) for _ in range(target))
+        # Обрезка до целевой длины в токенах Oracle
+        text = tokenizer.decode(tokenizer.encode(text)[:target])
+        payloads.append({"messages": [{"role": "user", "content": text}],
+                         "max_tokens": _choose(rng, output_mix), "temperature": args.temperature})
+    return payloads
+
+
+@asynccontextmanager
+async def make_client(args: argparse.Namespace) -> AsyncIterator[httpx.AsyncClient]:
+    """Клиент к серверу по --url или к приложению этого процесса.
+
+    In-process приложение поднимается через uvicorn на свободном порту
+    localhost в отдельном потоке: ASGI-транспорт httpx буферизует ответ
+    целиком, и TTFT стрима по нему не измерить.
+    """
+    timeout = httpx.Timeout(None)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            yield client
+        return
+
+    import uvicorn
+    from oracle.core.serve.app_fastapi import app, server as oracle_server
+
+    backend = oracle_server.backend
+    if hasattr(backend, "decode_ms_per_step"):
+        backend.prefill_ms_per_token = args.prefill_ms_per_token
+        backend.decode_ms_per_step = args.decode_ms_per_step
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Сервер не запустился")
+        await asyncio.sleep(0.05)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            yield client
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+async def send_request(client: httpx.AsyncClient, payload: Dict[str, Any], tokenizer) -> Dict[str, Any]:
+    """Один стриминговый запрос: время отправки, моменты content-чанков, число токенов ответа"""
+    result = {"status": None, "start": time.perf_counter(), "chunk_times": [], "output_tokens": 0, "error": None}
+    text = []
+    try:
+        async with client.stream("POST", "/v1/chat/completions", json={**payload, "stream": True}) as response:
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                chunk = json.loads(line[len("data: "):])
+                if "error" in chunk:
+                    result["error"] = chunk["error"]["message"]
+                    continue
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    result["chunk_times"].append(time.perf_counter())
+                    text.append(content)
+    except httpx.HTTPError as e:
+        result["error"] = str(e)
+    result["end"] = time.perf_counter()
+    result["output_tokens"] = len(tokenizer.encode("".join(text))) if text else 0
+    return result
+
+
+async def run_load(args: argparse.Namespace, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Открытый цикл: запросы стартуют по пуассоновскому расписанию независимо от ответов"""
+    tokenizer = load_tokenizer(args.model_path)
+    rng = random.Random(args.seed)
+    arrivals, t = [], 0.0
+    for _ in payloads:
+        t += rng.expovariate(args.rate)
+        arrivals.append(t)
+
+    async with make_client(args) as client:
+        for payload in payloads[:args.warmup]:
+            await send_request(client, payload, tokenizer)
+
+        async def scheduled(delay: float, payload: Dict[str, Any]) -> Dict[str, Any]:
+            await asyncio.sleep(delay - (time.perf_counter() - start))
+            return await send_request(client, payload, tokenizer)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[scheduled(d, p) for d, p in zip(arrivals, payloads)])
+        duration = time.perf_counter() - start
+
+    return summarize(results, duration)
+
+
+def _stats_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None}
+    return {
+        "mean": round(sum(values) / len(values) * 1000, 3),
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def summarize(results: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    """TTFT — до первого content-чанка; ITL — паузы между чанками; TPOT — (конец - первый) / (токены - 1)"""
+    ok = [r for r in results if r["status"] == 200 and r["error"] is None and r["chunk_times"]]
+    ttft = [r["chunk_times"][0] - r["start"] for r in ok]
+    itl = [b - a for r in ok for a, b in zip(r["chunk_times"], r["chunk_times"][1:])]
+    tpot = [(r["chunk_times"][-1] - r["chunk_times"][0]) / (r["output_tokens"] - 1)
+            for r in ok if r["output_tokens"] > 1]
+    e2e = [r["end"] - r["start"] for r in ok]
+    output_tokens = sum(r["output_tokens"] for r in ok)
+    return {
+        "requests": len(results),
+        "completed": len(ok),
+        "rejected_429": sum(r["status"] == 429 for r in results),
+        "failed": len(results) - len(ok) - sum(r["status"] == 429 for r in results),
+        "duration_s": round(duration, 3),
+        "throughput": {
+            "requests_per_s": round(len(ok) / duration, 3),
+            "output_tokens_per_s": round(output_tokens / duration, 3),
+        },
+        "output_tokens": output_tokens,
+        "ttft_ms": _stats_ms(ttft),
+        "itl_ms": _stats_ms(itl),
+        "tpot_ms": _stats_ms(tpot),
+        "e2e_ms": _stats_ms(e2e),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B serving load test")
+    parser.add_argument("--url", help="Адрес сервера (http://localhost:8000); без него — приложение в этом процессе")
+    parser.add_argument("--dataset", help="JSONL с запросами (тела chat, OpenAI Batch API или requests.jsonl)")
+    parser.add_argument("--num-requests", type=int, default=100, help="Запросов (для датасета — максимум)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Интенсивность пуассоновского потока, req/s")
+    parser.add_argument("--prompt-len-mix", default="32:0.5,256:0.35,1024:0.15",
+                        help="Смесь длин промпта в токенах: длина:вес,...")
+    parser.add_argument("--output-len-mix", default="16:0.5,64:0.35,256:0.15",
+                        help="Смесь max_tokens: длина:вес,...")
+    parser.add_argument("--ru-fraction", type=float, default=0.5, help="Доля русских промптов в синтетике")
+    parser.add_argument("--max-tokens", type=int, help="Переопределить max_tokens запросов датасета")
+    parser.add_argument("--temperature", type=float, default=0.0, help="Температура синтетических запросов")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.0,
+                        help="Имитация prefill детерминированного бэкенда in-process, мс/токен")
+    parser.add_argument("--decode-ms-per-step", type=float, default=0.0,
+                        help="Имитация decode-шага детерминированного бэкенда in-process, мс")
+    parser.add_argument("--warmup", type=int, default=0, help="Прогревочных запросов (последовательно, не в отчёте)")
+    parser.add_argument("--model-path", default=os.environ.get("MODEL_PATH", str(ROOT / "checkpoints" / "oracle850b")),
+                        help="Каталог модели (токенизатор для синтетики и подсчёта токенов)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed нагрузки и расписания")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    if args.dataset:
+        payloads = load_payloads(args.dataset, args.max_tokens)[:args.num_requests]
+    else:
+        payloads = synthetic_payloads(args)
+
+    results = asyncio.run(run_load(args, payloads))
+
+    print(f"{'metric':>8} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name in ("ttft_ms", "itl_ms", "tpot_ms", "e2e_ms"):
+        stats = results[name]
+        print(f"{name:>8} " + " ".join(f"{stats[k]:>9.1f}" if stats[k] is not None else f"{'-':>9}"
+                                       for k in ("mean", "p50", "p95", "p99")))
+    print(f"Запросов: {results['completed']}/{results['requests']} (429: {results['rejected_429']}, "
+          f"ошибок: {results['failed']}) за {results['duration_s']:.1f} с, "
+          f"{results['throughput']['requests_per_s']:.2f} req/s, "
+          f"{results['throughput']['output_tokens_per_s']:.1f} ток/с")
+
+    if args.output:
+        report = {
+            "schema_version": SCHEMA_VERSION,
+            "git_commit": _git_commit(),
+            "params": {key: value for key, value in sorted(vars(args).items()) if key != "output"},
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, sort_keys=True)
+            f.write("\n")
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Sliding-Window Attention Benchmark
+Память KV-кэша и скорость decode: dense vs sliding window + sink-токены на длинном контексте
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import argparse
+from typing import Dict, Any, List
+
+import torch
+
+from mini_model import add_mini_args, build_mini_config
+from oracle.moe850b.modeling.precision import PrecisionPolicy
+from oracle.moe850b.modeling.transformer_moe import Oracle850BTransformer
+
+
+def run_mode(config: Dict[str, Any], contexts: List[int], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Чанкованный prefill до каждого контекста, затем замер decode"""
+    torch.manual_seed(0)
+    model = Oracle850BTransformer(config, precision=PrecisionPolicy.from_config(config, mode="infer")).eval()
+    cache = model.create_kv_cache()
+    vocab_size = config["vocab_size"]
+    results = []
+
+    with torch.inference_mode():
+        for context in contexts:
+            start = time.perf_counter()
+            prefilled = 0
+            while cache.get_seq_length() < context:
+                chunk = min(args.prefill_chunk, context - cache.get_seq_length())
+                model(torch.randint(0, vocab_size, (1, chunk)), kv_cache=cache, return_logits="last")
+                prefilled += chunk
+            prefill_s = time.perf_counter() - start
+
+            token = torch.randint(0, vocab_size, (1, 1))
+            start = time.perf_counter()
+            for _ in range(args.decode_steps):
+                model(token, kv_cache=cache, return_logits="last")
+            decode_s = time.perf_counter() - start
+
+            # Decode-шаги не считаются в контекст следующего замера
+            cache.crop(context)
+            results.append({
+                "context": context,
+                "kv_cache_mib": cache.nbytes() / 2**20,
+                "prefill_tok_s": prefilled / prefill_s if prefilled else None,
+                "decode_ms_per_token": decode_s * 1000 / args.decode_steps,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B sliding-window attention benchmark")
+    add_mini_args(parser)
+    parser.add_argument("--contexts", type=int, nargs="+", default=[4096, 16384, 65536],
+                        help="Длины контекста для замеров (по возрастанию)")
+    parser.add_argument("--window", type=int, default=4096, help="Размер окна внимания")
+    parser.add_argument("--sink-tokens", type=int, default=4, help="Глобальные sink-токены")
+    parser.add_argument("--prefill-chunk", type=int, default=1024, help="Размер чанка prefill")
+    parser.add_argument("--decode-steps", type=int, default=16, help="Decode-шагов для замера")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = build_mini_config(args)
+    # Длинный контекст: RoPE вместо обученных позиций, без дропа токенов в MoE
+    config["position_encoding"] = "rope"
+    config["max_seq_len"] = max(args.contexts) + args.decode_steps
+    config["fp"] = {"infer": "fp32"}
+
+    window_config = dict(config, sliding_window=args.window, attention_sink_tokens=args.sink_tokens)
+
+    results = {
+        "dense": run_mode(config, args.contexts, args),
+        "sliding": run_mode(window_config, args.contexts, args),
+    }
+
+    print(f"{'mode':<8} {'context':>8} {'KV MiB':>8} {'prefill tok/s':>14} {'decode ms/tok':>14}")
+    for mode, rows in results.items():
+        for r in rows:
+            print(f"{mode:<8} {r['context']:>8} {r['kv_cache_mib']:>8.1f} "
+                  f"{r['prefill_tok_s'] or 0:>14.1f} {r['decode_ms_per_token']:>14.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": window_config, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
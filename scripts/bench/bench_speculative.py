@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Speculative Decoding Benchmark
+Acceptance rate, токены на forward верификатора и скорость vs обычный decode
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import argparse
+from typing import Dict, Any
+
+import torch
+
+from mini_model import add_mini_args, build_mini_config
+from oracle.moe850b.modeling.generation import generate
+from oracle.moe850b.modeling.speculative import SpeculativeDecoder
+from oracle.moe850b.modeling.transformer_moe import Oracle850BTransformer
+
+
+def build_draft(target: Oracle850BTransformer, config: Dict[str, Any],
+                args: argparse.Namespace) -> Oracle850BTransformer:
+    """Драфт из мини-конфига или первые --draft-layers слоёв верификатора"""
+    if args.draft_config:
+        with open(args.draft_config, "r", encoding="utf-8") as f:
+            draft_config = json.load(f)
+        draft_config["vocab_size"] = config["vocab_size"]
+        return Oracle850BTransformer(draft_config).eval()
+
+    draft_config = json.loads(json.dumps(config))
+    draft_config["dense"]["n_layers"] = args.draft_layers
+    draft = Oracle850BTransformer(draft_config).eval()
+    # Слои сверх draft_layers попадают в unexpected keys
+    draft.load_state_dict(target.state_dict(), strict=False)
+    return draft
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B speculative decoding benchmark")
+    add_mini_args(parser)
+    parser.add_argument("--draft-config", help="JSON мини-конфиг драфт-модели (make_mini_config.py)")
+    parser.add_argument("--draft-layers", type=int, default=1, help="Слоёв в драфте без --draft-config")
+    parser.add_argument("--lookahead", type=int, nargs="+", default=[2, 4, 8], help="Значения lookahead")
+    parser.add_argument("--prompt-len", type=int, default=32, help="Длина промпта")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="Токенов генерации")
+    parser.add_argument("--temperature", type=float, default=0.0, help="Температура (0 = greedy)")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = build_mini_config(args)
+    config["fp"] = {"infer": "fp32"}
+
+    torch.manual_seed(0)
+    target = Oracle850BTransformer(config).eval()
+    draft = build_draft(target, config, args)
+    prompt = torch.randint(0, config["vocab_size"], (1, args.prompt_len))
+
+    start = time.perf_counter()
+    generate(target, prompt, args.max_new_tokens, temperature=args.temperature,
+             generator=torch.Generator().manual_seed(0))
+    baseline_s = time.perf_counter() - start
+
+    results = []
+    for lookahead in args.lookahead:
+        decoder = SpeculativeDecoder(target, draft, lookahead=lookahead)
+        start = time.perf_counter()
+        decoder.generate(prompt, args.max_new_tokens, temperature=args.temperature,
+                         generator=torch.Generator().manual_seed(0))
+        elapsed = time.perf_counter() - start
+        results.append(dict(decoder.stats.to_dict(), lookahead=lookahead,
+                            tok_s=decoder.stats.generated / elapsed, speedup=baseline_s / elapsed))
+
+    print(f"baseline: {args.max_new_tokens / baseline_s:.1f} tok/s, "
+          f"{args.max_new_tokens} forward верификатора")
+    print(f"{'lookahead':>9} {'accept':>7} {'tok/fwd':>8} {'fwd':>5} {'tok/s':>8} {'speedup':>8}")
+    for r in results:
+        print(f"{r['lookahead']:>9} {r['acceptance_rate']:>7.2f} {r['tokens_per_target_forward']:>8.2f} "
+              f"{r['target_forwards']:>5} {r['tok_s']:>8.1f} {r['speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "baseline_tok_s": args.max_new_tokens / baseline_s,
+                       "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
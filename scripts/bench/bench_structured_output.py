@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Structured Output Benchmark
+Стоимость ограниченного декодирования: компиляция схемы, маски состояний и накладные расходы на токен
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import random
+import argparse
+from typing import Any, Dict, List, Optional
+
+import torch
+
+import mini_model  # noqa: F401  (добавляет src в sys.path)
+from oracle.core.serve.structured_output import (
+    ByteDFA, TokenAutomaton, TokenVocabulary, json_schema_to_regex, response_format_regex
+)
+from oracle.core.serve.tokenizer import OracleTokenizer
+from oracle.moe850b.modeling.sampling import BatchedSampler
+from bench_continuous_batching import percentile
+
+EOS_TOKEN_ID = 3
+DEFAULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "maxLength": 24},
+        "age": {"type": "integer", "minimum": 0, "maximum": 150},
+        "email": {"type": "string", "maxLength": 32},
+        "tags": {"type": "array", "items": {"enum": ["новый", "vip", "архив"]}, "maxItems": 3},
+        "active": {"type": "boolean"},
+        "score": {"type": ["number", "null"]},
+    },
+    "required": ["name", "age", "active"],
+}
+
+
+def synthetic_vocabulary(vocab_size: int, seed: int) -> List[Optional[bytes]]:
+    """Словарь как у byte-level BPE: спецтокены, 256 байт, остальное — фрагменты RU/EN текста и JSON"""
+    rng = random.Random(seed)
+    latin = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    cyrillic = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ"
+    punctuation = '{}[]":,. -_@0123456789'
+    table: List[Optional[bytes]] = [None] * 6 + [bytes([b]) for b in range(256)]
+    while len(table) < vocab_size:
+        alphabet = rng.choice([latin, cyrillic, punctuation, latin + punctuation])
+        piece = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+        table.append(((" " if rng.random() < 0.4 else "") + piece).encode("utf-8"))
+    return table
+
+
+def bench_masks(automaton: TokenAutomaton) -> Dict[str, Any]:
+    """Маски всех состояний: время построения (промах кэша) и память"""
+    build_ms = []
+    for state in range(automaton.dfa.num_states):
+        start = time.perf_counter()
+        automaton.allowed(state, torch.device("cpu"))
+        build_ms.append((time.perf_counter() - start) * 1000)
+    allowed = [int(automaton.allowed(state, torch.device("cpu")).sum()) for state in range(automaton.dfa.num_states)]
+    return {
+        "states": automaton.dfa.num_states,
+        "mask_build_ms_mean": sum(build_ms) / len(build_ms),
+        "mask_build_ms_p50": percentile(build_ms, 50),
+        "mask_build_ms_max": max(build_ms),
+        "mask_build_total_s": sum(build_ms) / 1000,
+        "masks_mb": automaton.dfa.num_states * automaton.vocab_size / 2 ** 20,
+        "allowed_tokens_p50": percentile(allowed, 50),
+    }
+
+
+def bench_decode(automaton: Optional[TokenAutomaton], vocabulary: TokenVocabulary, batch_size: int,
+                 args: argparse.Namespace) -> Dict[str, Any]:
+    """Шаги BatchedSampler по случайным логитам: с ограничением и без.
+
+    Ограниченные строки после EOS начинают новый ответ; завершённые ответы
+    проверяются json.loads и полным совпадением с DFA.
+    """
+    torch.manual_seed(args.seed)
+    vocab_size = vocabulary.vocab_size
+    sampler = BatchedSampler(batch_size, vocab_size, torch.device("cpu"))
+    slots = list(range(batch_size))
+    for slot in slots:
+        sampler.add(slot, args.temperature, args.top_k, args.top_p, constraint=automaton)
+    pool = [torch.randn(batch_size, vocab_size) * 3 for _ in range(4)]
+    outputs: List[bytearray] = [bytearray() for _ in slots]
+    finished = valid = 0
+
+    step_ms = []
+    for step in range(args.warmup + args.steps):
+        start = time.perf_counter()
+        tokens, _, _ = sampler.sample(pool[step % len(pool)], slots)
+        chosen = tokens.tolist()
+        elapsed = (time.perf_counter() - start) * 1000
+        if step >= args.warmup:
+            step_ms.append(elapsed)
+        if automaton is None:
+            continue
+        for slot, token_id in enumerate(chosen):
+            if token_id == EOS_TOKEN_ID:
+                finished += 1
+                text = bytes(outputs[slot])
+                try:
+                    json.loads(text.decode("utf-8"))
+                    valid += automaton.dfa.fullmatch(text)
+                except ValueError:
+                    pass
+                outputs[slot].clear()
+                sampler.add(slot, args.temperature, args.top_k, args.top_p, constraint=automaton)
+            else:
+                outputs[slot].extend(vocabulary.token_bytes[token_id] or b"")
+
+    mean_ms = sum(step_ms) / len(step_ms)
+    return {
+        "batch_size": batch_size,
+        "step_ms_mean": mean_ms,
+        "step_ms_p50": percentile(step_ms, 50),
+        "step_ms_p95": percentile(step_ms, 95),
+        "finished": finished,
+        "valid": valid,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B structured output benchmark")
+    parser.add_argument("--vocab-size", type=int, default=131072, help="Размер словаря модели")
+    parser.add_argument("--tokenizer", help="tokenizer.json (по умолчанию — синтетический словарь)")
+    parser.add_argument("--schema", help="JSON Schema из файла (по умолчанию — встроенная анкета)")
+    parser.add_argument("--response-format", choices=["json_schema", "json_object"], default="json_schema",
+                        help="Тип ограничения")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32], help="Размеры батча")
+    parser.add_argument("--steps", type=int, default=200, help="Замеряемых шагов на размер батча")
+    parser.add_argument("--warmup", type=int, default=10, help="Шагов прогрева")
+    parser.add_argument("--temperature", type=float, default=1.0, help="Температура")
+    parser.add_argument("--top-k", type=int, default=50, help="Top-k (одинаковая ширина сортировки с ограничением и без)")
+    parser.add_argument("--top-p", type=float, default=1.0, help="Top-p")
+    parser.add_argument("--seed", type=int, default=0, help="Seed")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tokenizer = OracleTokenizer(args.tokenizer) if args.tokenizer else None
+    if tokenizer is not None and not tokenizer.is_fallback:
+        token_bytes = tokenizer.token_bytes()
+    else:
+        token_bytes = synthetic_vocabulary(args.vocab_size, args.seed)
+    vocabulary = TokenVocabulary(token_bytes, args.vocab_size, EOS_TOKEN_ID)
+    vocabulary.tensors(torch.device("cpu"))
+    vocabulary_s = time.perf_counter() - start
+
+    if args.response_format == "json_object":
+        pattern = response_format_regex({"type": "json_object"})
+    else:
+        schema = DEFAULT_SCHEMA
+        if args.schema:
+            with open(args.schema, encoding="utf-8") as f:
+                schema = json.load(f)
+        pattern = json_schema_to_regex(schema)
+    start = time.perf_counter()
+    automaton = TokenAutomaton(ByteDFA.from_regex(pattern), vocabulary, "bench")
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    masks = bench_masks(automaton)
+    print(f"Словарь: {args.vocab_size} токенов, до {vocabulary.max_len} байт, подготовка {vocabulary_s:.2f} с")
+    print(f"Компиляция: {compile_ms:.1f} мс, состояний DFA {masks['states']}")
+    print(f"Маска состояния: {masks['mask_build_ms_mean']:.2f} мс в среднем (max {masks['mask_build_ms_max']:.2f}), "
+          f"все состояния {masks['mask_build_total_s']:.2f} с, {masks['masks_mb']:.1f} МБ")
+
+    results = []
+    print(f"{'batch':>6} {'base ms':>9} {'constr ms':>10} {'+ms/step':>9} {'+us/token':>10} {'valid':>9}")
+    for batch_size in args.batch_sizes:
+        base = bench_decode(None, vocabulary, batch_size, args)
+        constrained = bench_decode(automaton, vocabulary, batch_size, args)
+        overhead_ms = constrained["step_ms_mean"] - base["step_ms_mean"]
+        result = {
+            "batch_size": batch_size,
+            "baseline": base,
+            "constrained": constrained,
+            "overhead_ms_per_step": overhead_ms,
+            "overhead_us_per_token": overhead_ms * 1000 / batch_size,
+        }
+        results.append(result)
+        print(f"{batch_size:>6} {base['step_ms_mean']:>9.2f} {constrained['step_ms_mean']:>10.2f} "
+              f"{overhead_ms:>9.2f} {result['overhead_us_per_token']:>10.1f} "
+              f"{constrained['valid']:>4}/{constrained['finished']:<4}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "compile_ms": compile_ms, "vocabulary_s": vocabulary_s,
+                       "masks": masks, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
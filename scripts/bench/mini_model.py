@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Mini Model Helpers
+Общие утилиты бенчмарков: мини-конфиг и CPU-модель
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Dict, Any
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from make_mini_config import MiniConfigGenerator  # noqa: E402
+
+BASE_CONFIG = ROOT / "configs" / "model" / "oracle850b.moe.json"
+
+
+def add_mini_args(parser: argparse.ArgumentParser):
+    """Добавить аргументы мини-конфига (по умолчанию как в runpod_bootstrap)"""
+    parser.add_argument("--base-config", default=str(BASE_CONFIG), help="Базовый конфиг модели")
+    parser.add_argument("--layers", type=int, default=8, help="Количество слоёв")
+    parser.add_argument("--d-model", type=int, default=1024, help="Размер модели")
+    parser.add_argument("--heads", type=int, default=8, help="Количество голов")
+    parser.add_argument("--ff", type=int, default=4096, help="Размер FF слоя")
+    parser.add_argument("--experts", type=int, default=8, help="Количество экспертов")
+    parser.add_argument("--topk", type=int, default=2, help="Top-K роутер")
+    parser.add_argument("--vocab-size", type=int, default=None, help="Переопределить размер словаря")
+
+
+def build_mini_config(args: argparse.Namespace) -> Dict[str, Any]:
+    """Собрать мини-конфиг тем же генератором, что и make_mini_config.py"""
+    generator = MiniConfigGenerator()
+    base_config = json.loads(json.dumps(generator.load_base_config(Path(args.base_config))))
+
+    config = generator.generate_mini_config(
+        base_config,
+        layers=args.layers,
+        d_model=args.d_model,
+        heads=args.heads,
+        ff=args.ff,
+        experts=args.experts,
+        topk=args.topk
+    )
+    if args.vocab_size is not None:
+        config["vocab_size"] = args.vocab_size
+
+    return config
@@ -1,48 +1,142 @@
 #!/usr/bin/env python3
 """
-quantize_awq.py - AWQ/INT4 quantization pipeline template for Oracle850B-MoE.
+quantize_awq.py - Weight-only INT8/INT4 quantization of Oracle850B-MoE experts.
 
-Quantization pipeline after having weights (code without execution).
+Converts the MoE expert projections (w1/w2/w3) of every safetensors shard:
+    int8 - symmetric, one scale per output channel
+    int4 - symmetric, one scale per group of input channels, two values per byte
+
+Each `...experts.N.wX.weight` is replaced by `...experts.N.wX.qweight` and
+`...experts.N.wX.scales`, matching QuantizedLinear buffers, so a model prepared
+with `quantize_moe_experts(model, bits)` loads the shards directly. All other
+tensors are copied unchanged. This is round-to-nearest quantization; AWQ-style
+activation-aware scaling needs calibration data and is not applied here.
+
+Non-weight files of the checkpoint (config.json, tokenizer/, default prompts)
+are copied next to the quantized shards, so the output directory can be passed
+to TorchBackend.from_pretrained as is.
 
 Usage:
-    # After getting weights and Pro tier
-    python scripts/weights/quantize_awq.py --ckpt_dir checkpoints/oracle850b
+    python scripts/weights/quantize_awq.py --ckpt_dir checkpoints/oracle850b --bits 4 --group_size 128
 """
 
-import os
+import argparse
+import json
+import shutil
 import sys
 from pathlib import Path
 
+from safetensors.torch import load_file, save_file
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+from oracle.moe850b.modeling.quantization import quantize_expert_state  # noqa: E402
 
-def quantize_model(ckpt_path: Path, output_path: Path):
+
+def quantize_shard(shard_path: Path, output_path: Path, bits: int, group_size: int) -> dict:
     """
-    AWQ quantization template.
+    Quantizes expert weights of a single shard.
 
     Args:
-        ckpt_path: Path to source weights.
-        output_path: Path for quantized weights.
+        shard_path: Source safetensors shard.
+        output_path: Destination shard.
+        bits: 8 or 4.
+        group_size: Group size for int4.
+
+    Returns:
+        Statistics for the shard.
     """
-    # Template for quantization code
-    print(f"Quantizing {ckpt_path} -> {output_path}")
+    state = load_file(str(shard_path))
+    quantized = quantize_expert_state(state, bits=bits, group_size=group_size)
+    save_file({k: v.contiguous() for k, v in quantized.items()}, str(output_path),
+              metadata={"format": "pt", "quantization": f"int{bits}"})
 
-    # Quantization steps (template):
-    # 1. Load model
-    # 2. Apply AWQ algorithm
-    # 3. Save INT4 weights
+    return {
+        "keys": list(quantized.keys()),
+        "bytes_in": sum(t.numel() * t.element_size() for t in state.values()),
+        "bytes_out": sum(t.numel() * t.element_size() for t in quantized.values()),
+    }
 
-    # Mock implementation
-    output_path.mkdir(exist_ok=True)
-    print("Quantization completed (template)")
 
-    # In reality:
-    # from autoawq import AutoAWQForCausalLM
-    # model = AutoAWQForCausalLM.from_pretrained(ckpt_path)
-    # model.quantize(quant_config)
-    # model.save_quantized(output_path)
+def copy_model_files(ckpt_path: Path, output_path: Path, shard_files: list) -> list:
+    """
+    Copies everything except the weights (config, tokenizer, prompts) to the output.
+
+    Args:
+        ckpt_path: Path to source weights.
+        output_path: Path for quantized weights.
+        shard_files: Source shards, already written quantized.
+
+    Returns:
+        Names of the copied files and directories.
+    """
+    skip = {shard.name for shard in shard_files} | {"model.safetensors.index.json", "quantization_config.json"}
+    copied = []
+    for item in sorted(ckpt_path.iterdir()):
+        if item.name in skip or item.resolve() == output_path.resolve():
+            continue
+        if item.is_dir():
+            shutil.copytree(item, output_path / item.name, dirs_exist_ok=True)
+        else:
+            shutil.copy2(item, output_path / item.name)
+        copied.append(item.name)
+    return copied
+
+
+def quantize_model(ckpt_path: Path, output_path: Path, bits: int = 4, group_size: int = 128):
+    """
+    Weight-only quantization of all shards in a checkpoint directory.
+
+    Args:
+        ckpt_path: Path to source weights.
+        output_path: Path for quantized weights.
+        bits: 8 or 4.
+        group_size: Group size for int4.
+    """
+    shard_files = sorted(ckpt_path.glob("model-*-of-*.safetensors"))
+    if not shard_files:
+        shard_files = sorted(ckpt_path.glob("*.safetensors"))
+    if not shard_files:
+        raise FileNotFoundError(f"No safetensors shards in {ckpt_path}")
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    print(f"Quantizing {ckpt_path} -> {output_path} (int{bits}, group_size={group_size})")
+
+    weight_map = {}
+    bytes_in = bytes_out = 0
+    for shard_file in shard_files:
+        stats = quantize_shard(shard_file, output_path / shard_file.name, bits, group_size)
+        for key in stats["keys"]:
+            weight_map[key] = shard_file.name
+        bytes_in += stats["bytes_in"]
+        bytes_out += stats["bytes_out"]
+        print(f"  {shard_file.name}: {stats['bytes_in'] / 2**20:.1f} MiB -> {stats['bytes_out'] / 2**20:.1f} MiB")
+
+    index = {"metadata": {"total_size": bytes_out}, "weight_map": weight_map}
+    with open(output_path / "model.safetensors.index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+
+    quant_config = {
+        "quant_method": "weight_only_rtn",
+        "bits": bits,
+        "group_size": group_size if bits == 4 else None,
+        "symmetric": True,
+        "modules": ["experts.*.w1", "experts.*.w2", "experts.*.w3"],
+    }
+    with open(output_path / "quantization_config.json", "w", encoding="utf-8") as f:
+        json.dump(quant_config, f, indent=2)
+
+    copied = copy_model_files(ckpt_path, output_path, shard_files)
+    if "config.json" not in copied:
+        print(f"  Warning: no config.json in {ckpt_path}, copy it before loading {output_path}")
+    print(f"  Copied: {', '.join(copied) or '-'}")
+
+    print(f"Total: {bytes_in / 2**30:.2f} GiB -> {bytes_out / 2**30:.2f} GiB "
+          f"({bytes_in / max(bytes_out, 1):.2f}x)")
 
 
 def main():
-    parser = argparse.ArgumentParser(description="AWQ quantization (template)")
+    parser = argparse.ArgumentParser(description="Weight-only INT8/INT4 quantization of MoE experts")
     parser.add_argument(
         "--ckpt_dir",
         type=str,
@@ -55,6 +149,19 @@ def main():
         default="checkpoints/oracle850b-awq",
         help="Path for quantized weights",
     )
+    parser.add_argument(
+        "--bits",
+        type=int,
+        choices=[8, 4],
+        default=4,
+        help="Quantization bit width",
+    )
+    parser.add_argument(
+        "--group_size",
+        type=int,
+        default=128,
+        help="Input-channel group size for int4",
+    )
     args = parser.parse_args()
 
     ckpt_path = Path(args.ckpt_dir)
@@ -65,7 +172,7 @@ def main():
         sys.exit(1)
 
     try:
-        quantize_model(ckpt_path, output_path)
+        quantize_model(ckpt_path, output_path, args.bits, args.group_size)
         print(f"Quantized model saved to {output_path}")
         return 0
     except Exception as e:
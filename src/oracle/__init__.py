@@ -9,5 +9,3 @@ __author__ = "MagistrTheOne|Краснодар|2025"
 # Импорты для обратной совместимости
 from .core import *
 from .moe850b import *
-from .serve import *
-from .tokenization import *
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Admission Control
+Бюджет токенов в работе: ограниченное ожидание допуска и 429 при перегрузке
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .backends import PRIORITY_CLASSES, Sequence
+from . import metrics
+
+
+class AdmissionRejected(Exception):
+    """Сервер перегружен: запрос не допущен (HTTP 429)"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Допуск запроса; release идемпотентен (вызывается из нескольких мест стрима)"""
+
+    def __init__(self, controller: "AdmissionController", cost: int, priority: str):
+        self.controller = controller
+        self.cost = cost
+        self.priority = priority
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.cost, self.priority)
+
+
+class AdmissionController:
+    """Допуск запросов по бюджету токенов (промпт + max_tokens).
+
+    Пока сумма оценок запросов в работе меньше max_inflight_tokens, запрос
+    допускается сразу. Иначе он ждёт в FIFO не дольше max_wait секунд; при
+    переполнении очереди ожидания или по таймауту — AdmissionRejected с
+    рекомендуемым Retry-After. Запрос дороже всего бюджета допускается,
+    когда сервер пуст, иначе он ждал бы вечно.
+
+    Ожидающие обслуживаются по классам приоритета (interactive раньше
+    batch), а класс может быть ограничен долей бюджета (class_fractions),
+    чтобы поток batch-запросов не выбирал его целиком.
+
+    Работает в event loop, блокировки не нужны.
+    """
+
+    def __init__(self, max_inflight_tokens: int, max_wait: float = 10.0, max_queue: int = 256,
+                 class_fractions: Optional[Dict[str, float]] = None):
+        self.max_inflight_tokens = max_inflight_tokens
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.class_fractions = dict(class_fractions or {})
+        self.inflight_tokens = 0
+        self.inflight_by_class = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._waiters: Dict[str, Deque[Tuple[int, asyncio.Future]]] = {p: deque() for p in PRIORITY_CLASSES}
+
+    @staticmethod
+    def estimate(seq: Sequence) -> int:
+        """Оценка стоимости запроса в токенах: весь промпт и максимум ответа"""
+        return len(seq.prompt_ids) + seq.sampling.max_tokens
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    @property
+    def pressure(self) -> float:
+        """Доля бюджета, занятая запросами в работе"""
+        return self.inflight_tokens / self.max_inflight_tokens
+
+    @property
+    def ready(self) -> bool:
+        """Готов принимать: никто не ждёт допуска и бюджет не исчерпан"""
+        return not self.queue_depth and self.inflight_tokens < self.max_inflight_tokens
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    async def acquire(self, seq: Sequence) -> AdmissionTicket:
+        """Дождаться допуска запроса или отказать"""
+        return await self._acquire(self.estimate(seq), seq.priority)
+
+    async def acquire_batch(self, seqs: List[Sequence]) -> AdmissionTicket:
+        """Допуск пакетного запроса (/v1/completions, /v1/embeddings) одним местом в очереди.
+
+        Стоимость — сумма оценок входов, но не больше бюджета: пакет любого
+        размера ждёт один раз, а не по входу, и не упирается в max_queue.
+        """
+        cost = min(sum(self.estimate(seq) for seq in seqs), self.max_inflight_tokens)
+        return await self._acquire(cost, seqs[0].priority)
+
+    async def _acquire(self, cost: int, priority: str) -> AdmissionTicket:
+        ahead = PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1]
+        if not any(self._waiters[p] for p in ahead) and self._fits(cost, priority):
+            self._take(cost, priority)
+            self._update_gauges()
+            return AdmissionTicket(self, cost, priority)
+
+        if self.queue_depth >= self.max_queue:
+            metrics.ADMISSION_REJECTED.labels("queue_full").inc()
+            raise AdmissionRejected("Сервер перегружен: очередь допуска заполнена", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (cost, future)
+        self._waiters[priority].append(waiter)
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Допуск выдан одновременно с таймаутом/отменой: вернуть бюджет
+                self.release(cost, priority)
+            else:
+                future.cancel()
+                self._waiters[priority].remove(waiter)
+                self._wake()
+            self._update_gauges()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            metrics.ADMISSION_REJECTED.labels("timeout").inc()
+            raise AdmissionRejected(
+                f"Сервер перегружен: нет допуска за {self.max_wait:.0f} с", self.retry_after()
+            ) from None
+        metrics.ADMISSION_WAIT_TIME.labels(priority).observe(time.perf_counter() - start)
+        return AdmissionTicket(self, cost, priority)
+
+    def release(self, cost: int, priority: str):
+        """Вернуть бюджет завершённого запроса и допустить ожидающих"""
+        self.inflight_tokens -= cost
+        self.inflight_by_class[priority] -= cost
+        self._wake()
+        self._update_gauges()
+
+    def _fits(self, cost: int, priority: str) -> bool:
+        if self.inflight_tokens + cost > self.max_inflight_tokens and self.inflight_tokens > 0:
+            return False
+        limit = self.class_fractions.get(priority, 1.0) * self.max_inflight_tokens
+        used = self.inflight_by_class[priority]
+        return used + cost <= limit or used == 0
+
+    def _take(self, cost: int, priority: str):
+        self.inflight_tokens += cost
+        self.inflight_by_class[priority] += cost
+
+    def _wake(self):
+        """Допустить ожидающих по порядку классов; заблокированная голова класса держит низшие"""
+        for priority in PRIORITY_CLASSES:
+            waiters = self._waiters[priority]
+            while waiters and self._fits(waiters[0][0], priority):
+                cost, future = waiters.popleft()
+                self._take(cost, priority)
+                future.set_result(None)
+            if waiters:
+                return
+
+    def _update_gauges(self):
+        metrics.ADMISSION_INFLIGHT_TOKENS.set(self.inflight_tokens)
+        metrics.ADMISSION_QUEUE_DEPTH.set(self.queue_depth)
+
+
+def create_admission_controller(max_batch_size: int) -> AdmissionController:
+    """Контроллер из окружения; бюджет по умолчанию — два полных батча по ORACLE_MAX_SEQ_LEN"""
+    default_budget = 2 * max_batch_size * int(os.environ.get("ORACLE_MAX_SEQ_LEN", 4096))
+    return AdmissionController(
+        int(os.environ.get("ORACLE_MAX_INFLIGHT_TOKENS", default_budget)),
+        max_wait=float(os.environ.get("ORACLE_ADMISSION_TIMEOUT", 10.0)),
+        max_queue=int(os.environ.get("ORACLE_ADMISSION_QUEUE", 256)),
+        class_fractions={"batch": float(os.environ.get("ORACLE_BATCH_TOKEN_FRACTION", 0.75))}
+    )
@@ -6,15 +6,35 @@ Author: MagistrTheOne|Краснодар|2025
 """
 
 import os
+import sys
 import json
+import time
+import uuid
 import asyncio
-from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Union
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 
+# Запуск скриптом (python src/oracle/core/serve/app_fastapi.py): src в sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from oracle.core.serve.admission import AdmissionRejected, AdmissionTicket, create_admission_controller  # noqa: E402
+from oracle.core.serve.backends import InferenceBackend, SamplingParams, Sequence, create_backend  # noqa: E402
+from oracle.core.serve.engine import InferenceEngine  # noqa: E402
+from oracle.core.serve import metrics  # noqa: E402
+from oracle.core.serve.metrics import MetricsMiddleware, render_metrics  # noqa: E402
+from oracle.core.serve.prefix_cache import PrefixCache  # noqa: E402
+from oracle.core.serve.response_cache import CachedResponse, ResponseCache  # noqa: E402
+from oracle.core.serve.structured_output import StructuredOutputCompiler, TokenAutomaton  # noqa: E402
+from oracle.core.serve.tokenizer import IncrementalDetokenizer, MessageTokenCache  # noqa: E402
+from oracle.core.serve.tokenizer_pool import TokenizerPool  # noqa: E402
+
 
 # Модели запросов/ответов
 class ChatMessage(BaseModel):
@@ -28,6 +48,13 @@ class ChatCompletionRequest(BaseModel):
     max_tokens: Optional[int] = Field(default=2048, description="Максимум токенов")
     temperature: Optional[float] = Field(default=0.7, description="Температура")
     top_p: Optional[float] = Field(default=0.9, description="Top-p")
+    top_k: Optional[int] = Field(default=None, description="Top-k (0 или None — без ограничения)")
+    presence_penalty: Optional[float] = Field(default=0.0, description="Штраф за уже сгенерированные токены")
+    repetition_penalty: Optional[float] = Field(default=1.0, description="Штраф повторов промпта и ответа (> 1)")
+    stop: Optional[Union[str, List[str]]] = Field(default=None, description="Stop-последовательности (до 4)")
+    response_format: Optional[Dict[str, Any]] = Field(
+        default=None, description="Формат ответа: text, json_object, json_schema или regex (ограниченное декодирование)"
+    )
     stream: Optional[bool] = Field(default=False, description="Стриминг")
 
 
@@ -40,14 +67,75 @@ class ChatCompletionResponse(BaseModel):
     usage: Dict[str, int]
 
 
+class CompletionRequest(BaseModel):
+    model: str = Field(default="oracle850b-moe", description="Модель")
+    prompt: Union[str, List[str]] = Field(..., description="Промпт или список промптов")
+    max_tokens: Optional[int] = Field(default=16, description="Максимум токенов на промпт")
+    temperature: Optional[float] = Field(default=0.7, description="Температура")
+    top_p: Optional[float] = Field(default=0.9, description="Top-p")
+    top_k: Optional[int] = Field(default=None, description="Top-k (0 или None — без ограничения)")
+    presence_penalty: Optional[float] = Field(default=0.0, description="Штраф за уже сгенерированные токены")
+    repetition_penalty: Optional[float] = Field(default=1.0, description="Штраф повторов промпта и ответа (> 1)")
+    stop: Optional[Union[str, List[str]]] = Field(default=None, description="Stop-последовательности (до 4)")
+    response_format: Optional[Dict[str, Any]] = Field(
+        default=None, description="Формат ответа: text, json_object, json_schema или regex (ограниченное декодирование)"
+    )
+
+
+class CompletionResponse(BaseModel):
+    id: str
+    object: str = "text_completion"
+    created: int
+    model: str
+    choices: List[Dict[str, Any]]
+    usage: Dict[str, int]
+
+
+class EmbeddingRequest(BaseModel):
+    model: str = Field(default="oracle850b-moe", description="Модель")
+    input: Union[str, List[str]] = Field(..., description="Текст или список текстов")
+
+
+class EmbeddingResponse(BaseModel):
+    object: str = "list"
+    model: str
+    data: List[Dict[str, Any]]
+    usage: Dict[str, int]
+
+
 class Oracle850BServer:
     """Сервер Oracle850B с авто-инжектом системных токенов"""
     
-    def __init__(self, model_path: str = "checkpoints/oracle850b"):
-        self.model_path = Path(model_path)
+    def __init__(self, model_path: Optional[str] = None, backend: Optional[InferenceBackend] = None):
+        self.model_path = Path(model_path or os.environ.get("MODEL_PATH", "checkpoints/oracle850b"))
         self.default_system = self._load_default_system()
         self.default_intro = self._load_default_intro()
         
+        # Бэкенд генерации (ORACLE_BACKEND: deterministic | torch) и очередь перед ним
+        self.backend = backend or create_backend(model_path=self.model_path)
+        self.tokenizer = self.backend.tokenizer
+        self.engine = InferenceEngine(self.backend)
+        # Допуск по бюджету токенов: при перегрузке 429 вместо бесконечной очереди
+        self.admission = create_admission_controller(self.backend.max_batch_size)
+        
+        # Системный префикс одинаков у большинства запросов: токены и KV считаются один раз
+        self.prefix_cache = PrefixCache(self.tokenizer, int(os.environ.get("ORACLE_PREFIX_CACHE_SIZE", 8)))
+        # История чата приходит целиком на каждом ходе: токены сообщений кэшируются по хэшу
+        self.message_cache = MessageTokenCache(self.tokenizer)
+        # Токенизация вне event loop
+        self.tokenizer_pool = TokenizerPool(self.tokenizer, int(os.environ.get("ORACLE_TOKENIZER_WORKERS", 2)))
+        # Готовые ответы greedy-запросов (ORACLE_RESPONSE_CACHE_SIZE=0 — кэш выключен)
+        response_cache_size = int(os.environ.get("ORACLE_RESPONSE_CACHE_SIZE", 0))
+        self.response_cache = ResponseCache(
+            response_cache_size, float(os.environ.get("ORACLE_RESPONSE_CACHE_TTL", 600))
+        ) if response_cache_size > 0 else None
+        # response_format -> автомат с масками токенов, LRU по схеме/regex
+        self.structured_output = StructuredOutputCompiler(
+            self.tokenizer, self.backend.vocab_size, int(os.environ.get("ORACLE_STRUCTURED_CACHE_SIZE", 32))
+        )
+        # Входов в одном запросе /v1/completions и /v1/embeddings
+        self.max_batch_inputs = int(os.environ.get("ORACLE_MAX_BATCH_INPUTS", 2048))
+        
     def _load_default_system(self) -> str:
         """Загрузить системный промпт по умолчанию"""
         system_file = self.model_path / "default_system.txt"
@@ -62,8 +150,12 @@ class Oracle850BServer:
             return intro_file.read_text(encoding="utf-8").strip()
         return "Привет! Я Oracle850B, готова помочь с вашими задачами."
     
+    def _intro(self) -> str:
+        return f"<|oracle_intro|>{self.default_intro}\n\n"
+    
     def _inject_system_tokens(self, messages: List[ChatMessage]) -> List[ChatMessage]:
-        """Авто-инжект системных токенов Oracle850B"""
+        """Авто-инжект системных токенов Oracle850B (сообщения запроса не изменяются)"""
+        messages = list(messages)
         
         # Проверить, есть ли системное сообщение
         has_system = any(msg.role == "system" for msg in messages)
@@ -77,23 +169,204 @@ class Oracle850BServer:
             messages = [system_msg] + messages
         
         # Добавить вводный токен к первому пользовательскому сообщению
-        if messages and messages[0].role == "user":
-            messages[0].content = f"<|oracle_intro|>{self.default_intro}\n\n{messages[0].content}"
+        for i, msg in enumerate(messages):
+            if msg.role == "user":
+                messages[i] = ChatMessage(role="user", content=self._intro() + msg.content)
+                break
         
         return messages
     
-    async def generate_response(self, request: ChatCompletionRequest) -> ChatCompletionResponse:
-        """Генерация ответа (мок-реализация для dry-run)"""
+    def _build_prompt(self, messages: List[ChatMessage]) -> Tuple[str, List[str]]:
+        """Чат-шаблон: "<role>: <content>" построчно и реплика ассистента в конце.
+        
+        Возвращает общий префикс (ведущие системные сообщения и intro первой
+        реплики) и остальной текст по сообщениям; вместе они дают промпт.
+        """
+        segments = [f"{msg.role}: {msg.content}\n" for msg in messages] + ["assistant: "]
         
+        num_system = 0
+        while messages[num_system:] and messages[num_system].role == "system":
+            num_system += 1
+        prefix = "".join(segments[:num_system])
+        segments = segments[num_system:]
+        
+        intro = f"user: {self._intro()}"
+        if messages[num_system:] and messages[num_system].role == "user" and segments[0].startswith(intro):
+            prefix += intro
+            segments[0] = segments[0][len(intro):]
+        return prefix, segments
+    
+    def _compile_constraints(self, request: Union[ChatCompletionRequest, CompletionRequest]
+                             ) -> Tuple[List[List[int]], Optional[TokenAutomaton]]:
+        """Токены stop-строк и автомат response_format (блокирующе — вызывать в пуле токенизации)"""
+        stop = [request.stop] if isinstance(request.stop, str) else list(request.stop or [])
+        if len(stop) > 4:
+            raise ValueError(f"Не больше 4 stop-последовательностей, получено {len(stop)}")
+        return ([self.tokenizer.encode(text) for text in stop if text],
+                self.structured_output.compile(request.response_format))
+    
+    def _sampling_params(self, request: Union[ChatCompletionRequest, CompletionRequest],
+                         stop_token_ids: List[List[int]], constraint: Optional[TokenAutomaton],
+                         default_max_tokens: int = 2048) -> SamplingParams:
+        """Параметры генерации из запроса (None -> значения по умолчанию), stop и автомат — из пула"""
+        return SamplingParams(
+            max_tokens=request.max_tokens or default_max_tokens,
+            temperature=request.temperature if request.temperature is not None else 0.7,
+            top_p=request.top_p if request.top_p is not None else 1.0,
+            top_k=request.top_k or 0,
+            presence_penalty=request.presence_penalty or 0.0,
+            repetition_penalty=request.repetition_penalty if request.repetition_penalty is not None else 1.0,
+            stop_token_ids=stop_token_ids,
+            constraint=constraint
+        )
+    
+    def _response_cache_key(self, request: ChatCompletionRequest) -> Optional[str]:
+        """Ключ по сырым полям запроса: без токенизации stop и компиляции response_format в event loop"""
+        if self.response_cache is None:
+            return None
+        sampling = request.model_dump(include={"max_tokens", "temperature", "top_p", "top_k", "presence_penalty",
+                                               "repetition_penalty", "stop", "response_format"})
+        return ResponseCache.make_key(request.model, request.messages, sampling)
+    
+    def cached_response(self, request: ChatCompletionRequest) -> Optional[CachedResponse]:
+        """Готовый ответ из кэша (только temperature=0) — без токенизации, допуска и планировщика"""
+        key = self._response_cache_key(request)
+        return self.response_cache.get(key) if key is not None else None
+    
+    def _store_response(self, request: ChatCompletionRequest, seq: Sequence, text: str):
+        key = self._response_cache_key(request)
+        if key is not None and seq.error is None and seq.finish_reason in ("stop", "length"):
+            self.response_cache.put(key, CachedResponse(seq.output_ids, text, seq.finish_reason,
+                                                        len(seq.prompt_ids)))
+    
+    async def prepare_sequence(self, request: ChatCompletionRequest, priority: str = "interactive",
+                               tenant: str = "default") -> Sequence:
+        """Промпт с системными токенами -> Sequence для движка (токенизация в пуле потоков)"""
+        return await self.tokenizer_pool.run("encode", self._tokenize_request, request, priority, tenant)
+    
+    def _tokenize_request(self, request: ChatCompletionRequest, priority: str, tenant: str) -> Sequence:
         # Инжект системных токенов
         messages = self._inject_system_tokens(request.messages)
+        prefix_text, segments = self._build_prompt(messages)
+        
+        prefix = self.prefix_cache.get(prefix_text)
+        if self.tokenizer.splits_exactly:
+            # Префикс токенизируется (и проходит prefill) один раз, сообщения — по хэшу
+            if prefix is None:
+                segments = [prefix_text] + segments
+            prompt_ids = list(prefix.token_ids) if prefix is not None else []
+            for ids in self.message_cache.encode(segments):
+                prompt_ids.extend(ids)
+        else:
+            # BPE меняет токены на границах фрагментов: промпт кодируется целиком,
+            # KV префикса используется, только если его токены — начало промпта
+            prompt_ids = self.tokenizer.encode(prefix_text + "".join(segments))
+            if prefix is not None and prompt_ids[:len(prefix)] != prefix.token_ids:
+                prefix = None
+        sampling = self._sampling_params(request, *self._compile_constraints(request))
+        return Sequence(prompt_ids, sampling, prefix=prefix,
+                        priority=priority, tenant=tenant)
+    
+    async def _submit(self, seq: Sequence) -> Sequence:
+        """Допуск по бюджету токенов и генерация через очередь движка"""
+        ticket = await self.admission.acquire(seq)
+        try:
+            return await self.engine.submit(seq)
+        finally:
+            ticket.release()
+    
+    async def _submit_all(self, seqs: List[Sequence]) -> List[Sequence]:
+        """Все последовательности пакета одновременно в очередь движка.
         
-        # Мок-ответ для dry-run
-        response_content = f"Мок-ответ Oracle850B для: {messages[-1].content[:100]}..."
+        Пакет проходит допуск одним билетом (стоимость ограничена бюджетом),
+        поэтому пакет больше бюджета не получает 429 на пустом сервере, а
+        дальше его входы дозируются бюджетом токенов шага планировщика.
+        При первой ошибке остальные отменяются и освобождают места в батче.
+        """
+        ticket = await self.admission.acquire_batch(seqs)
+        tasks = [asyncio.ensure_future(self.engine.submit(seq)) for seq in seqs]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            ticket.release()
+    
+    async def _encode_inputs(self, inputs: Union[str, List[str]], endpoint: str) -> List[List[int]]:
+        """Тексты пакетного запроса -> id токенов (один вызов encode_batch в пуле)"""
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        if not texts:
+            raise ValueError("Пустой список входов")
+        if len(texts) > self.max_batch_inputs:
+            raise ValueError(f"Слишком много входов: {len(texts)} (максимум {self.max_batch_inputs})")
+        metrics.BATCH_REQUEST_INPUTS.labels(endpoint).observe(len(texts))
+        return await self.tokenizer_pool.encode_batch(texts)
+    
+    async def complete(self, request: CompletionRequest, priority: str = "interactive",
+                       tenant: str = "default") -> CompletionResponse:
+        """Completions: продолжение каждого промпта как есть, без чат-шаблона и системных токенов"""
+        ids_batch = await self._encode_inputs(request.prompt, "completions")
+        stop_token_ids, constraint = await self.tokenizer_pool.run("encode", self._compile_constraints, request)
+        seqs = [Sequence(ids, self._sampling_params(request, stop_token_ids, constraint, default_max_tokens=16),
+                         priority=priority, tenant=tenant) for ids in ids_batch]
+        seqs = await self._submit_all(seqs)
+        texts = await self.tokenizer_pool.decode_batch([seq.output_ids for seq in seqs])
+        
+        prompt_tokens = sum(len(seq.prompt_ids) for seq in seqs)
+        completion_tokens = sum(len(seq.output_ids) for seq in seqs)
+        return CompletionResponse(
+            id=f"cmpl-{uuid.uuid4().hex}",
+            created=int(time.time()),
+            model=request.model,
+            choices=[{"index": i, "text": text, "logprobs": None, "finish_reason": seq.finish_reason}
+                     for i, (seq, text) in enumerate(zip(seqs, texts))],
+            usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        )
+    
+    async def embed(self, request: EmbeddingRequest, priority: str = "interactive",
+                    tenant: str = "default") -> EmbeddingResponse:
+        """Embeddings: усреднённые финальные hidden states модели по каждому входу"""
+        ids_batch = await self._encode_inputs(request.input, "embeddings")
+        seqs = [Sequence(ids, SamplingParams(max_tokens=1, temperature=0.0),
+                         priority=priority, tenant=tenant, task="embed") for ids in ids_batch]
+        seqs = await self._submit_all(seqs)
         
+        prompt_tokens = sum(len(seq.prompt_ids) for seq in seqs)
+        return EmbeddingResponse(
+            model=request.model,
+            data=[{"object": "embedding", "index": i, "embedding": seq.embedding} for i, seq in enumerate(seqs)],
+            usage={"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+        )
+    
+    async def generate_response(self, request: ChatCompletionRequest, priority: str = "interactive",
+                                tenant: str = "default") -> ChatCompletionResponse:
+        """Генерация ответа через очередь движка и бэкенд (или из кэша ответов)"""
+        cached = self.cached_response(request)
+        if cached is not None:
+            return self._chat_response(request, cached.text, cached.finish_reason,
+                                       cached.prompt_tokens, len(cached.output_ids))
+        seq = await self.prepare_sequence(request, priority, tenant)
+        seq = await self._submit(seq)
+        response_content = await self.tokenizer_pool.decode(seq.output_ids)
+        self._store_response(request, seq, response_content)
+        return self._chat_response(request, response_content, seq.finish_reason,
+                                   len(seq.prompt_ids), len(seq.output_ids))
+    
+    async def build_response(self, request: ChatCompletionRequest, seq: Sequence) -> ChatCompletionResponse:
+        """chat.completion по завершённой последовательности (детокенизация в пуле потоков)"""
+        response_content = await self.tokenizer_pool.decode(seq.output_ids)
+        return self._chat_response(request, response_content, seq.finish_reason,
+                                   len(seq.prompt_ids), len(seq.output_ids))
+    
+    def _chat_response(self, request: ChatCompletionRequest, response_content: str, finish_reason: str,
+                       prompt_tokens: int, completion_tokens: int) -> ChatCompletionResponse:
         return ChatCompletionResponse(
-            id="oracle-850b-mock-001",
-            created=int(asyncio.get_event_loop().time()),
+            id=f"chatcmpl-{uuid.uuid4().hex}",
+            created=int(time.time()),
             model=request.model,
             choices=[{
                 "index": 0,
@@ -101,21 +374,88 @@ class Oracle850BServer:
                     "role": "assistant",
                     "content": response_content
                 },
-                "finish_reason": "stop"
+                "finish_reason": finish_reason
             }],
             usage={
-                "prompt_tokens": sum(len(msg.content.split()) for msg in messages),
-                "completion_tokens": len(response_content.split()),
-                "total_tokens": 0
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
             }
         )
+    
+    async def stream_response(self, request: ChatCompletionRequest, seq: Optional[Sequence] = None,
+                              ticket: Optional[AdmissionTicket] = None,
+                              cached: Optional[CachedResponse] = None) -> AsyncIterator[str]:
+        """SSE-поток chat.completion.chunk с терминатором [DONE].
+        
+        Текст детокенизируется инкрементально (только окно после последней
+        выданной границы): хвост с неполным UTF-8 символом придерживается до
+        следующей порции токенов. С cached поток воспроизводится из кэша
+        ответов в том же формате, seq не нужен.
+        """
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        
+        def event(delta: Dict[str, str], finish_reason: Optional[str] = None) -> str:
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        
+        yield event({"role": "assistant"})
+        
+        detokenizer = IncrementalDetokenizer(self.tokenizer)
+        token_chunks = cached.replay() if cached is not None else self.engine.stream(seq)
+        text = []
+        try:
+            async for new_ids in token_chunks:
+                delta = detokenizer.add(new_ids)
+                if delta:
+                    text.append(delta)
+                    yield event({"content": delta})
+        except Exception as e:
+            error = {"error": {"message": str(e), "type": type(e).__name__}}
+            yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+            return
+        finally:
+            if ticket is not None:
+                ticket.release()
+        
+        delta = detokenizer.flush()
+        if delta:
+            text.append(delta)
+            yield event({"content": delta})
+        if cached is not None:
+            yield event({}, cached.finish_reason)
+        else:
+            self._store_response(request, seq, "".join(text))
+            yield event({}, seq.finish_reason)
+        yield "data: [DONE]\n\n"
+
+
+# Инициализация сервера
+server = Oracle850BServer()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка фоновой задачи движка"""
+    server.engine.start()
+    yield
+    await server.engine.stop()
 
 
 # Инициализация приложения
 app = FastAPI(
     title="Oracle850B API",
     description="OpenAI-совместимый API для Oracle850B (MoE)",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -127,9 +467,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Инициализация сервера
-server = Oracle850BServer()
-
+# Метрики HTTP (счётчики и длительность по маршрутам)
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 async def root():
@@ -159,26 +498,113 @@ async def list_models():
     }
 
 
+def _request_class(http_request: Request, default_priority: str = "interactive") -> Tuple[str, str]:
+    """Класс приоритета (заголовок X-Priority) и арендатор (API-ключ из Authorization)"""
+    priority = http_request.headers.get("x-priority", default_priority).lower()
+    scheme, _, api_key = http_request.headers.get("authorization", "").partition(" ")
+    tenant = api_key.strip() if scheme.lower() == "bearer" and api_key.strip() else "anonymous"
+    return priority, tenant
+
+
 @app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
-async def chat_completions(request: ChatCompletionRequest):
-    """Chat Completions API (OpenAI-совместимый)"""
+async def chat_completions(request: ChatCompletionRequest, http_request: Request):
+    """Chat Completions API (OpenAI-совместимый, stream=true -> SSE)"""
+    priority, tenant = _request_class(http_request)
     try:
-        response = await server.generate_response(request)
+        if request.stream:
+            cached = server.cached_response(request)
+            seq = ticket = None
+            if cached is None:
+                seq = await server.prepare_sequence(request, priority, tenant)
+                ticket = await server.admission.acquire(seq)
+            return StreamingResponse(
+                server.stream_response(request, seq, ticket, cached),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                # Генератор может не стартовать, если клиент отключился сразу
+                background=BackgroundTask(ticket.release) if ticket is not None else None
+            )
+        response = await server.generate_response(request, priority, tenant)
         return response
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+
+def _batch_priority(inputs: Union[str, List[str]]) -> str:
+    """Пакетные вызовы по умолчанию идут классом batch, одиночные — interactive"""
+    return "batch" if not isinstance(inputs, str) and len(inputs) > 1 else "interactive"
+
+
+@app.post("/v1/completions", response_model=CompletionResponse)
+async def completions(request: CompletionRequest, http_request: Request):
+    """Completions API (OpenAI-совместимый): список промптов за один вызов"""
+    priority, tenant = _request_class(http_request, _batch_priority(request.prompt))
+    try:
+        return await server.complete(request, priority, tenant)
+    except Exception as e:
+        raise _http_error(e)
+
+
+@app.post("/v1/embeddings", response_model=EmbeddingResponse)
+async def embeddings(request: EmbeddingRequest, http_request: Request):
+    """Embeddings API (OpenAI-совместимый): пулинг hidden states, общий планировщик с генерацией"""
+    priority, tenant = _request_class(http_request, _batch_priority(request.input))
+    try:
+        return await server.embed(request, priority, tenant)
+    except Exception as e:
+        raise _http_error(e)
+
+
+def _http_error(e: Exception) -> HTTPException:
+    """Исключение обработчика -> HTTP-ответ: 429 при перегрузке, 400 для неверного запроса"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AdmissionRejected):
+        return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, ValueError):
+        return HTTPException(status_code=400, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+
+def _readiness() -> Dict[str, Any]:
+    admission = server.admission
+    return {
+        "ready": admission.ready,
+        "inflight_tokens": admission.inflight_tokens,
+        "max_inflight_tokens": admission.max_inflight_tokens,
+        "pressure": round(admission.pressure, 3),
+        "admission_queue": admission.queue_depth,
+        "engine_queue": server.engine.scheduler.queue_depth,
+        "running": server.engine.scheduler.num_running
+    }
 
 
 @app.get("/health")
 async def health_check():
-    """Проверка здоровья сервера"""
+    """Проверка здоровья сервера (liveness) и нагрузка очереди"""
+    readiness = _readiness()
     return {
-        "status": "healthy",
+        "status": "healthy" if readiness["ready"] else "saturated",
         "model": "oracle850b-moe",
-        "ready": True
+        "backend": server.backend.name,
+        **readiness
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness-проба: 503, пока запросы ждут допуска или бюджет исчерпан"""
+    readiness = _readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики Prometheus (очередь, prefill/decode, TTFT, e2e, токенизация, HTTP)"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
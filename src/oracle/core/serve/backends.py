@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Inference Backends
+Пошаговый интерфейс генерации: in-process PyTorch (KV-кэш) и детерминированная заглушка
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import os
+import json
+import time
+import logging
+import itertools
+from pathlib import Path
+from typing import List, Optional, Union
+
+from .tokenizer import OracleTokenizer, load_tokenizer
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета в порядке убывания: interactive (чат) обслуживается раньше batch
+PRIORITY_CLASSES = ("interactive", "batch")
+# Задачи последовательности: generate — prefill и decode, embed — только prefill с пулингом
+SEQUENCE_TASKS = ("generate", "embed")
+
+
+class SamplingParams:
+    """Параметры генерации одного запроса"""
+
+    def __init__(self, max_tokens: int = 2048, temperature: float = 0.7,
+                 top_p: float = 1.0, top_k: int = 0, seed: Optional[int] = None,
+                 repetition_penalty: float = 1.0, presence_penalty: float = 0.0,
+                 stop_token_ids: Optional[List[List[int]]] = None, constraint=None):
+        if max_tokens < 1:
+            raise ValueError(f"max_tokens должен быть >= 1, получено {max_tokens}")
+        if temperature < 0:
+            raise ValueError(f"temperature должна быть >= 0, получено {temperature}")
+        if not 0 < top_p <= 1:
+            raise ValueError(f"top_p должен быть в (0, 1], получено {top_p}")
+        if top_k < 0:
+            raise ValueError(f"top_k должен быть >= 0, получено {top_k}")
+        if repetition_penalty <= 0:
+            raise ValueError(f"repetition_penalty должен быть > 0, получено {repetition_penalty}")
+        if not -2 <= presence_penalty <= 2:
+            raise ValueError(f"presence_penalty должен быть в [-2, 2], получено {presence_penalty}")
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.seed = seed
+        self.repetition_penalty = repetition_penalty
+        self.presence_penalty = presence_penalty
+        # Stop-последовательности в id токенов: совпавшая не попадает в ответ
+        self.stop_token_ids = [list(ids) for ids in stop_token_ids or [] if ids]
+        # Ограничение формата ответа (TokenAutomaton из response_format) или None
+        self.constraint = constraint
+
+    @property
+    def stop_holdback(self) -> int:
+        """Сколько последних токенов стрим придерживает: они могут оказаться началом stop"""
+        return max((len(ids) for ids in self.stop_token_ids), default=1) - 1
+
+
+class Sequence:
+    """Состояние одного запроса в движке: промпт, сгенерированные токены, тайминги"""
+
+    _counter = itertools.count()
+
+    def __init__(self, prompt_ids: List[int], sampling: SamplingParams,
+                 request_id: Optional[str] = None, prefix=None,
+                 priority: str = "interactive", tenant: str = "default", task: str = "generate"):
+        if not prompt_ids:
+            raise ValueError("Пустой промпт")
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Неизвестный класс приоритета: {priority} (ожидается {', '.join(PRIORITY_CLASSES)})")
+        if task not in SEQUENCE_TASKS:
+            raise ValueError(f"Неизвестная задача: {task} (ожидается {', '.join(SEQUENCE_TASKS)})")
+        self.request_id = request_id or f"seq-{next(self._counter)}"
+        self.priority = priority
+        self.task = task
+        self.tenant = tenant  # арендатор (API-ключ) для справедливой очереди
+        self.prompt_ids = list(prompt_ids)
+        # Общий префикс (PrefixEntry): prompt_ids начинаются с prefix.token_ids,
+        # бэкенд может взять его KV из кэша и считать prefill только для остатка
+        self.prefix = prefix if prefix is not None and 0 < len(prefix) < len(self.prompt_ids) else None
+        self.num_cached_tokens = 0  # фактически переиспользовано бэкендом при prefill
+        self.sampling = sampling
+        self.output_ids: List[int] = []
+        self.embedding: Optional[List[float]] = None  # результат задачи embed
+        self.finish_reason: Optional[str] = None
+        self.error: Optional[Exception] = None
+        self.state = None  # приватное состояние бэкенда (слот KV-кэша и т.п.)
+
+        self.arrival_time = time.perf_counter()
+        self.first_token_time: Optional[float] = None
+        self.finish_time: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finish_reason is not None
+
+    @property
+    def all_ids(self) -> List[int]:
+        return self.prompt_ids + self.output_ids
+
+    @property
+    def num_prefill_tokens(self) -> int:
+        """Токенов промпта, которые считает prefill (без закэшированного префикса)"""
+        cached = max(self.num_cached_tokens, len(self.prefix) if self.prefix is not None else 0)
+        return len(self.prompt_ids) - cached
+
+    def append(self, token_ids: List[int]):
+        """Добавить токены, сгенерированные бэкендом за шаг"""
+        if self.first_token_time is None and token_ids:
+            self.first_token_time = time.perf_counter()
+        self.output_ids.extend(token_ids)
+
+    def finish(self, reason: str, error: Optional[Exception] = None):
+        """Завершить последовательность (stop, length, error, abort)"""
+        if self.finish_reason is None:
+            self.finish_reason = reason
+            self.error = error
+            self.finish_time = time.perf_counter()
+
+    def check_finished(self, eos_token_id: int) -> bool:
+        """Остановка по EOS или max_tokens, лишние токены шага отбрасываются"""
+        if eos_token_id in self.output_ids:
+            del self.output_ids[self.output_ids.index(eos_token_id):]
+            self.finish("stop")
+        elif len(self.output_ids) >= self.sampling.max_tokens:
+            del self.output_ids[self.sampling.max_tokens:]
+            self.finish("length")
+        return self.finished
+
+
+class InferenceBackend:
+    """Базовый интерфейс бэкенда.
+
+    Движок вызывает prefill для новой последовательности, затем decode для
+    батча активных последовательностей (каждый шаг добавляет >= 1 токена),
+    и release после завершения. Методы синхронные и выполняются в
+    отдельном потоке движка, не в event loop.
+
+    Если у последовательности есть seq.prefix, prefill может переиспользовать
+    состояние префикса (prefix.kv) и считать только остаток промпта;
+    число переиспользованных токенов записывается в seq.num_cached_tokens.
+
+    Последовательности с task="embed" вместо prefill попадают в embed одним
+    списком за шаг: бэкенд записывает seq.embedding и сразу их завершает.
+    """
+
+    name = "base"
+
+    def __init__(self, tokenizer: OracleTokenizer, max_batch_size: int = 8):
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+
+    @property
+    def eos_token_id(self) -> int:
+        return self.tokenizer.eos_token_id
+
+    @property
+    def vocab_size(self) -> int:
+        """Размер словаря логитов (под него строятся маски response_format)"""
+        return self.tokenizer.vocab_size
+
+    def prefill(self, seq: Sequence):
+        """Обработать промпт и добавить первый токен"""
+        raise NotImplementedError
+
+    def decode(self, seqs: List[Sequence]):
+        """Один decode-шаг для батча последовательностей"""
+        raise NotImplementedError
+
+    def embed(self, seqs: List[Sequence]):
+        """Эмбеддинги промптов батча (seq.embedding) с завершением последовательностей"""
+        raise NotImplementedError
+
+    def release(self, seq: Sequence):
+        """Освободить ресурсы завершённой последовательности"""
+        seq.state = None
+
+
+class DeterministicBackend(InferenceBackend):
+    """Детерминированная заглушка для dry-run и нагрузочных тестов.
+
+    Циклически выдаёт токены фиксированного ответа и EOS после
+    response_tokens токенов. Задержки prefill (на токен промпта) и decode
+    (на батчевый шаг) имитируют стоимость модели. Эмбеддинг — нормированная
+    гистограмма id токенов промпта по embedding_dim корзинам. Ограничение
+    формата (sampling.constraint) не применяется.
+    """
+
+    name = "deterministic"
+    REPLY = "Детерминированный ответ Oracle850B. "
+
+    def __init__(self, tokenizer: OracleTokenizer, max_batch_size: int = 8,
+                 response_tokens: int = 64, prefill_ms_per_token: float = 0.0,
+                 decode_ms_per_step: float = 0.0, embedding_dim: int = 64):
+        super().__init__(tokenizer, max_batch_size)
+        self.response_tokens = response_tokens
+        self.embedding_dim = embedding_dim
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_step = decode_ms_per_step
+        self.reply_ids = tokenizer.encode(self.REPLY)
+
+    def _next_token(self, seq: Sequence) -> int:
+        position = len(seq.output_ids)
+        if position >= self.response_tokens:
+            return self.eos_token_id
+        return self.reply_ids[position % len(self.reply_ids)]
+
+    def prefill(self, seq: Sequence):
+        if self.prefill_ms_per_token:
+            time.sleep(self.prefill_ms_per_token * seq.num_prefill_tokens / 1000)
+        if seq.prefix is not None:
+            seq.num_cached_tokens = len(seq.prefix)
+        seq.append([self._next_token(seq)])
+
+    def decode(self, seqs: List[Sequence]):
+        if self.decode_ms_per_step:
+            time.sleep(self.decode_ms_per_step / 1000)
+        for seq in seqs:
+            seq.append([self._next_token(seq)])
+
+    def embed(self, seqs: List[Sequence]):
+        if self.prefill_ms_per_token:
+            time.sleep(self.prefill_ms_per_token * sum(len(seq.prompt_ids) for seq in seqs) / 1000)
+        for seq in seqs:
+            vector = [0.0] * self.embedding_dim
+            for token_id in seq.prompt_ids:
+                vector[token_id % self.embedding_dim] += 1.0
+            norm = sum(x * x for x in vector) ** 0.5
+            seq.embedding = [x / norm for x in vector]
+            seq.finish("stop")
+
+
+class TorchBackend(InferenceBackend):
+    """In-process PyTorch бэкенд на Oracle850BTransformer.
+
+    KV-кэш — пул слотов (SlotKVCache): последовательности разной длины
+    декодируются одним батчем, при sliding_window слот хранит только
+    sink-токены и окно. Перед prefill в слот копируется KV самого
+    длинного закэшированного префикса: из radix-кэша промптов (история
+    многоходового чата, туда попадают завершённые последовательности) или
+    общего системного префикса (seq.prefix), prefill идёт только по остатку.
+    С драфт-моделью каждая последовательность идёт через SpeculativeDecoder
+    (несколько токенов за шаг, промпт целиком).
+
+    Сэмплинг — BatchedSampler: параметры запроса пишутся в тензоры слота
+    при prefill, decode-шаг применяет штрафы, temperature, top-k/top-p и
+    stop-последовательности ко всему батчу за один проход, а для запросов с
+    response_format — маску допустимых токенов состояния автомата. В
+    спекулятивном режиме штрафы и stop не применяются, response_format не
+    поддерживается.
+
+    Эмбеддинги: промпты шага упаковываются в одну строку (cu_seqlens,
+    блочно-диагональное внимание без паддинга), финальные hidden states
+    усредняются по токенам каждого промпта и нормируются по L2.
+    """
+
+    name = "torch"
+
+    def __init__(self, tokenizer: OracleTokenizer, model, max_batch_size: int = 8,
+                 max_seq_len: Optional[int] = None, draft_model=None, lookahead: int = 4,
+                 prompt_cache_bytes: int = 0):
+        super().__init__(tokenizer, max_batch_size)
+        import torch
+        from oracle.moe850b.modeling.kv_cache import create_slot_kv_cache
+        from oracle.moe850b.modeling.sampling import BatchedSampler
+        from oracle.moe850b.modeling.speculative import SpeculativeDecoder
+        from .radix_cache import RadixPromptCache
+
+        self.torch = torch
+        self.model = model.eval()
+        self.device = next(model.parameters()).device
+        self.max_seq_len = min(max_seq_len or model.max_seq_len, model.max_seq_len)
+        self.cache = create_slot_kv_cache(model.config, max_batch_size, self.max_seq_len)
+        self.sampler = BatchedSampler(max_batch_size, model.vocab_size, self.device)
+        self.speculative = SpeculativeDecoder(model, draft_model.eval(), lookahead) if draft_model else None
+        self.prompt_cache = RadixPromptCache(prompt_cache_bytes) if prompt_cache_bytes > 0 else None
+
+    @classmethod
+    def from_pretrained(cls, model_path: Union[str, Path], config_path: Optional[str] = None,
+                        draft_config_path: Optional[str] = None, device: Optional[str] = None,
+                        **kwargs) -> "TorchBackend":
+        """Модель из config.json (+ safetensors-веса, если есть) в model_path"""
+        from oracle.moe850b.modeling.transformer_moe import create_oracle850b_model
+
+        model_path = Path(model_path)
+        config_path = config_path or str(model_path / "config.json")
+        device = device or "cpu"
+
+        model = create_oracle850b_model(config_path, mode="infer", device=device)
+        load_weights(model, model_path)
+        model.to(device)
+
+        draft = None
+        if draft_config_path:
+            draft = create_oracle850b_model(draft_config_path, mode="infer", device=device)
+            load_weights(draft, Path(draft_config_path).parent)
+            draft.to(device)
+
+        return cls(load_tokenizer(model_path), model, draft_model=draft, **kwargs)
+
+    @property
+    def vocab_size(self) -> int:
+        return self.model.vocab_size
+
+    def _sample(self, logits, seqs: List[Sequence]):
+        """Токен каждой последовательности за один проход сэмплера; совпавший stop отрезается"""
+        tokens, stopped, stop_len = self.sampler.sample(logits, [seq.state["slot"] for seq in seqs])
+        # Одна синхронизация с устройством на шаг
+        rows = self.torch.stack([tokens, stopped.long(), stop_len]).T.tolist()
+        for seq, (token, stop, length) in zip(seqs, rows):
+            seq.append([token])
+            if stop:
+                del seq.output_ids[len(seq.output_ids) - length:]
+                seq.finish("stop")
+
+    def prefill(self, seq: Sequence):
+        prompt_len = len(seq.prompt_ids)
+        if prompt_len >= self.max_seq_len:
+            raise ValueError(f"Промпт ({prompt_len} токенов) не помещается в max_seq_len={self.max_seq_len}")
+        seq.sampling.max_tokens = min(seq.sampling.max_tokens, self.max_seq_len - prompt_len)
+        if seq.sampling.constraint is not None and self.speculative is not None:
+            raise ValueError("response_format не поддерживается со спекулятивным декодированием")
+
+        generator = None
+        if seq.sampling.seed is not None:
+            generator = self.torch.Generator(device=self.device).manual_seed(seq.sampling.seed)
+        seq.state = {"generator": generator}
+        input_ids = self.torch.tensor([seq.prompt_ids], device=self.device)
+
+        with self.torch.inference_mode():
+            if self.speculative is not None:
+                seq.prefix = None
+                seq.state["speculative"] = self.speculative.start(input_ids)
+                self._speculative_step(seq)
+                return
+            seq.state["slot"] = slot = self.cache.allocate()
+            p = seq.sampling
+            self.sampler.add(slot, p.temperature, p.top_k, p.top_p, p.repetition_penalty,
+                             p.presence_penalty, seq.prompt_ids, p.stop_token_ids, generator, p.constraint)
+            # Последний токен промпта всегда проходит prefill: нужны его логиты
+            cached, chunks = self.prompt_cache.match(seq.prompt_ids[:-1]) if self.prompt_cache else (0, [])
+            if seq.prefix is not None and len(seq.prefix) > cached:
+                if seq.prefix.kv is None:
+                    seq.prefix.kv = self._prefix_kv(seq.prefix.token_ids)
+                cached, chunks = len(seq.prefix), [seq.prefix.kv]
+            start = 0
+            for keys, values in chunks:
+                self.cache.load_prefix(slot, keys, values, start)
+                start += keys[0].shape[1]
+            seq.num_cached_tokens = cached
+            input_ids = input_ids[:, cached:]
+            logits = self.model(input_ids, kv_cache=self.cache.bind([slot]), return_logits="last")
+            self._sample(logits[:, -1], [seq])
+
+    def embed(self, seqs: List[Sequence]):
+        batch = []
+        for seq in seqs:
+            if len(seq.prompt_ids) > self.max_seq_len:
+                seq.finish("error", ValueError(
+                    f"Вход ({len(seq.prompt_ids)} токенов) не помещается в max_seq_len={self.max_seq_len}"
+                ))
+            else:
+                batch.append(seq)
+        if not batch:
+            return
+
+        torch = self.torch
+        lengths = [len(seq.prompt_ids) for seq in batch]
+        input_ids = torch.tensor([[t for seq in batch for t in seq.prompt_ids]], device=self.device)
+        cu_seqlens = torch.tensor([0] + list(itertools.accumulate(lengths)), device=self.device)
+        with torch.inference_mode():
+            hidden = self.model.forward_hidden(input_ids, cu_seqlens=cu_seqlens)[0]
+            pooled = torch.stack([h.float().mean(dim=0) for h in hidden.split(lengths)])
+            pooled = torch.nn.functional.normalize(pooled, dim=-1).cpu()
+        for seq, vector in zip(batch, pooled.tolist()):
+            seq.embedding = vector
+            seq.finish("stop")
+
+    def _prefix_kv(self, token_ids: List[int]):
+        """KV префикса по слоям (ключи [H, P, D], значения [H, P, D])"""
+        from oracle.moe850b.modeling.kv_cache import DynamicKVCache
+
+        kv_cache = DynamicKVCache(self.model.n_layers)
+        self.model(self.torch.tensor([token_ids], device=self.device), kv_cache=kv_cache, return_logits="last")
+        return [k[0] for k in kv_cache.keys], [v[0] for v in kv_cache.values]
+
+    def _speculative_step(self, seq: Sequence):
+        p = seq.sampling
+        remaining = p.max_tokens - len(seq.output_ids)
+        new_tokens = self.speculative.step(seq.state["speculative"], remaining, p.temperature,
+                                           p.top_k, p.top_p, seq.state["generator"])
+        seq.append(new_tokens[0].tolist())
+
+    def decode(self, seqs: List[Sequence]):
+        with self.torch.inference_mode():
+            if self.speculative is not None:
+                for seq in seqs:
+                    self._speculative_step(seq)
+                return
+            input_ids = self.torch.tensor([[seq.output_ids[-1]] for seq in seqs], device=self.device)
+            kv_cache = self.cache.bind([seq.state["slot"] for seq in seqs])
+            logits = self.model(input_ids, kv_cache=kv_cache, return_logits="last")
+            self._sample(logits[:, -1], seqs)
+
+    def release(self, seq: Sequence):
+        if seq.state and "slot" in seq.state:
+            slot = seq.state["slot"]
+            with self.torch.inference_mode():
+                if self.prompt_cache is not None and seq.error is None:
+                    # В слоте KV промпта и всех ответных токенов, кроме последнего;
+                    # при sliding window — только пока последовательность помещается в окно
+                    num_tokens = min(self.cache.readable_length(slot), len(seq.all_ids))
+                    self.prompt_cache.insert(seq.all_ids[:num_tokens],
+                                             lambda start, end: self.cache.read(slot, start, end))
+                self.cache.free(slot)
+                self.sampler.remove(slot)
+        super().release(seq)
+
+
+def load_weights(model, model_path: Path) -> bool:
+    """Загрузить safetensors-веса (включая квантованные экспертов), если они есть"""
+    model_path = Path(model_path)
+    shard_files = sorted(model_path.glob("*.safetensors"))
+    if not shard_files:
+        logger.warning(f"Веса не найдены в {model_path}, модель инициализирована случайно")
+        return False
+
+    from safetensors.torch import load_file
+    from oracle.moe850b.modeling.quantization import quantize_moe_experts
+
+    quant_config_file = model_path / "quantization_config.json"
+    if quant_config_file.exists():
+        quant_config = json.loads(quant_config_file.read_text(encoding="utf-8"))
+        quantize_moe_experts(model, bits=quant_config["bits"], group_size=quant_config.get("group_size") or 128)
+
+    state = {}
+    for shard_file in shard_files:
+        state.update(load_file(str(shard_file)))
+    missing, unexpected = model.load_state_dict(state, strict=False)
+    if missing or unexpected:
+        logger.warning(f"Веса {model_path}: missing={len(missing)}, unexpected={len(unexpected)}")
+    return True
+
+
+def create_backend(name: Optional[str] = None, model_path: Union[str, Path] = "checkpoints/oracle850b",
+                   **kwargs) -> InferenceBackend:
+    """Бэкенд по имени (по умолчанию из ORACLE_BACKEND, иначе deterministic)"""
+    name = name or os.environ.get("ORACLE_BACKEND", "deterministic")
+    max_batch_size = int(os.environ.get("ORACLE_MAX_BATCH_SIZE", kwargs.pop("max_batch_size", 8)))
+
+    if name == "deterministic":
+        return DeterministicBackend(load_tokenizer(model_path), max_batch_size=max_batch_size, **kwargs)
+    if name == "torch":
+        return TorchBackend.from_pretrained(
+            model_path,
+            config_path=os.environ.get("ORACLE_MODEL_CONFIG"),
+            draft_config_path=os.environ.get("ORACLE_DRAFT_CONFIG"),
+            device=os.environ.get("ORACLE_DEVICE"),
+            max_batch_size=max_batch_size,
+            max_seq_len=int(os.environ.get("ORACLE_MAX_SEQ_LEN", 4096)),
+            lookahead=int(os.environ.get("ORACLE_LOOKAHEAD", 4)),
+            prompt_cache_bytes=int(float(os.environ.get("ORACLE_PROMPT_CACHE_MB", 1024)) * 2**20),
+            **kwargs
+        )
+    raise ValueError(f"Неизвестный бэкенд: {name}")
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Offline Batch Inference
+Прогон JSONL с chat-запросами через бэкенд сервинга: окно запросов, инкрементальная запись, возобновление
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple
+
+# Запуск скриптом (python src/oracle/core/serve/batch_runner.py): src в sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from oracle.core.serve.app_fastapi import ChatCompletionRequest, server  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def parse_line(line: bytes, line_no: int) -> Tuple[str, ChatCompletionRequest]:
+    """Строка входа -> (custom_id, запрос).
+
+    Строка — тело /v1/chat/completions или запись формата OpenAI Batch API
+    ({"custom_id": ..., "body": {...}}); без custom_id берётся номер строки.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Строка должна быть JSON-объектом")
+    body = record.get("body", record)
+    request = ChatCompletionRequest(**body)
+    request.stream = False
+    return str(record.get("custom_id", f"line-{line_no}")), request
+
+
+class Checkpoint:
+    """Точка возобновления: смещение во входе и размер выхода после последнего записанного результата.
+
+    Результаты пишутся строго в порядке входа, поэтому всё до input_offset
+    уже есть в выходе, а всё после output_size при возобновлении
+    отрезается — ни потерь, ни дублей после падения.
+    """
+
+    FIELDS = ("input_offset", "output_size", "line_no", "requests", "errors",
+              "prompt_tokens", "completion_tokens")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.input_offset = 0
+        self.output_size = 0
+        self.line_no = 0
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def load(self) -> bool:
+        if not self.path.exists():
+            return False
+        state = json.loads(self.path.read_text(encoding="utf-8"))
+        for field in self.FIELDS:
+            setattr(self, field, state[field])
+        return True
+
+    def save(self):
+        """Атомарная запись (tmp + rename)"""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps({field: getattr(self, field) for field in self.FIELDS}), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+class BatchRunner:
+    """Офлайн-прогон JSONL через движок сервинга.
+
+    Вход читается потоково, в работе не больше window запросов: движок
+    держит батч полным (continuous batching), память не растёт с размером
+    файла. Результаты пишутся по мере готовности в порядке входа (готовые
+    вне очереди ждут в буфере до 4 * window), контрольная точка
+    обновляется каждые checkpoint_every записанных строк. Ошибка запроса
+    пишется в его строку результата и не останавливает прогон.
+    """
+
+    def __init__(self, input_path: Path, output_path: Path, checkpoint_path: Optional[Path] = None,
+                 window: int = 64, checkpoint_every: int = 100, priority: str = "interactive",
+                 tenant: str = "offline", log_interval: float = 10.0):
+        self.input_path = Path(input_path)
+        self.output_path = Path(output_path)
+        self.checkpoint = Checkpoint(Path(checkpoint_path or f"{output_path}.ckpt"))
+        self.window = window
+        self.checkpoint_every = checkpoint_every
+        self.priority = priority
+        self.tenant = tenant
+        self.log_interval = log_interval
+
+    async def _process(self, line_no: int, line: bytes) -> Tuple[Dict[str, Any], int, int]:
+        """Запись результата и число токенов промпта/ответа"""
+        custom_id = f"line-{line_no}"
+        try:
+            custom_id, request = parse_line(line, line_no)
+            seq = await server.prepare_sequence(request, self.priority, self.tenant)
+            seq = await server.engine.submit(seq)
+            response = await server.build_response(request, seq)
+        except Exception as e:
+            error = {"message": str(e), "type": type(e).__name__}
+            return {"custom_id": custom_id, "response": None, "error": error}, 0, 0
+        usage = response.usage
+        return ({"custom_id": custom_id, "response": response.model_dump(), "error": None},
+                usage["prompt_tokens"], usage["completion_tokens"])
+
+    async def run(self, resume: bool = False) -> Dict[str, Any]:
+        ckpt = self.checkpoint = Checkpoint(self.checkpoint.path)
+        if resume and ckpt.load():
+            logger.info(f"Возобновление после строки {ckpt.line_no} (смещение {ckpt.input_offset})")
+
+        mode = "r+b" if resume and self.output_path.exists() else "wb"
+        start = time.perf_counter()
+        run_prompt_tokens = run_completion_tokens = run_requests = 0
+        with open(self.input_path, "rb") as fin, open(self.output_path, mode) as fout:
+            fout.truncate(ckpt.output_size)
+            fout.seek(ckpt.output_size)
+            fin.seek(ckpt.input_offset)
+
+            line_no = ckpt.line_no
+            inflight: Set[asyncio.Task] = set()
+            indices: Dict[asyncio.Task, int] = {}
+            ready: Dict[int, Tuple[Dict[str, Any], int, int]] = {}
+            offsets: Dict[int, Tuple[int, int]] = {}  # индекс -> (смещение после строки, номер строки)
+            next_index = write_index = 0
+            exhausted = False
+            since_checkpoint = 0
+            last_log = start
+
+            while True:
+                # Дозаполнить окно
+                while not exhausted and len(inflight) < self.window and len(ready) < 4 * self.window:
+                    line = fin.readline()
+                    if not line:
+                        exhausted = True
+                        break
+                    line_no += 1
+                    if not line.strip():
+                        continue
+                    task = asyncio.ensure_future(self._process(line_no, line))
+                    indices[task] = next_index
+                    offsets[next_index] = (fin.tell(), line_no)
+                    inflight.add(task)
+                    next_index += 1
+                if not inflight:
+                    break
+
+                done, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    ready[indices.pop(task)] = task.result()
+
+                # Записать готовый непрерывный префикс
+                while write_index in ready:
+                    record, prompt_tokens, completion_tokens = ready.pop(write_index)
+                    fout.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                    ckpt.input_offset, ckpt.line_no = offsets.pop(write_index)
+                    ckpt.requests += 1
+                    ckpt.errors += record["error"] is not None
+                    ckpt.prompt_tokens += prompt_tokens
+                    ckpt.completion_tokens += completion_tokens
+                    run_requests += 1
+                    run_prompt_tokens += prompt_tokens
+                    run_completion_tokens += completion_tokens
+                    write_index += 1
+                    since_checkpoint += 1
+
+                if since_checkpoint >= self.checkpoint_every:
+                    self._save_checkpoint(fout)
+                    since_checkpoint = 0
+                now = time.perf_counter()
+                if now - last_log >= self.log_interval:
+                    last_log = now
+                    logger.info(f"Записано {ckpt.requests} (ошибок {ckpt.errors}), в работе {len(inflight)}, "
+                                f"{run_completion_tokens / (now - start):.1f} ток/с")
+
+            self._save_checkpoint(fout)
+
+        elapsed = time.perf_counter() - start
+        return {
+            "requests": ckpt.requests,
+            "errors": ckpt.errors,
+            "prompt_tokens": ckpt.prompt_tokens,
+            "completion_tokens": ckpt.completion_tokens,
+            "run_requests": run_requests,
+            "elapsed_s": elapsed,
+            "requests_per_s": run_requests / elapsed if elapsed > 0 else 0.0,
+            "completion_tokens_per_s": run_completion_tokens / elapsed if elapsed > 0 else 0.0,
+            "total_tokens_per_s": (run_prompt_tokens + run_completion_tokens) / elapsed if elapsed > 0 else 0.0
+        }
+
+    def _save_checkpoint(self, fout):
+        """Сначала данные на диск, затем точка возобновления"""
+        fout.flush()
+        os.fsync(fout.fileno())
+        self.checkpoint.output_size = fout.tell()
+        self.checkpoint.save()
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    runner = BatchRunner(
+        Path(args.input), Path(args.output), args.checkpoint, window=args.window,
+        checkpoint_every=args.checkpoint_every, priority=args.priority, tenant=args.tenant,
+        log_interval=args.log_interval
+    )
+    try:
+        return await runner.run(resume=args.resume)
+    finally:
+        await server.engine.stop()
+        server.tokenizer_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oracle850B offline batch inference")
+    parser.add_argument("input", help="JSONL с запросами /v1/chat/completions (или формат OpenAI Batch API)")
+    parser.add_argument("output", help="JSONL с результатами (custom_id, response, error)")
+    parser.add_argument("--checkpoint", help="Файл контрольной точки (по умолчанию <output>.ckpt)")
+    parser.add_argument("--resume", action="store_true", help="Продолжить с контрольной точки")
+    parser.add_argument("--window", type=int, default=64, help="Запросов в работе одновременно")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Обновлять контрольную точку каждые N строк")
+    parser.add_argument("--priority", default="interactive", choices=["interactive", "batch"],
+                        help="Класс приоритета (batch ограничен долей слотов батча)")
+    parser.add_argument("--tenant", default="offline", help="Арендатор для справедливой очереди")
+    parser.add_argument("--log-interval", type=float, default=10.0, help="Интервал логов прогресса, с")
+    parser.add_argument("--output-stats", help="Сохранить итоговую статистику в JSON")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    stats = asyncio.run(_run(args))
+    print(f"Запросов: {stats['requests']} (ошибок {stats['errors']}), за прогон {stats['run_requests']} "
+          f"за {stats['elapsed_s']:.1f} с")
+    print(f"Пропускная способность: {stats['completion_tokens_per_s']:.1f} ток/с ответа, "
+          f"{stats['total_tokens_per_s']:.1f} ток/с всего, {stats['requests_per_s']:.2f} req/s")
+
+    if args.output_stats:
+        with open(args.output_stats, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Inference Engine
+Асинхронная очередь запросов и continuous batching бэкенда вне event loop
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from .backends import InferenceBackend, Sequence
+from .scheduler import Scheduler, SchedulerOutput, parse_tenant_weights
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceEngine:
+    """Очередь запросов и цикл continuous batching.
+
+    Обработчики кладут Sequence в asyncio.Queue и ждут future. Фоновая
+    задача перед каждым шагом переносит новые запросы в Scheduler, шаг
+    (prefill новых + decode running) выполняется в однопоточном executor,
+    завершённые последовательности сразу уходят из батча и освобождают
+    место для следующих. Состояние планировщика меняется только между
+    шагами, поэтому блокировки не нужны.
+
+    Запросы эмбеддингов (task="embed") идут через ту же очередь и бюджет
+    токенов шага, но заканчиваются на prefill: их промпты за шаг
+    обрабатываются одним вызовом backend.embed.
+
+    После шага движок фиксирует seq.num_committed — токены до этой границы
+    больше не меняются, их и отдаёт stream().
+    """
+
+    def __init__(self, backend: InferenceBackend, max_batch_size: Optional[int] = None,
+                 max_num_batched_tokens: Optional[int] = None,
+                 tenant_weights: Optional[Dict[str, float]] = None,
+                 class_slot_limits: Optional[Dict[str, int]] = None):
+        self.backend = backend
+        max_batch_size = max_batch_size or backend.max_batch_size
+        if tenant_weights is None:
+            tenant_weights = parse_tenant_weights(os.environ.get("ORACLE_TENANT_WEIGHTS", ""))
+        if class_slot_limits is None:
+            # По умолчанию batch-класс не занимает последнюю четверть батча
+            batch_slots = max_batch_size - max_batch_size // 4
+            class_slot_limits = {"batch": int(os.environ.get("ORACLE_BATCH_MAX_SLOTS", batch_slots))}
+        self.scheduler = Scheduler(
+            max_batch_size,
+            max_num_batched_tokens or int(os.environ.get("ORACLE_MAX_BATCHED_TOKENS", 4096)),
+            tenant_weights, class_slot_limits
+        )
+        self.queue: Optional[asyncio.Queue] = None
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, asyncio.Event] = {}
+        self._aborted: Set[Sequence] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="oracle-engine")
+
+    def start(self):
+        """Запустить фоновую задачу в текущем event loop"""
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _enqueue(self, seq: Sequence) -> asyncio.Future:
+        self.start()
+        seq.num_committed = 0
+        future = asyncio.get_running_loop().create_future()
+        self._futures[seq.request_id] = future
+        await self.queue.put(seq)
+        return future
+
+    async def submit(self, seq: Sequence) -> Sequence:
+        """Поставить запрос в очередь и дождаться завершения генерации"""
+        future = await self._enqueue(seq)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Клиент отключился: освободить место в батче
+            self.abort(seq)
+            raise
+
+    async def stream(self, seq: Sequence) -> AsyncIterator[List[int]]:
+        """Новые зафиксированные токены после каждого шага.
+
+        Медленный клиент не копит очередь: пока он не прочитал очередную
+        порцию, токены следующих шагов склеиваются в одну. Закрытие
+        генератора до завершения (отключение клиента) отменяет запрос.
+        """
+        event = asyncio.Event()
+        self._streams[seq.request_id] = event
+        future = await self._enqueue(seq)
+        sent = 0
+        try:
+            while True:
+                await event.wait()
+                event.clear()
+                committed = seq.num_committed
+                if committed > sent:
+                    yield seq.output_ids[sent:committed]
+                    sent = committed
+                if future.done():
+                    if seq.error is not None:
+                        raise seq.error
+                    return
+        finally:
+            self._streams.pop(seq.request_id, None)
+            if not future.done():
+                metrics.CANCELLED_STREAMS.inc()
+                self.abort(seq)
+
+    def abort(self, seq: Sequence):
+        """Отменить запрос; слот освобождается до следующего шага"""
+        self._aborted.add(seq)
+        event = self._streams.get(seq.request_id)
+        if event is not None:
+            event.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.scheduler.has_work():
+                self.scheduler.add(await self.queue.get())
+            while not self.queue.empty():
+                self.scheduler.add(self.queue.get_nowait())
+            self._process_aborts()
+            if not self.scheduler.has_work():
+                continue
+
+            output = self.scheduler.schedule()
+            self._observe_step(output)
+            try:
+                await loop.run_in_executor(self._executor, self._execute, output)
+            except Exception as e:
+                logger.exception("Ошибка decode-шага")
+                for seq in output.prefill + output.decode:
+                    seq.finish("error", e)
+                    self.backend.release(seq)
+
+            for seq in output.prefill:
+                if seq.first_token_time is not None:
+                    metrics.TIME_TO_FIRST_TOKEN.labels(seq.priority).observe(seq.first_token_time - seq.arrival_time)
+                metrics.PREFILL_TOKENS.labels("computed").inc(len(seq.prompt_ids) - seq.num_cached_tokens)
+                metrics.PREFILL_TOKENS.labels("cached").inc(seq.num_cached_tokens)
+            for seq in self.scheduler.evict_finished():
+                self._complete(seq)
+            for seq in output.prefill + output.decode:
+                self._publish(seq)
+            self._update_gauges()
+
+    def _process_aborts(self):
+        """Снять отменённые запросы между шагами (executor в этот момент простаивает)"""
+        for seq in self._aborted:
+            if seq.finished:
+                continue
+            self.scheduler.abort(seq)
+            seq.finish("abort")
+            self.backend.release(seq)
+            self._complete(seq)
+            self._publish(seq)
+        if self._aborted:
+            self._update_gauges()
+        self._aborted.clear()
+
+    def _publish(self, seq: Sequence):
+        """Зафиксировать токены шага и разбудить стрим.
+
+        Пока последовательность не завершена, хвост длиной до stop-последовательности
+        не фиксируется: при совпадении stop он будет отрезан.
+        """
+        committed = len(seq.output_ids)
+        if not seq.finished:
+            committed -= seq.sampling.stop_holdback
+        seq.num_committed = max(seq.num_committed, committed)
+        event = self._streams.get(seq.request_id)
+        if event is not None:
+            event.set()
+
+    def _execute(self, output: SchedulerOutput):
+        """Один шаг в потоке executor: эмбеддинги, prefill новых, decode running, освобождение завершённых"""
+        backend = self.backend
+        embeds = [seq for seq in output.prefill if seq.task == "embed"]
+        if embeds:
+            # Эмбеддинги шага — один проход модели; последовательности завершаются сразу
+            start = time.perf_counter()
+            try:
+                backend.embed(embeds)
+            except Exception as e:
+                for seq in embeds:
+                    seq.finish("error", e)
+            metrics.EMBED_STEP_TIME.observe(time.perf_counter() - start)
+        for seq in output.prefill:
+            if seq.task == "embed":
+                continue
+            start = time.perf_counter()
+            try:
+                backend.prefill(seq)
+            except Exception as e:
+                # Ошибка одного промпта (например, слишком длинного) не валит батч
+                seq.finish("error", e)
+            metrics.PREFILL_TIME.observe(time.perf_counter() - start)
+        if output.decode:
+            start = time.perf_counter()
+            backend.decode(output.decode)
+            metrics.DECODE_STEP_TIME.observe(time.perf_counter() - start)
+
+        for seq in output.prefill + output.decode:
+            if seq.finished or seq.check_finished(backend.eos_token_id):
+                backend.release(seq)
+
+    def _observe_step(self, output: SchedulerOutput):
+        metrics.SCHEDULER_STEPS.inc()
+        self._update_gauges()
+        metrics.BATCH_OCCUPANCY.observe(self.scheduler.occupancy)
+        metrics.STEP_BATCHED_TOKENS.observe(output.num_batched_tokens)
+        now = time.perf_counter()
+        for seq in output.prefill:
+            metrics.QUEUE_WAIT_TIME.labels(seq.priority).observe(now - seq.arrival_time)
+
+    def _update_gauges(self):
+        metrics.QUEUE_DEPTH.set(self.scheduler.queue_depth)
+        metrics.RUNNING_SEQUENCES.set(self.scheduler.num_running)
+
+    def _complete(self, seq: Sequence):
+        """Вернуть результат обработчику запроса"""
+        metrics.REQUESTS_FINISHED.labels(seq.finish_reason).inc()
+        metrics.PROMPT_TOKENS.inc(len(seq.prompt_ids))
+        metrics.GENERATED_TOKENS.inc(len(seq.output_ids))
+        metrics.E2E_LATENCY.labels(seq.priority).observe(seq.finish_time - seq.arrival_time)
+        if seq.first_token_time is not None and len(seq.output_ids) > 1:
+            metrics.TIME_PER_OUTPUT_TOKEN.observe(
+                (seq.finish_time - seq.first_token_time) / (len(seq.output_ids) - 1)
+            )
+        future = self._futures.pop(seq.request_id, None)
+        if future is None or future.done():
+            return
+        if seq.error is not None:
+            future.set_exception(seq.error)
+        else:
+            future.set_result(seq)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Serving Metrics
+Prometheus-метрики горячего пути сервинга и эндпоинт /metrics
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import time
+from typing import Tuple
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+)
+
+REGISTRY = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Планировщик
+QUEUE_DEPTH = Gauge(
+    "oracle_queue_depth", "Запросов в очереди на prefill", registry=REGISTRY
+)
+RUNNING_SEQUENCES = Gauge(
+    "oracle_running_sequences", "Последовательностей в decode-батче", registry=REGISTRY
+)
+BATCH_OCCUPANCY = Histogram(
+    "oracle_batch_occupancy", "Доля занятых мест батча на шаге",
+    buckets=(0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0), registry=REGISTRY
+)
+STEP_BATCHED_TOKENS = Histogram(
+    "oracle_step_batched_tokens", "Токенов (prefill + decode) в шаге",
+    buckets=(1, 4, 16, 64, 256, 1024, 4096, 16384), registry=REGISTRY
+)
+SCHEDULER_STEPS = Counter(
+    "oracle_scheduler_steps", "Шагов планировщика", registry=REGISTRY
+)
+
+# Запросы
+TIME_TO_FIRST_TOKEN = Histogram(
+    "oracle_time_to_first_token_seconds", "Время от поступления до первого токена", ["priority"],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+QUEUE_WAIT_TIME = Histogram(
+    "oracle_queue_wait_seconds", "Ожидание в очереди до первого prefill", ["priority"],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+PREFILL_TIME = Histogram(
+    "oracle_prefill_seconds", "Prefill одной последовательности в шаге",
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+DECODE_STEP_TIME = Histogram(
+    "oracle_decode_step_seconds", "Batched decode-шаг (по токену на последовательность)",
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+EMBED_STEP_TIME = Histogram(
+    "oracle_embed_step_seconds", "Пакетный проход эмбеддингов за шаг",
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+TIME_PER_OUTPUT_TOKEN = Histogram(
+    "oracle_time_per_output_token_seconds", "Среднее время на токен после первого, по запросу",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0), registry=REGISTRY
+)
+E2E_LATENCY = Histogram(
+    "oracle_e2e_request_latency_seconds", "Время от поступления до завершения запроса", ["priority"],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+REQUESTS_FINISHED = Counter(
+    "oracle_requests_finished", "Завершённых запросов", ["finish_reason"], registry=REGISTRY
+)
+PROMPT_TOKENS = Counter(
+    "oracle_prompt_tokens", "Токенов промпта в завершённых запросах", registry=REGISTRY
+)
+GENERATED_TOKENS = Counter(
+    "oracle_generated_tokens", "Сгенерированных токенов", registry=REGISTRY
+)
+BATCH_REQUEST_INPUTS = Histogram(
+    "oracle_batch_request_inputs", "Входов в одном запросе /v1/completions и /v1/embeddings", ["endpoint"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048), registry=REGISTRY
+)
+CANCELLED_STREAMS = Counter(
+    "oracle_cancelled_streams", "Стримов, закрытых клиентом до завершения", registry=REGISTRY
+)
+
+# Допуск запросов
+ADMISSION_INFLIGHT_TOKENS = Gauge(
+    "oracle_admission_inflight_tokens", "Оценка токенов (промпт + max_tokens) допущенных запросов",
+    registry=REGISTRY
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "oracle_admission_queue_depth", "Запросов, ожидающих допуска", registry=REGISTRY
+)
+ADMISSION_WAIT_TIME = Histogram(
+    "oracle_admission_wait_seconds", "Ожидание допуска (только ждавшие запросы)", ["priority"],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+ADMISSION_REJECTED = Counter(
+    "oracle_admission_rejected", "Отказов в допуске (429)", ["reason"], registry=REGISTRY
+)
+
+# HTTP
+HTTP_REQUESTS = Counter(
+    "oracle_http_requests", "HTTP-запросов", ["method", "path", "status"], registry=REGISTRY
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "oracle_http_request_duration_seconds", "Длительность HTTP-запроса (для SSE — до конца стрима)",
+    ["path"], buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+
+# Кэш префиксов
+PREFIX_CACHE_LOOKUPS = Counter(
+    "oracle_prefix_cache_lookups", "Обращений к кэшу системного префикса", ["result"], registry=REGISTRY
+)
+PREFILL_TOKENS = Counter(
+    "oracle_prefill_tokens", "Токенов промпта: computed — посчитано prefill, cached — взято из кэша",
+    ["source"], registry=REGISTRY
+)
+
+PROMPT_CACHE_LOOKUPS = Counter(
+    "oracle_prompt_cache_lookups", "Поисков в radix-кэше промптов (hit — совпал непустой префикс)",
+    ["result"], registry=REGISTRY
+)
+PROMPT_CACHE_BYTES = Gauge(
+    "oracle_prompt_cache_bytes", "Память KV в radix-кэше промптов", registry=REGISTRY
+)
+PROMPT_CACHE_EVICTED_TOKENS = Counter(
+    "oracle_prompt_cache_evicted_tokens", "Токенов, вытесненных из radix-кэша", registry=REGISTRY
+)
+
+# Кэш ответов
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "oracle_response_cache_lookups", "Обращений к кэшу ответов (temperature=0)", ["result"], registry=REGISTRY
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "oracle_response_cache_entries", "Ответов в кэше", registry=REGISTRY
+)
+RESPONSE_CACHE_EVICTIONS = Counter(
+    "oracle_response_cache_evictions", "Вытесненных ответов (size — LRU, ttl — по возрасту)", ["reason"],
+    registry=REGISTRY
+)
+
+# Структурированный вывод (response_format)
+STRUCTURED_COMPILE_LOOKUPS = Counter(
+    "oracle_structured_compile_lookups", "Обращений к кэшу автоматов response_format", ["result"],
+    registry=REGISTRY
+)
+STRUCTURED_COMPILE_TIME = Histogram(
+    "oracle_structured_compile_seconds", "Компиляция JSON Schema/regex в байтовый DFA",
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+STRUCTURED_MASK_BUILD_TIME = Histogram(
+    "oracle_structured_mask_build_seconds", "Построение маски токенов при первом посещении состояния DFA",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0), registry=REGISTRY
+)
+
+# Токенизация
+TOKENIZER_QUEUE_TIME = Histogram(
+    "oracle_tokenizer_queue_seconds", "Ожидание свободного потока токенизации", ["op"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0), registry=REGISTRY
+)
+TOKENIZATION_TIME = Histogram(
+    "oracle_tokenization_seconds", "Время кодирования/декодирования в потоке токенизации", ["op"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0), registry=REGISTRY
+)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Текст экспозиции Prometheus и его content-type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: число и длительность HTTP-запросов по шаблону пути.
+
+    Чистый ASGI, а не BaseHTTPMiddleware: тело ответа не буферизуется, SSE
+    идёт без задержек, на запрос — два perf_counter и две метрики. Путь
+    берётся из шаблона маршрута (/v1/chat/completions), неизвестные пути
+    сводятся к "other", чтобы не раздувать кардинальность.
+    """
+
+    def __init__(self, app, excluded_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            path = getattr(scope.get("route"), "path", "other")
+            HTTP_REQUESTS.labels(scope["method"], path, str(status)).inc()
+            HTTP_REQUEST_DURATION.labels(path).observe(time.perf_counter() - start)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Prefix Cache
+Общий префикс промпта (системные токены и intro): токены и KV считаются один раз
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from .tokenizer import OracleTokenizer
+from . import metrics
+
+
+class PrefixEntry:
+    """Токены общего префикса и KV-состояние бэкенда для них"""
+
+    def __init__(self, key: str, token_ids: List[int]):
+        self.key = key
+        self.token_ids = token_ids
+        self.kv = None  # заполняет бэкенд при первом prefill (в потоке движка)
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+
+class PrefixCache:
+    """LRU-кэш префиксов по sha256 текста.
+
+    Токенизация префикса выполняется один раз на запись; KV хранится в
+    записи, так что при вытеснении освобождается вместе с ней.
+    """
+
+    def __init__(self, tokenizer: OracleTokenizer, max_entries: int = 8):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, PrefixEntry]" = OrderedDict()
+        self._lock = threading.Lock()  # вызывается из потоков токенизации
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[PrefixEntry]:
+        """Запись для префикса (создаётся и токенизируется при промахе)"""
+        if not text or self.max_entries <= 0:
+            return None
+        key = self.key(text)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                entry.hits += 1
+                metrics.PREFIX_CACHE_LOOKUPS.labels("hit").inc()
+                return entry
+
+        metrics.PREFIX_CACHE_LOOKUPS.labels("miss").inc()
+        entry = PrefixEntry(key, self.tokenizer.encode(text))
+        with self._lock:
+            # Параллельный промах мог уже добавить запись: оставить первую
+            entry = self.entries.setdefault(key, entry)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
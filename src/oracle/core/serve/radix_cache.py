@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Radix Prompt Cache
+Radix-дерево по id токенов с KV-состоянием: повторная история чата не проходит prefill заново
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import heapq
+import itertools
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+
+# KV отрезка токенов по слоям: (ключи [H, n, D] по слоям, значения [H, n, D] по слоям)
+KVChunk = Tuple[list, list]
+
+
+class RadixNode:
+    """Ребро дерева: отрезок токенов и его KV"""
+
+    _clock = itertools.count()
+
+    def __init__(self, token_ids: List[int], kv: Optional[KVChunk], parent: Optional["RadixNode"]):
+        self.token_ids = token_ids
+        self.kv = kv
+        self.parent = parent
+        self.children: Dict[int, "RadixNode"] = {}
+        self.nbytes = sum(t.numel() * t.element_size() for t in kv[0] + kv[1]) if kv else 0
+        self.touch()
+
+    def touch(self):
+        self.last_access = next(self._clock)
+
+    def __lt__(self, other: "RadixNode") -> bool:
+        return self.last_access < other.last_access
+
+    def split(self, length: int) -> "RadixNode":
+        """Разрезать ребро: вернуть новый родитель с первыми length токенами.
+
+        Обе части копируются, чтобы вытеснение одной из них действительно
+        освобождало память.
+        """
+        keys, values = self.kv
+        head = RadixNode(self.token_ids[:length],
+                         ([k[:, :length].clone() for k in keys], [v[:, :length].clone() for v in values]),
+                         self.parent)
+        head.last_access = self.last_access
+        self.parent.children[self.token_ids[0]] = head
+        head.children[self.token_ids[length]] = self
+
+        self.token_ids = self.token_ids[length:]
+        self.kv = ([k[:, length:].clone() for k in keys], [v[:, length:].clone() for v in values])
+        self.parent = head
+        self.nbytes -= head.nbytes
+        return head
+
+
+class RadixPromptCache:
+    """Кэш KV промптов с поиском самого длинного общего префикса.
+
+    Многоходовый чат присылает всю историю заново: новая реплика — это
+    старый промпт, ответ ассистента и новое сообщение. Завершённая
+    последовательность вставляет свои токены и KV в дерево, следующий
+    запрос берёт самый длинный совпавший префикс и считает prefill с этого
+    места. При превышении max_bytes вытесняются листья по LRU (родитель,
+    оставшийся без детей, становится следующим кандидатом).
+
+    Все методы вызываются из потока движка, блокировки не нужны.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.root = RadixNode([], None, None)
+        self.nbytes = 0
+        self.num_tokens = 0
+
+    def match(self, token_ids: List[int]) -> Tuple[int, List[KVChunk]]:
+        """Длина самого длинного закэшированного префикса и его KV по отрезкам"""
+        node, matched, chunks = self.root, 0, []
+        while matched < len(token_ids):
+            child = node.children.get(token_ids[matched])
+            if child is None:
+                break
+            length = _common_length(child.token_ids, token_ids[matched:])
+            child.touch()
+            keys, values = child.kv
+            if length < len(child.token_ids):
+                chunks.append(([k[:, :length] for k in keys], [v[:, :length] for v in values]))
+                matched += length
+                break
+            chunks.append(child.kv)
+            matched += length
+            node = child
+
+        metrics.PROMPT_CACHE_LOOKUPS.labels("hit" if matched else "miss").inc()
+        return matched, chunks
+
+    def insert(self, token_ids: List[int], read_kv: Callable[[int, int], KVChunk]):
+        """Добавить последовательность; read_kv(start, end) читает KV только для новых токенов"""
+        node, matched = self.root, 0
+        while matched < len(token_ids):
+            child = node.children.get(token_ids[matched])
+            if child is None:
+                break
+            length = _common_length(child.token_ids, token_ids[matched:])
+            child.touch()
+            if length < len(child.token_ids):
+                child = child.split(length)
+            matched += length
+            node = child
+
+        if matched < len(token_ids):
+            leaf = RadixNode(token_ids[matched:], read_kv(matched, len(token_ids)), node)
+            node.children[leaf.token_ids[0]] = leaf
+            self.nbytes += leaf.nbytes
+            self.num_tokens += len(leaf.token_ids)
+        self.evict()
+
+    def evict(self):
+        """Вытеснить давно не использованные листья до бюджета памяти"""
+        if self.nbytes <= self.max_bytes:
+            metrics.PROMPT_CACHE_BYTES.set(self.nbytes)
+            return
+        leaves = [node for node in self._nodes() if not node.children]
+        heapq.heapify(leaves)
+        while self.nbytes > self.max_bytes and leaves:
+            leaf = heapq.heappop(leaves)
+            parent = leaf.parent
+            del parent.children[leaf.token_ids[0]]
+            self.nbytes -= leaf.nbytes
+            self.num_tokens -= len(leaf.token_ids)
+            metrics.PROMPT_CACHE_EVICTED_TOKENS.inc(len(leaf.token_ids))
+            if parent is not self.root and not parent.children:
+                heapq.heappush(leaves, parent)
+        metrics.PROMPT_CACHE_BYTES.set(self.nbytes)
+
+    def _nodes(self) -> List[RadixNode]:
+        nodes, stack = [], list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children.values())
+        return nodes
+
+
+def _common_length(a: List[int], b: List[int]) -> int:
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
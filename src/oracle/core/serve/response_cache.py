@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Response Cache
+Кэш готовых ответов для детерминированных запросов (temperature=0): точное совпадение, LRU и TTL
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence as SequenceType
+
+from . import metrics
+
+
+class CachedResponse:
+    """Сохранённый ответ: токены, текст и данные для usage"""
+
+    def __init__(self, output_ids: List[int], text: str, finish_reason: str, prompt_tokens: int):
+        self.output_ids = list(output_ids)
+        self.text = text
+        self.finish_reason = finish_reason
+        self.prompt_tokens = prompt_tokens
+        self.created = time.monotonic()
+
+    async def replay(self, chunk_tokens: int = 16) -> AsyncIterator[List[int]]:
+        """Токены ответа порциями, как их отдаёт InferenceEngine.stream"""
+        for start in range(0, len(self.output_ids), chunk_tokens):
+            yield self.output_ids[start:start + chunk_tokens]
+
+
+class ResponseCache:
+    """Кэш ответов по точному совпадению запроса.
+
+    Ключ — sha256 от модели, нормализованных сообщений (только role и
+    content, role в нижнем регистре, канонический JSON) и полей сэмплинга
+    из запроса как есть (stop-строки, response_format), без токенизации и
+    компиляции автомата. Кэшируются только greedy-запросы (temperature=0):
+    их ответ не зависит от случая и от соседей по батчу — в eval MoE всегда
+    dropless (capacity-диспетчеризация только для обучения), а маршрутизация
+    токена не зависит от других последовательностей. Записи вытесняются по
+    LRU при превышении max_entries и по возрасту ttl секунд (0 — без TTL).
+
+    Работает в event loop, блокировки не нужны.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(model: str, messages: SequenceType, sampling: Dict[str, Any]) -> Optional[str]:
+        """Ключ запроса или None, если ответ недетерминирован.
+
+        sampling — поля запроса (max_tokens, temperature, top_p, top_k,
+        штрафы, stop, response_format) в том виде, в каком они пришли.
+        """
+        if sampling.get("temperature") != 0:
+            return None
+        stop = sampling.get("stop")
+        payload = {
+            "model": model,
+            "messages": [{"role": msg.role.strip().lower(), "content": msg.content} for msg in messages],
+            "sampling": dict(sampling, stop=[stop] if isinstance(stop, str) else stop),
+        }
+        canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl and time.monotonic() - entry.created > self.ttl:
+            del self._entries[key]
+            metrics.RESPONSE_CACHE_EVICTIONS.labels("ttl").inc()
+            metrics.RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+            entry = None
+        if entry is None:
+            metrics.RESPONSE_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        metrics.RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.RESPONSE_CACHE_EVICTIONS.labels("size").inc()
+        metrics.RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        metrics.RESPONSE_CACHE_ENTRIES.set(0)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Continuous Batching Scheduler
+Iteration-level планирование: новые запросы вливаются в decode-батч на каждом шаге
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+from .backends import PRIORITY_CLASSES, Sequence
+
+
+class SchedulerOutput:
+    """План одного шага: последовательности на prefill и на decode"""
+
+    def __init__(self, prefill: List[Sequence], decode: List[Sequence]):
+        self.prefill = prefill
+        self.decode = decode
+
+    @property
+    def num_batched_tokens(self) -> int:
+        return sum(seq.num_prefill_tokens for seq in self.prefill) + len(self.decode)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.prefill and not self.decode
+
+
+class FairQueue:
+    """Очередь ожидающих запросов: строгий приоритет классов, WFQ по арендаторам.
+
+    Внутри класса у каждого арендатора своя FIFO и виртуальное время: за
+    допущенный запрос оно растёт на (prefill + max_tokens) / weight.
+    Следующим идёт голова очереди арендатора с наименьшим виртуальным
+    временем, поэтому клиент с тысячей запросов получает свою долю, а не
+    всю очередь. Вернувшийся после простоя арендатор стартует не раньше
+    минимума активных: простой не копит кредит.
+    """
+
+    def __init__(self, tenant_weights: Optional[Dict[str, float]] = None):
+        self.tenant_weights = dict(tenant_weights or {})
+        self.queues: Dict[str, "OrderedDict[str, Deque[Sequence]]"] = {c: OrderedDict() for c in PRIORITY_CLASSES}
+        self.virtual_time: Dict[str, Dict[str, float]] = {c: {} for c in PRIORITY_CLASSES}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, seq: Sequence) -> bool:
+        queue = self.queues[seq.priority].get(seq.tenant)
+        return queue is not None and seq in queue
+
+    def depth(self, priority: str) -> int:
+        return sum(len(queue) for queue in self.queues[priority].values())
+
+    def append(self, seq: Sequence):
+        queues, virtual_time = self.queues[seq.priority], self.virtual_time[seq.priority]
+        if seq.tenant not in queues:
+            active = min((virtual_time[t] for t in queues), default=0.0)
+            virtual_time[seq.tenant] = max(virtual_time.get(seq.tenant, 0.0), active)
+            queues[seq.tenant] = deque()
+        queues[seq.tenant].append(seq)
+        self._size += 1
+
+    def remove(self, seq: Sequence) -> bool:
+        queues = self.queues[seq.priority]
+        queue = queues.get(seq.tenant)
+        if queue is None or seq not in queue:
+            return False
+        queue.remove(seq)
+        self._size -= 1
+        if not queue:
+            del queues[seq.tenant]
+            if not queues:
+                # Класс опустел: виртуальное время начинается заново
+                self.virtual_time[seq.priority].clear()
+        return True
+
+    def peek(self, classes: Iterable[str] = PRIORITY_CLASSES) -> Optional[Sequence]:
+        """Следующий запрос из первого непустого класса среди classes"""
+        for priority in classes:
+            queues = self.queues[priority]
+            if queues:
+                virtual_time = self.virtual_time[priority]
+                return queues[min(queues, key=virtual_time.__getitem__)][0]
+        return None
+
+    def pop(self, seq: Sequence):
+        """Забрать запрос, выбранный peek, и начислить его стоимость арендатору"""
+        cost = seq.num_prefill_tokens + seq.sampling.max_tokens
+        self.virtual_time[seq.priority][seq.tenant] += cost / self.tenant_weights.get(seq.tenant, 1.0)
+        self.remove(seq)
+
+
+class Scheduler:
+    """Планировщик с бюджетом токенов на шаг, классами приоритета и WFQ.
+
+    Каждый шаг все running-последовательности получают по decode-токену,
+    остаток бюджета max_num_batched_tokens отдаётся prefill ожидающих
+    запросов в порядке FairQueue, пока есть места в батче. Класс может
+    быть ограничен числом мест (class_slot_limits), чтобы batch-клиенты
+    не занимали все слоты надолго и интерактивный запрос не ждал
+    окончания чужих длинных генераций. Один prefill длиннее бюджета
+    допускается, только если шаг иначе пуст.
+
+    Эмбеддинги (task="embed") завершаются на том же шаге и не держат ни
+    decode-места, ни слота KV: их ограничивает только бюджет токенов шага,
+    а не max_batch_size и class_slot_limits.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_num_batched_tokens: int = 4096,
+                 tenant_weights: Optional[Dict[str, float]] = None,
+                 class_slot_limits: Optional[Dict[str, int]] = None):
+        self.max_batch_size = max_batch_size
+        self.max_num_batched_tokens = max_num_batched_tokens
+        self.class_slot_limits = dict(class_slot_limits or {})
+        self.waiting = FairQueue(tenant_weights)
+        self.running: List[Sequence] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.waiting)
+
+    @property
+    def num_running(self) -> int:
+        """Последовательностей, занимающих места decode-батча (без эмбеддингов шага)"""
+        return sum(seq.task != "embed" for seq in self.running)
+
+    @property
+    def occupancy(self) -> float:
+        """Доля занятых мест в decode-батче"""
+        return self.num_running / self.max_batch_size
+
+    def has_work(self) -> bool:
+        return bool(self.waiting or self.running)
+
+    def add(self, seq: Sequence):
+        """Поставить новый запрос в очередь"""
+        self.waiting.append(seq)
+
+    def abort(self, seq: Sequence) -> bool:
+        """Убрать запрос из очереди или батча (True, если он там был)"""
+        if seq in self.running:
+            self.running.remove(seq)
+            return True
+        return self.waiting.remove(seq)
+
+    def schedule(self) -> SchedulerOutput:
+        """Собрать следующий шаг в пределах бюджета токенов и размера батча"""
+        decode = list(self.running)
+        budget = self.max_num_batched_tokens - len(decode)
+        prefill = []
+        occupied = Counter(seq.priority for seq in decode)
+        num_slots = len(decode)
+
+        while self.waiting:
+            seq = self._next_waiting(num_slots, occupied)
+            if seq is None:
+                break
+            cost = seq.num_prefill_tokens
+            if cost > budget and (prefill or decode):
+                break
+            self.waiting.pop(seq)
+            prefill.append(seq)
+            budget -= cost
+            if seq.task != "embed":
+                num_slots += 1
+                occupied[seq.priority] += 1
+
+        self.running = decode + prefill
+        return SchedulerOutput(prefill, decode)
+
+    def _next_waiting(self, num_slots: int, occupied: Counter) -> Optional[Sequence]:
+        """Голова первого класса, которую можно взять: эмбеддинг всегда, генерацию — при свободном месте"""
+        for priority in PRIORITY_CLASSES:
+            seq = self.waiting.peek([priority])
+            if seq is None:
+                continue
+            limit = self.class_slot_limits.get(priority, self.max_batch_size)
+            if seq.task == "embed" or (num_slots < self.max_batch_size and occupied[priority] < limit):
+                return seq
+        return None
+
+    def evict_finished(self) -> List[Sequence]:
+        """Убрать завершённые последовательности из батча сразу после шага"""
+        finished = [seq for seq in self.running if seq.finished]
+        if finished:
+            self.running = [seq for seq in self.running if not seq.finished]
+        return finished
+
+
+def parse_tenant_weights(spec: str) -> Dict[str, float]:
+    """Веса арендаторов из строки "key1=4,key2=0.5" (ORACLE_TENANT_WEIGHTS)"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        tenant, _, weight = item.rpartition("=")
+        if not tenant or float(weight) <= 0:
+            raise ValueError(f"Некорректный вес арендатора: {item}")
+        weights[tenant] = float(weight)
+    return weights
@@ -0,0 +1,777 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Structured Output
+Ограниченное декодирование: JSON Schema и regex -> байтовый DFA -> маски допустимых токенов по состояниям
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics
+
+MAX_CODEPOINT = 0x10FFFF
+SURROGATES = (0xD800, 0xDFFF)
+MAX_REPEAT = 1000         # верхняя граница счётчика {m,n}
+MAX_NFA_STATES = 200000
+MAX_DFA_STATES = 20000
+DEAD = -1                 # переход в никуда: байт недопустим
+
+# Символьные классы в диапазонах кодовых точек
+DIGIT = [(0x30, 0x39)]
+WORD = [(0x30, 0x39), (0x41, 0x5A), (0x5F, 0x5F), (0x61, 0x7A)]
+SPACE = [(0x09, 0x0D), (0x20, 0x20)]
+
+
+# Диапазоны кодовых точек
+
+def _normalize(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Отсортированные непересекающиеся диапазоны без суррогатов"""
+    merged: List[List[int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    result = []
+    for lo, hi in merged:
+        if hi < SURROGATES[0] or lo > SURROGATES[1]:
+            result.append((lo, hi))
+            continue
+        if lo < SURROGATES[0]:
+            result.append((lo, SURROGATES[0] - 1))
+        if hi > SURROGATES[1]:
+            result.append((SURROGATES[1] + 1, hi))
+    return result
+
+
+def _negate(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    result, start = [], 0
+    for lo, hi in _normalize(ranges):
+        if lo > start:
+            result.append((start, lo - 1))
+        start = hi + 1
+    if start <= MAX_CODEPOINT:
+        result.append((start, MAX_CODEPOINT))
+    return _normalize(result)
+
+
+def _byte_ranges(lo: List[int], hi: List[int]) -> List[List[Tuple[int, int]]]:
+    """Все UTF-8 последовательности одной длины между кодировками lo и hi как цепочки диапазонов байт"""
+    if len(lo) == 1:
+        return [[(lo[0], hi[0])]]
+    if lo[0] == hi[0]:
+        return [[(lo[0], lo[0])] + tail for tail in _byte_ranges(lo[1:], hi[1:])]
+    n = len(lo) - 1
+    result = [[(lo[0], lo[0])] + tail for tail in _byte_ranges(lo[1:], [0xBF] * n)]
+    if lo[0] + 1 <= hi[0] - 1:
+        result.append([(lo[0] + 1, hi[0] - 1)] + [(0x80, 0xBF)] * n)
+    result.extend([(hi[0], hi[0])] + tail for tail in _byte_ranges([0x80] * n, hi[1:]))
+    return result
+
+
+def _utf8_sequences(lo: int, hi: int) -> List[List[Tuple[int, int]]]:
+    """Диапазон кодовых точек -> цепочки диапазонов байт его UTF-8 кодировок"""
+    result = []
+    for start, end in ((0x0, 0x7F), (0x80, 0x7FF), (0x800, 0xFFFF), (0x10000, MAX_CODEPOINT)):
+        a, b = max(lo, start), min(hi, end)
+        if a <= b:
+            result.extend(_byte_ranges(list(chr(a).encode("utf-8")), list(chr(b).encode("utf-8"))))
+    return result
+
+
+# Разбор регулярного выражения
+
+class _RegexParser:
+    """Регулярное выражение -> дерево ("set", диапазоны) | ("cat", узлы) | ("alt", узлы) | ("repeat", узел, min, max).
+
+    Поддерживаются литералы, ., классы [...] и [^...], \\d \\w \\s (и
+    отрицания), \\xHH, \\uHHHH, группы (...) и (?:...), |, *, +, ?, {m},
+    {m,}, {m,n}; ленивые квантификаторы эквивалентны жадным (язык тот же).
+    ^ и $ допустимы только на краях: совпадение всегда полное.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.pos = 0
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"regex: {message} (позиция {self.pos})")
+
+    def peek(self) -> Optional[str]:
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+    def take(self) -> str:
+        if self.pos >= len(self.pattern):
+            raise self.error("неожиданный конец выражения")
+        char = self.pattern[self.pos]
+        self.pos += 1
+        return char
+
+    def parse(self):
+        if self.peek() == "^":
+            self.pos += 1
+        node = self._alternation()
+        if self.peek() is not None:
+            raise self.error(f"неожиданный символ {self.peek()!r}")
+        return node
+
+    def _alternation(self):
+        branches = [self._concatenation()]
+        while self.peek() == "|":
+            self.pos += 1
+            branches.append(self._concatenation())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _concatenation(self):
+        items = []
+        while self.peek() is not None and self.peek() not in "|)":
+            if self.peek() == "$" and self.pos == len(self.pattern) - 1:
+                self.pos += 1
+                break
+            items.append(self._repeat())
+        return items[0] if len(items) == 1 else ("cat", items)
+
+    def _repeat(self):
+        node = self._atom()
+        while True:
+            char = self.peek()
+            if char == "*":
+                bounds = (0, None)
+            elif char == "+":
+                bounds = (1, None)
+            elif char == "?":
+                bounds = (0, 1)
+            elif char == "{":
+                match = re.compile(r"\{(\d+)(,(\d*))?\}").match(self.pattern, self.pos)
+                if match is None:
+                    return node
+                low = int(match.group(1))
+                high = low if match.group(2) is None else (int(match.group(3)) if match.group(3) else None)
+                if high is not None and high < low:
+                    raise self.error(f"неверный счётчик {match.group(0)}")
+                if max(low, high or 0) > MAX_REPEAT:
+                    raise self.error(f"счётчик больше {MAX_REPEAT}")
+                self.pos = match.end() - 1
+                bounds = (low, high)
+            else:
+                return node
+            self.pos += 1
+            if self.peek() == "?":
+                self.pos += 1  # ленивый вариант
+            node = ("repeat", node, bounds[0], bounds[1])
+
+    def _atom(self):
+        char = self.take()
+        if char == "(":
+            if self.pattern.startswith("?:", self.pos):
+                self.pos += 2
+            elif self.peek() == "?":
+                raise self.error("поддерживаются только группы (...) и (?:...)")
+            node = self._alternation()
+            if self.take() != ")":
+                raise self.error("ожидается )")
+            return node
+        if char == "[":
+            return ("set", self._class())
+        if char == ".":
+            return ("set", _negate([(0x0A, 0x0A)]))
+        if char == "\\":
+            return ("set", self._escape())
+        if char in "*+?":
+            raise self.error(f"нечего повторять перед {char!r}")
+        if char in "^$":
+            raise self.error(f"якорь {char!r} допустим только на краю выражения")
+        return ("set", [(ord(char), ord(char))])
+
+    def _escape(self, in_class: bool = False) -> List[Tuple[int, int]]:
+        char = self.take()
+        classes = {"d": DIGIT, "w": WORD, "s": SPACE}
+        if char in classes:
+            return classes[char]
+        if char.lower() in classes:
+            return _negate(classes[char.lower()])
+        controls = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v", "0": "\0"}
+        if char in controls:
+            code = ord(controls[char])
+        elif char == "b" and in_class:
+            code = 0x08
+        elif char in "xu":
+            width = 2 if char == "x" else 4
+            digits = self.pattern[self.pos:self.pos + width]
+            if not re.fullmatch(f"[0-9a-fA-F]{{{width}}}", digits):
+                raise self.error(f"ожидается \\{char} и {width} hex-цифры")
+            self.pos += width
+            code = int(digits, 16)
+        elif char.isalnum():
+            raise self.error(f"неподдерживаемая последовательность \\{char}")
+        else:
+            code = ord(char)
+        return [(code, code)]
+
+    def _class(self) -> List[Tuple[int, int]]:
+        negated = self.peek() == "^"
+        if negated:
+            self.pos += 1
+        ranges: List[Tuple[int, int]] = []
+        first = True
+        while True:
+            char = self.take()
+            if char == "]" and not first:
+                break
+            first = False
+            if char == "\\":
+                items = self._escape(in_class=True)
+                if len(items) != 1 or items[0][0] != items[0][1]:
+                    ranges.extend(items)
+                    continue
+                low = items[0][0]
+            else:
+                low = ord(char)
+            if self.peek() == "-" and self.pattern[self.pos + 1:self.pos + 2] not in ("]", ""):
+                self.pos += 1
+                char = self.take()
+                high_items = self._escape(in_class=True) if char == "\\" else [(ord(char), ord(char))]
+                if len(high_items) != 1 or high_items[0][0] != high_items[0][1]:
+                    raise self.error("класс не может быть границей диапазона")
+                high = high_items[0][0]
+                if high < low:
+                    raise self.error("перевёрнутый диапазон в классе")
+                ranges.append((low, high))
+            else:
+                ranges.append((low, low))
+        return _negate(ranges) if negated else _normalize(ranges)
+
+
+# Автоматы
+
+class _NFA:
+    """Автомат Томпсона над байтами: переходы по диапазонам байт и ε-переходы"""
+
+    def __init__(self):
+        self.edges: List[List[Tuple[int, int, int]]] = []
+        self.epsilon: List[List[int]] = []
+
+    def state(self) -> int:
+        if len(self.edges) >= MAX_NFA_STATES:
+            raise ValueError("regex: слишком большой автомат")
+        self.edges.append([])
+        self.epsilon.append([])
+        return len(self.edges) - 1
+
+    def build(self, node) -> Tuple[int, int]:
+        """Фрагмент (вход, выход) для узла дерева"""
+        kind = node[0]
+        if kind == "set":
+            start, end = self.state(), self.state()
+            for lo, hi in node[1]:
+                for chain in _utf8_sequences(lo, hi):
+                    current = start
+                    for i, (byte_lo, byte_hi) in enumerate(chain):
+                        target = end if i == len(chain) - 1 else self.state()
+                        self.edges[current].append((byte_lo, byte_hi, target))
+                        current = target
+            return start, end
+        if kind == "cat":
+            start = end = self.state()
+            for item in node[1]:
+                item_start, item_end = self.build(item)
+                self.epsilon[end].append(item_start)
+                end = item_end
+            return start, end
+        if kind == "alt":
+            start, end = self.state(), self.state()
+            for branch in node[1]:
+                branch_start, branch_end = self.build(branch)
+                self.epsilon[start].append(branch_start)
+                self.epsilon[branch_end].append(end)
+            return start, end
+        # repeat: min обязательных копий, затем звезда или (max - min) вложенных необязательных
+        _, item, low, high = node
+        start = end = self.state()
+        for _ in range(low):
+            item_start, item_end = self.build(item)
+            self.epsilon[end].append(item_start)
+            end = item_end
+        final = self.state()
+        if high is None:
+            item_start, item_end = self.build(item)
+            self.epsilon[end].extend([item_start, final])
+            self.epsilon[item_end].extend([item_start, final])
+        else:
+            for _ in range(high - low):
+                item_start, item_end = self.build(item)
+                self.epsilon[end].extend([item_start, final])
+                end = item_end
+            self.epsilon[end].append(final)
+        return start, final
+
+
+class ByteDFA:
+    """Детерминированный автомат над байтами UTF-8.
+
+    transitions[state][byte] — следующее состояние или DEAD; из каждого
+    живого состояния достижимо принимающее (тупиковые ветви удалены),
+    поэтому любой допустимый байт оставляет путь к полному совпадению.
+    """
+
+    def __init__(self, transitions: List[List[int]], accepting: List[bool]):
+        self.transitions = transitions
+        self.accepting = accepting
+        self.start = 0
+
+    @property
+    def num_states(self) -> int:
+        return len(self.transitions)
+
+    def walk(self, state: int, data: bytes) -> int:
+        transitions = self.transitions
+        for byte in data:
+            state = transitions[state][byte]
+            if state == DEAD:
+                return DEAD
+        return state
+
+    def fullmatch(self, data: bytes) -> bool:
+        state = self.walk(self.start, data)
+        return state != DEAD and self.accepting[state]
+
+    @classmethod
+    def from_regex(cls, pattern: str) -> "ByteDFA":
+        """Разбор, автомат Томпсона и построение подмножеств"""
+        nfa = _NFA()
+        nfa_start, nfa_end = nfa.build(_RegexParser(pattern).parse())
+
+        closures: Dict[int, frozenset] = {}
+
+        def closure(states) -> frozenset:
+            result, stack = set(states), list(states)
+            while stack:
+                for target in nfa.epsilon[stack.pop()]:
+                    if target not in result:
+                        result.add(target)
+                        stack.append(target)
+            return frozenset(result)
+
+        start = closure([nfa_start])
+        ids: Dict[frozenset, int] = {start: 0}
+        subsets = [start]
+        transitions: List[List[int]] = []
+        for subset in subsets:
+            targets: Dict[int, set] = {}
+            for nfa_state in subset:
+                for lo, hi, target in nfa.edges[nfa_state]:
+                    for byte in range(lo, hi + 1):
+                        targets.setdefault(byte, set()).add(target)
+            row = [DEAD] * 256
+            for byte, states in targets.items():
+                key = frozenset(states)
+                next_subset = closures.get(key)
+                if next_subset is None:
+                    next_subset = closures[key] = closure(states)
+                if next_subset not in ids:
+                    if len(subsets) >= MAX_DFA_STATES:
+                        raise ValueError(f"regex: больше {MAX_DFA_STATES} состояний автомата")
+                    ids[next_subset] = len(subsets)
+                    subsets.append(next_subset)
+                row[byte] = ids[next_subset]
+            transitions.append(row)
+        accepting = [nfa_end in subset for subset in subsets]
+
+        # Живые состояния: из них достижимо принимающее
+        reverse: List[List[int]] = [[] for _ in subsets]
+        for state, row in enumerate(transitions):
+            for target in set(row) - {DEAD}:
+                reverse[target].append(state)
+        live = [False] * len(subsets)
+        stack = [state for state, accept in enumerate(accepting) if accept]
+        for state in stack:
+            live[state] = True
+        while stack:
+            for source in reverse[stack.pop()]:
+                if not live[source]:
+                    live[source] = True
+                    stack.append(source)
+        if not live[0]:
+            raise ValueError("regex: выражению не соответствует ни одна строка")
+        for row in transitions:
+            for byte, target in enumerate(row):
+                if target != DEAD and not live[target]:
+                    row[byte] = DEAD
+        return cls(*_minimize(transitions, accepting))
+
+
+def _minimize(transitions: List[List[int]], accepting: List[bool]) -> Tuple[List[List[int]], List[bool]]:
+    """Минимизация Мура: состояния с одинаковым будущим склеиваются (меньше состояний — меньше масок).
+
+    Разбиение уточняется по (класс, классы переходов по байтам), пока
+    число классов растёт; новые номера — в порядке обхода из старта (0).
+    """
+    # Байты с одинаковыми столбцами переходов неразличимы: достаточно по одному представителю
+    columns: Dict[tuple, int] = {}
+    for byte in range(256):
+        columns.setdefault(tuple(row[byte] for row in transitions), byte)
+    reduced = [[row[byte] for byte in columns.values()] for row in transitions]
+
+    classes = [int(accept) for accept in accepting]
+    num_classes = len(set(classes))
+    while True:
+        signatures: Dict[tuple, int] = {}
+        refined = [signatures.setdefault((classes[state], tuple(DEAD if t == DEAD else classes[t] for t in row)),
+                                         len(signatures))
+                   for state, row in enumerate(reduced)]
+        classes = refined
+        if len(signatures) == num_classes:
+            break
+        num_classes = len(signatures)
+
+    numbering = {classes[0]: 0}
+    representatives = [0]
+    for state in representatives:
+        for target in transitions[state]:
+            if target != DEAD and classes[target] not in numbering:
+                numbering[classes[target]] = len(representatives)
+                representatives.append(target)
+    minimal = [[DEAD if t == DEAD else numbering[classes[t]] for t in transitions[state]]
+               for state in representatives]
+    return minimal, [accepting[state] for state in representatives]
+
+
+# JSON Schema -> regex
+
+STRING_CHAR = r'([^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})'
+STRING = f'"{STRING_CHAR}*"'
+INTEGER = r'-?(0|[1-9][0-9]*)'
+NUMBER = INTEGER + r'(\.[0-9]+)?([eE][+-]?[0-9]+)?'
+BOOLEAN = r'(true|false)'
+NULL = r'null'
+ITEM_SEPARATOR = r',[ ]?'
+KEY_SEPARATOR = r':[ ]?'
+STRING_FORMATS = {
+    "date": r'"[0-9]{4}-[0-9]{2}-[0-9]{2}"',
+    "time": r'"[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?"',
+    "date-time": r'"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})"',
+    "uuid": r'"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"',
+}
+
+
+def json_value_regex(depth: int = 2) -> str:
+    """Любое JSON-значение с вложенностью массивов и объектов не глубже depth"""
+    scalar = f"{STRING}|{NUMBER}|{BOOLEAN}|{NULL}"
+    if depth <= 0:
+        return f"({scalar})"
+    value = json_value_regex(depth - 1)
+    array = rf"\[({value}({ITEM_SEPARATOR}{value})*)?\]"
+    member = f"{STRING}{KEY_SEPARATOR}{value}"
+    obj = rf"\{{({member}({ITEM_SEPARATOR}{member})*)?\}}"
+    return f"({scalar}|{array}|{obj})"
+
+
+def json_object_regex(depth: int = 2) -> str:
+    """JSON-объект (response_format json_object)"""
+    member = f"{STRING}{KEY_SEPARATOR}{json_value_regex(depth - 1)}"
+    return rf"\{{({member}({ITEM_SEPARATOR}{member})*)?\}}"
+
+
+def _literal(value: Any) -> str:
+    return re.escape(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+
+def _alternatives(patterns: List[str]) -> str:
+    return "(" + "|".join(patterns) + ")"
+
+
+def _repeat_bounds(low: int, high: Optional[int]) -> str:
+    return f"{{{low},}}" if high is None else f"{{{low},{high}}}"
+
+
+def json_schema_to_regex(schema: Any, depth: int = 2) -> str:
+    """JSON Schema -> regex её компактных JSON-представлений.
+
+    Поддерживаются type (в т.ч. список), const, enum, anyOf/oneOf,
+    allOf из одной схемы; string: minLength/maxLength, pattern (целиком
+    содержимое строки), format date/time/date-time/uuid; integer/number
+    (minimum >= 0 убирает знак, обе границы у integer ограничивают число
+    цифр; сами значения границ не проверяются); array: items, minItems/maxItems; object:
+    properties в порядке объявления, required (необязательные можно
+    пропустить). Дополнительные свойства не генерируются, $ref не
+    поддерживается. Схема без type и {} — любое значение глубины depth.
+    """
+    if schema is True or schema == {}:
+        return json_value_regex(depth)
+    if not isinstance(schema, dict):
+        raise ValueError(f"JSON Schema: ожидается объект, получено {type(schema).__name__}")
+    if "$ref" in schema:
+        raise ValueError("JSON Schema: $ref не поддерживается")
+    if "const" in schema:
+        return _literal(schema["const"])
+    if "enum" in schema:
+        if not schema["enum"]:
+            raise ValueError("JSON Schema: пустой enum")
+        return _alternatives([_literal(value) for value in schema["enum"]])
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            return _alternatives([json_schema_to_regex(sub, depth) for sub in schema[key]])
+    if "allOf" in schema:
+        if len(schema["allOf"]) != 1:
+            raise ValueError("JSON Schema: allOf поддерживается только из одной схемы")
+        return json_schema_to_regex(schema["allOf"][0], depth)
+
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        return _alternatives([json_schema_to_regex({**schema, "type": t}, depth) for t in schema_type])
+    if schema_type is None:
+        if "properties" in schema:
+            schema_type = "object"
+        elif "items" in schema:
+            schema_type = "array"
+        else:
+            return json_value_regex(depth)
+
+    if schema_type == "string":
+        if "pattern" in schema:
+            pattern = schema["pattern"]
+            pattern = pattern[1:] if pattern.startswith("^") else pattern
+            pattern = pattern[:-1] if pattern.endswith("$") and not pattern.endswith("\\$") else pattern
+            return f'"({pattern})"'
+        if schema.get("format") in STRING_FORMATS:
+            return STRING_FORMATS[schema["format"]]
+        low, high = schema.get("minLength", 0), schema.get("maxLength")
+        if low == 0 and high is None:
+            return STRING
+        return f'"{STRING_CHAR}{_repeat_bounds(low, high)}"'
+    if schema_type in ("integer", "number"):
+        pattern = INTEGER if schema_type == "integer" else NUMBER
+        bounds = [schema.get("minimum", schema.get("exclusiveMinimum")),
+                  schema.get("maximum", schema.get("exclusiveMaximum"))]
+        bounds = [value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+                  for value in bounds]
+        if schema_type == "integer" and None not in bounds:
+            # Обе границы известны: не больше цифр, чем у большей по модулю
+            digits = len(str(int(max(abs(value) for value in bounds))))
+            pattern = f"-?(0|[1-9][0-9]{{0,{digits - 1}}})"
+        if bounds[0] is not None and bounds[0] >= 0:
+            pattern = pattern[2:]  # без "-?"
+        return f"({pattern})"
+    if schema_type == "boolean":
+        return BOOLEAN
+    if schema_type == "null":
+        return NULL
+    if schema_type == "array":
+        item = json_schema_to_regex(schema.get("items", {}), depth - 1)
+        low, high = schema.get("minItems", 0), schema.get("maxItems")
+        if high == 0:
+            return r"\[\]"
+        rest = f"({ITEM_SEPARATOR}{item}){_repeat_bounds(max(low - 1, 0), None if high is None else high - 1)}"
+        items = f"{item}{rest}"
+        return rf"\[{items}\]" if low > 0 else rf"\[({items})?\]"
+    if schema_type == "object":
+        properties = schema.get("properties")
+        if not properties:
+            return json_object_regex(depth)
+        required = set(schema.get("required", []))
+        members = [(f"{_literal(name)}{KEY_SEPARATOR}{json_schema_to_regex(sub, depth - 1)}", name in required)
+                   for name, sub in properties.items()]
+        # after[i]: свойства с i-го, когда перед ними уже что-то есть (каждое с запятой)
+        after = [""] * (len(members) + 1)
+        for i in range(len(members) - 1, -1, -1):
+            member, is_required = members[i]
+            item = f"{ITEM_SEPARATOR}{member}"
+            after[i] = (item if is_required else f"({item})?") + after[i + 1]
+        # first[i]: свойства с i-го, когда перед ними ничего нет
+        first = [""] * (len(members) + 1)
+        for i in range(len(members) - 1, -1, -1):
+            member, is_required = members[i]
+            first[i] = member + after[i + 1] if is_required else f"({member}{after[i + 1]}|{first[i + 1]})"
+        return rf"\{{{first[0]}\}}"
+    raise ValueError(f"JSON Schema: неизвестный type {schema_type!r}")
+
+
+def response_format_regex(response_format: Optional[Dict[str, Any]]) -> Optional[str]:
+    """response_format запроса (формат OpenAI) -> regex ответа или None без ограничений.
+
+    {"type": "text"}, {"type": "json_object"},
+    {"type": "json_schema", "json_schema": {"name": ..., "schema": {...}}} и
+    расширение {"type": "regex", "regex": "..."}.
+    """
+    if response_format is None:
+        return None
+    if not isinstance(response_format, dict):
+        raise ValueError("response_format должен быть объектом")
+    kind = response_format.get("type", "text")
+    if kind == "text":
+        return None
+    if kind == "json_object":
+        return json_object_regex()
+    if kind == "json_schema":
+        spec = response_format.get("json_schema")
+        if not isinstance(spec, dict) or "schema" not in spec:
+            raise ValueError("response_format json_schema: нужен json_schema.schema")
+        return json_schema_to_regex(spec["schema"])
+    if kind == "regex":
+        pattern = response_format.get("regex")
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError("response_format regex: нужна непустая строка regex")
+        return pattern
+    raise ValueError(f"Неизвестный response_format.type: {kind} (ожидается text, json_object, json_schema, regex)")
+
+
+# Уровень токенов
+
+class TokenVocabulary:
+    """Байты токенов словаря модели для построения масок.
+
+    id вне токенизатора и спецтокены (None) никогда не разрешаются, кроме
+    EOS в принимающих состояниях. Для масок токены упорядочены по убыванию
+    длины: на позиции p байты есть ровно у первых counts[p] токенов.
+    """
+
+    def __init__(self, token_bytes: List[Optional[bytes]], vocab_size: int, eos_token_id: int):
+        token_bytes = list(token_bytes[:vocab_size]) + [None] * max(vocab_size - len(token_bytes), 0)
+        self.token_bytes = [data or None for data in token_bytes]
+        self.vocab_size = vocab_size
+        self.eos_token_id = eos_token_id
+        lengths = [len(data) if data else 0 for data in self.token_bytes]
+        self.order = sorted(range(vocab_size), key=lambda i: -lengths[i])
+        self.max_len = max(lengths, default=0)
+        self.counts = [0] * self.max_len
+        for length in lengths:
+            for position in range(length):
+                self.counts[position] += 1
+        self.num_valid = self.counts[0] if self.max_len else 0
+        self._tensors: Dict[str, tuple] = {}
+
+    def tensors(self, device) -> tuple:
+        """(order [V] long, байты позиции p у первых counts[p] токенов: список uint8-тензоров) на устройстве"""
+        import torch
+
+        key = str(device)
+        if key not in self._tensors:
+            order = torch.tensor(self.order, dtype=torch.long, device=device)
+            columns = [torch.tensor([self.token_bytes[token_id][position] for token_id in self.order[:count]],
+                                    dtype=torch.uint8, device=device)
+                       for position, count in enumerate(self.counts)]
+            self._tensors[key] = (order, columns)
+        return self._tensors[key]
+
+
+class TokenAutomaton:
+    """Ограничение ответа на уровне токенов: DFA по байтам и словарь модели.
+
+    Состояние последовательности — состояние DFA. Маска состояния
+    (bool [vocab_size], True — токен допустим) строится при первом
+    посещении за max_len векторных переходов по всему словарю и кэшируется,
+    так что на decode-шаге маскирование — одна операция над логитами, а
+    переход — проход DFA по байтам выбранного токена. EOS разрешён только в
+    принимающих состояниях; если из состояния нет ни одного допустимого
+    токена (нужный байт не выражается токенами), разрешается EOS.
+
+    Маски строятся в потоке движка; кэш масок — на одно устройство.
+    """
+
+    def __init__(self, dfa: ByteDFA, vocabulary: TokenVocabulary, key: str):
+        self.dfa = dfa
+        self.vocabulary = vocabulary
+        self.vocab_size = vocabulary.vocab_size
+        self.key = key
+        self.initial_state = dfa.start
+        self._masks: Dict[int, Any] = {}
+        self._table = None
+
+    def advance(self, state: int, token_id: int) -> int:
+        """Состояние после токена (EOS и спецтокены его не меняют)"""
+        data = self.vocabulary.token_bytes[token_id] if 0 <= token_id < self.vocab_size else None
+        if data is None:
+            return state
+        next_state = self.dfa.walk(state, data)
+        return state if next_state == DEAD else next_state
+
+    def is_accepting(self, state: int) -> bool:
+        return self.dfa.accepting[state]
+
+    def allowed(self, state: int, device):
+        """Маска допустимых токенов состояния (из кэша или построенная)"""
+        mask = self._masks.get(state)
+        if mask is None:
+            start = time.perf_counter()
+            mask = self._masks[state] = self._build_mask(state, device)
+            metrics.STRUCTURED_MASK_BUILD_TIME.observe(time.perf_counter() - start)
+        return mask
+
+    def _build_mask(self, state: int, device):
+        import torch
+
+        vocabulary = self.vocabulary
+        order, columns = vocabulary.tensors(device)
+        if self._table is None:
+            # DEAD -> поглощающее состояние num_states
+            table = torch.tensor(self.dfa.transitions, dtype=torch.long)
+            dead = self.dfa.num_states
+            table = torch.cat([table.masked_fill(table == DEAD, dead), torch.full((1, 256), dead)])
+            self._table = table.to(device)
+        current = torch.full((vocabulary.num_valid,), state, dtype=torch.long, device=device)
+        for position, count in enumerate(vocabulary.counts):
+            current[:count] = self._table[current[:count], columns[position].long()]
+        mask = torch.zeros(self.vocab_size, dtype=torch.bool, device=device)
+        mask[order[:vocabulary.num_valid]] = current != self.dfa.num_states
+        if self.is_accepting(state) or not bool(mask.any()):
+            mask[vocabulary.eos_token_id] = True
+        return mask
+
+    def __len__(self) -> int:
+        """Число построенных масок"""
+        return len(self._masks)
+
+
+class StructuredOutputCompiler:
+    """response_format -> TokenAutomaton с LRU-кэшем по sha256 regex.
+
+    Словарь токенов строится один раз при первой компиляции. Компиляция
+    блокирующая и идёт только в потоках токенизации (TokenizerPool), не в
+    event loop, поэтому кэш под блокировкой; повторные схемы получают
+    готовый автомат вместе с уже построенными масками.
+    """
+
+    def __init__(self, tokenizer, vocab_size: int, max_entries: int = 32):
+        self.tokenizer = tokenizer
+        self.vocab_size = vocab_size
+        self.max_entries = max_entries
+        self._vocabulary: Optional[TokenVocabulary] = None
+        self._entries: "OrderedDict[str, TokenAutomaton]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def vocabulary(self) -> TokenVocabulary:
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = TokenVocabulary(self.tokenizer.token_bytes(), self.vocab_size,
+                                                   self.tokenizer.eos_token_id)
+            return self._vocabulary
+
+    def compile(self, response_format: Optional[Dict[str, Any]]) -> Optional[TokenAutomaton]:
+        """Автомат ответа или None, если формат не ограничен (ValueError — неверная спецификация)"""
+        pattern = response_format_regex(response_format)
+        if pattern is None:
+            return None
+        key = hashlib.sha256(pattern.encode("utf-8")).hexdigest()
+        with self._lock:
+            automaton = self._entries.get(key)
+            if automaton is not None:
+                self._entries.move_to_end(key)
+                metrics.STRUCTURED_COMPILE_LOOKUPS.labels("hit").inc()
+                return automaton
+        metrics.STRUCTURED_COMPILE_LOOKUPS.labels("miss").inc()
+
+        start = time.perf_counter()
+        automaton = TokenAutomaton(ByteDFA.from_regex(pattern), self.vocabulary(), key)
+        metrics.STRUCTURED_COMPILE_TIME.observe(time.perf_counter() - start)
+        with self._lock:
+            automaton = self._entries.setdefault(key, automaton)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return automaton
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Serving Tokenizer
+Обёртка над HF tokenizers с байтовым fallback для dry-run и тестов
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Спецтокены Oracle850B (tokenizer_config.json)
+SPECIAL_TOKENS = {
+    "<|oracle_sys|>": 0,
+    "<|oracle_intro|>": 1,
+    "<|author|>": 2,
+    "<|endoftext|>": 3,
+    "<|pad|>": 4,
+    "<|unk|>": 5,
+}
+EOS_TOKEN = "<|endoftext|>"
+
+
+class OracleTokenizer:
+    """Токенизатор сервера: tokenizer.json или байтовый fallback.
+
+    Fallback кодирует спецтокены их id, остальной текст — UTF-8 байтами со
+    сдвигом на число спецтокенов, поэтому помещается в любой словарь >= 262.
+    """
+
+    def __init__(self, tokenizer_path: Optional[Union[str, Path]] = None):
+        self.special_tokens = dict(SPECIAL_TOKENS)
+        self.eos_token_id = self.special_tokens[EOS_TOKEN]
+        self._byte_offset = len(self.special_tokens)
+        self._special_pattern = re.compile("(" + "|".join(map(re.escape, self.special_tokens)) + ")")
+        self._tokenizer = self._load(tokenizer_path)
+
+    def _load(self, tokenizer_path: Optional[Union[str, Path]]):
+        """Загрузить tokenizer.json, при ошибке — байтовый fallback"""
+        if tokenizer_path is None:
+            return None
+        path = Path(tokenizer_path)
+        if path.is_dir():
+            path = path / "tokenizer.json"
+        if not path.exists():
+            return None
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(str(path))
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить {path}, используется байтовый токенизатор: {e}")
+            return None
+        eos_id = tokenizer.token_to_id(EOS_TOKEN)
+        if eos_id is not None:
+            self.eos_token_id = eos_id
+        return tokenizer
+
+    @property
+    def is_fallback(self) -> bool:
+        return self._tokenizer is None
+
+    @property
+    def splits_exactly(self) -> bool:
+        """encode(a + b) == encode(a) + encode(b) для любых фрагментов.
+
+        Верно только для байтового fallback: у HF tokenizers BPE-слияния,
+        regex пре-токенизатора и ▁ в начале текста (Metaspace) зависят от
+        соседних символов и меняют токены на границе фрагментов.
+        """
+        return self._tokenizer is None
+
+    @property
+    def vocab_size(self) -> int:
+        if self._tokenizer is not None:
+            return self._tokenizer.get_vocab_size()
+        return self._byte_offset + 256
+
+    def encode(self, text: str) -> List[int]:
+        """Текст -> id токенов"""
+        if self._tokenizer is not None:
+            return self._tokenizer.encode(text, add_special_tokens=False).ids
+
+        ids = []
+        for part in self._special_pattern.split(text):
+            if part in self.special_tokens:
+                ids.append(self.special_tokens[part])
+            elif part:
+                ids.extend(b + self._byte_offset for b in part.encode("utf-8"))
+        return ids
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        """Несколько текстов за один вызов (HF tokenizers кодирует их параллельно)"""
+        if self._tokenizer is not None:
+            return [enc.ids for enc in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+        return [self.encode(text) for text in texts]
+
+    def decode(self, ids: List[int], skip_special_tokens: bool = True) -> str:
+        """id токенов -> текст (неполные UTF-8 последовательности заменяются)"""
+        if self._tokenizer is not None:
+            return self._tokenizer.decode(ids, skip_special_tokens=skip_special_tokens)
+
+        special_by_id = {v: k for k, v in self.special_tokens.items()}
+        parts, buffer = [], bytearray()
+        for token_id in ids:
+            if token_id < self._byte_offset:
+                parts.append(buffer.decode("utf-8", errors="replace"))
+                buffer.clear()
+                if not skip_special_tokens and token_id in special_by_id:
+                    parts.append(special_by_id[token_id])
+            elif token_id < self._byte_offset + 256:
+                buffer.append(token_id - self._byte_offset)
+        parts.append(buffer.decode("utf-8", errors="replace"))
+        return "".join(parts)
+
+    def token_bytes(self) -> List[Optional[bytes]]:
+        """Байты каждого id словаря (None — спецтокены) для масок структурированного вывода.
+
+        Byte-level BPE (декодер ByteLevel) переводится обратно через таблицу
+        GPT-2 bytes_to_unicode, SentencePiece-токены — заменой ▁ на пробел и
+        <0xHH> на байт.
+        """
+        if self._tokenizer is None:
+            return [None] * self._byte_offset + [bytes([b]) for b in range(256)]
+
+        special = set(self.special_tokens)
+        if hasattr(self._tokenizer, "get_added_tokens_decoder"):
+            special |= {t.content for t in self._tokenizer.get_added_tokens_decoder().values() if t.special}
+        byte_level = type(self._tokenizer.decoder).__name__ == "ByteLevel"
+        unicode_to_byte = {char: byte for byte, char in _bytes_to_unicode().items()}
+        table: List[Optional[bytes]] = []
+        for token_id in range(self._tokenizer.get_vocab_size()):
+            token = self._tokenizer.id_to_token(token_id)
+            if token is None or token in special:
+                table.append(None)
+            elif byte_level and all(char in unicode_to_byte for char in token):
+                table.append(bytes(unicode_to_byte[char] for char in token))
+            elif _BYTE_TOKEN.fullmatch(token):
+                table.append(bytes([int(token[3:5], 16)]))
+            else:
+                table.append(token.replace("▁", " ").encode("utf-8"))
+        return table
+
+
+_BYTE_TOKEN = re.compile(r"<0x[0-9A-Fa-f]{2}>")
+
+
+def _bytes_to_unicode() -> Dict[int, str]:
+    """Таблица byte-level BPE (GPT-2): байт -> печатный символ"""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + \
+        list(range(ord("®"), ord("ÿ") + 1))
+    mapping, extra = {}, 0
+    for byte in range(256):
+        if byte in printable:
+            mapping[byte] = chr(byte)
+        else:
+            mapping[byte] = chr(256 + extra)
+            extra += 1
+    return mapping
+
+
+class MessageTokenCache:
+    """LRU id токенов по sha1 фрагмента промпта (одного сообщения чата).
+
+    Клиенты присылают всю историю на каждом ходе: старые сообщения берутся
+    из кэша, новые кодируются одним encode_batch. Склейка id фрагментов
+    совпадает с encode всего текста только при tokenizer.splits_exactly.
+    """
+
+    def __init__(self, tokenizer: OracleTokenizer, max_entries: int = 4096):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[bytes, List[int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # вызывается из потоков токенизации
+
+    def encode(self, segments: List[str]) -> List[List[int]]:
+        """id токенов каждого фрагмента"""
+        keys = [hashlib.sha1(segment.encode("utf-8")).digest() for segment in segments]
+        found: Dict[bytes, List[int]] = {}
+        missing: Dict[bytes, str] = {}
+        with self._lock:
+            for key, segment in zip(keys, segments):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                    self.hits += 1
+                elif key not in missing:
+                    missing[key] = segment
+                    self.misses += 1
+
+        if missing:
+            # Кодирование вне блокировки: HF tokenizers отпускает GIL
+            found.update(zip(missing, self.tokenizer.encode_batch(list(missing.values()))))
+            with self._lock:
+                for key in missing:
+                    self.entries[key] = found[key]
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return [found[key] for key in keys]
+
+
+class IncrementalDetokenizer:
+    """Потоковая детокенизация без повторного decode всего ответа.
+
+    Декодируется только окно с последней границы выданного текста: дельта —
+    разница между декодом окна с новыми токенами и без них. Если текст
+    кончается на U+FFFD (кириллический символ — два байта, и токены могут
+    разрезать его), дельта придерживается до следующих токенов.
+    """
+
+    def __init__(self, tokenizer: OracleTokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, start: int, end: Optional[int] = None) -> str:
+        return self.tokenizer.decode(self.token_ids[start:end], skip_special_tokens=self.skip_special_tokens)
+
+    def add(self, token_ids: List[int]) -> str:
+        """Добавить токены, вернуть новый готовый текст (возможно пустой)"""
+        self.token_ids.extend(token_ids)
+        prefix_text = self._decode(self.prefix_offset, self.read_offset)
+        new_text = self._decode(self.prefix_offset)
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+        self.prefix_offset, self.read_offset = self.read_offset, len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+    def flush(self) -> str:
+        """Остаток после последнего токена (незавершённый UTF-8 — как U+FFFD)"""
+        if self.read_offset == len(self.token_ids):
+            return ""
+        prefix_text = self._decode(self.prefix_offset, self.read_offset)
+        new_text = self._decode(self.prefix_offset)
+        self.prefix_offset = self.read_offset = len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+
+def load_tokenizer(model_path: Union[str, Path]) -> OracleTokenizer:
+    """Токенизатор из <model_path>/tokenizer/tokenizer.json"""
+    return OracleTokenizer(Path(model_path) / "tokenizer")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Tokenizer Pool
+Токенизация и детокенизация в пуле потоков вне event loop
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from .tokenizer import OracleTokenizer
+from . import metrics
+
+
+class TokenizerPool:
+    """Пул потоков токенизации.
+
+    Кодирование длинного промпта в async-обработчике блокирует event loop
+    для всех остальных запросов. HF tokenizers отпускает GIL, поэтому
+    обычных потоков достаточно, чтобы кодировать параллельно с обработкой
+    сети и шагами движка. Время ожидания потока и самой операции пишется в
+    метрики по типу операции.
+    """
+
+    def __init__(self, tokenizer: OracleTokenizer, num_workers: int = 2):
+        self.tokenizer = tokenizer
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="oracle-tokenizer")
+
+    async def run(self, op: str, fn: Callable[..., Any], *args) -> Any:
+        """Выполнить fn(*args) в потоке пула с учётом времени в очереди"""
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            metrics.TOKENIZER_QUEUE_TIME.labels(op).observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                metrics.TOKENIZATION_TIME.labels(op).observe(time.perf_counter() - started)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+    async def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        return await self.run("encode", self.tokenizer.encode_batch, texts)
+
+    async def decode_batch(self, ids_batch: List[List[int]], skip_special_tokens: bool = True) -> List[str]:
+        def decode_all():
+            return [self.tokenizer.decode(ids, skip_special_tokens) for ids in ids_batch]
+        return await self.run("decode", decode_all)
+
+    async def decode(self, ids: List[int], skip_special_tokens: bool = True) -> str:
+        return (await self.decode_batch([ids], skip_special_tokens))[0]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Attention
+SDPA self-attention with packed-document and sliding-window masks, partial RoPE
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Dict, Any, Optional
+
+
+def document_ids_from_cu_seqlens(cu_seqlens: torch.Tensor, batch_size: int, seq_len: int) -> torch.Tensor:
+    """Document id per token [batch_size, seq_len] from flash-attn style cu_seqlens.
+
+    cu_seqlens are cumulative document lengths over the flattened batch,
+    e.g. [0, 5, 12, 16] for documents of 5, 7 and 4 tokens.
+    """
+    flat_positions = torch.arange(batch_size * seq_len, device=cu_seqlens.device)
+    document_ids = torch.bucketize(flat_positions, cu_seqlens[1:], right=True)
+    return document_ids.view(batch_size, seq_len)
+
+
+def position_ids_from_document_ids(document_ids: torch.Tensor) -> torch.Tensor:
+    """Positions that restart at 0 at every document boundary"""
+    batch_size, seq_len = document_ids.shape
+    positions = torch.arange(seq_len, device=document_ids.device).expand(batch_size, seq_len)
+
+    starts = torch.ones_like(document_ids, dtype=torch.bool)
+    starts[:, 1:] = document_ids[:, 1:] != document_ids[:, :-1]
+    doc_start = torch.where(starts, positions, torch.zeros_like(positions)).cummax(dim=1).values
+
+    return positions - doc_start
+
+
+def build_attention_mask(query_positions: torch.Tensor, key_positions: torch.Tensor,
+                         query_documents: Optional[torch.Tensor] = None,
+                         key_documents: Optional[torch.Tensor] = None,
+                         window: Optional[int] = None, sink_tokens: int = 0) -> torch.Tensor:
+    """Boolean SDPA mask [batch_size, 1, q_len, k_len], True = attend.
+
+    Causal by position; with document ids only tokens of the same document
+    see each other (block-diagonal causal attention for packed sequences).
+    With a window a query sees the last `window` positions plus the first
+    `sink_tokens` positions. Negative key positions mark empty cache slots.
+    """
+    q_pos = query_positions.unsqueeze(2)
+    k_pos = key_positions.unsqueeze(1)
+    mask = (k_pos <= q_pos) & (k_pos >= 0)
+    if window:
+        mask = mask & ((q_pos - k_pos < window) | (k_pos < sink_tokens))
+    if query_documents is not None:
+        mask = mask & (key_documents.unsqueeze(1) == query_documents.unsqueeze(2))
+    return mask.unsqueeze(1)
+
+
+class RotaryEmbedding(nn.Module):
+    """Partial rotary position embedding (first rotary_pct of every head)"""
+
+    def __init__(self, head_dim: int, rotary_pct: float = 1.0, theta: float = 10000.0):
+        super().__init__()
+        self.rotary_dim = int(head_dim * rotary_pct) // 2 * 2
+        inv_freq = 1.0 / (theta ** (torch.arange(0, self.rotary_dim, 2, dtype=torch.float32) / self.rotary_dim))
+        self.register_buffer("inv_freq", inv_freq, persistent=False)
+
+    def forward(self, x: torch.Tensor, position_ids: torch.Tensor) -> torch.Tensor:
+        """Rotate x [batch_size, n_heads, seq_len, head_dim] by position_ids [batch_size, seq_len]"""
+        freqs = position_ids.unsqueeze(-1).float() * self.inv_freq.float()  # [batch_size, seq_len, rotary_dim / 2]
+        emb = torch.cat([freqs, freqs], dim=-1).unsqueeze(1)
+        cos, sin = emb.cos().to(x.dtype), emb.sin().to(x.dtype)
+
+        x_rot, x_pass = x[..., :self.rotary_dim], x[..., self.rotary_dim:]
+        x1, x2 = x_rot.chunk(2, dim=-1)
+        rotated = torch.cat([-x2, x1], dim=-1)
+        return torch.cat([x_rot * cos + rotated * sin, x_pass], dim=-1)
+
+
+class Oracle850BAttention(nn.Module):
+    """Multi-head self-attention over F.scaled_dot_product_attention.
+
+    Parameter names match nn.MultiheadAttention (in_proj_weight, in_proj_bias,
+    out_proj), so existing state dicts load unchanged. config["sliding_window"]
+    limits attention to the last window tokens plus
+    config["attention_sink_tokens"] global sink tokens.
+    """
+
+    def __init__(self, d_model: int, n_heads: int, config: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        config = config or {}
+        if d_model % n_heads != 0:
+            raise ValueError(f"d_model={d_model} is not divisible by n_heads={n_heads}")
+        self.d_model = d_model
+        self.n_heads = n_heads
+        self.head_dim = d_model // n_heads
+
+        self.in_proj_weight = nn.Parameter(torch.empty(3 * d_model, d_model))
+        self.in_proj_bias = nn.Parameter(torch.zeros(3 * d_model))
+        self.out_proj = nn.Linear(d_model, d_model)
+        nn.init.xavier_uniform_(self.in_proj_weight)
+        nn.init.zeros_(self.out_proj.bias)
+
+        # Rotary embedding only for position_encoding == "rope"
+        self.rotary = None
+        if config.get("position_encoding", "learned") == "rope":
+            self.rotary = RotaryEmbedding(
+                self.head_dim, config.get("rotary_pct", 1.0), config.get("rope_theta", 10000)
+            )
+
+        # Sliding window (None = dense attention)
+        self.sliding_window = config.get("sliding_window")
+        self.sink_tokens = config.get("attention_sink_tokens", 0)
+
+    def forward(self, x: torch.Tensor, attn_mask: Optional[torch.Tensor] = None,
+                position_ids: Optional[torch.Tensor] = None, kv_cache: Optional[Any] = None,
+                layer_idx: int = 0) -> torch.Tensor:
+        """attn_mask: SDPA mask (bool True = attend, or additive float); None = causal
+        (sliding-window causal when configured). kv_cache: DynamicKVCache-like
+        object updated in place with this layer's keys/values.
+        """
+        batch_size, seq_len, _ = x.shape
+
+        qkv = F.linear(x, self.in_proj_weight, self.in_proj_bias)
+        qkv = qkv.view(batch_size, seq_len, 3, self.n_heads, self.head_dim).permute(2, 0, 3, 1, 4)
+        q, k, v = qkv[0], qkv[1], qkv[2]  # [batch_size, n_heads, seq_len, head_dim]
+
+        if position_ids is None:
+            if kv_cache is not None:
+                position_ids = kv_cache.next_position_ids(batch_size, seq_len, x.device)
+            else:
+                position_ids = torch.arange(seq_len, device=x.device).expand(batch_size, seq_len)
+        if self.rotary is not None:
+            q = self.rotary(q, position_ids)
+            k = self.rotary(k, position_ids)
+
+        key_positions = position_ids
+        if kv_cache is not None:
+            k, v, key_positions = kv_cache.update(layer_idx, k, v, position_ids)
+
+        if attn_mask is None and (self.sliding_window or kv_cache is not None):
+            attn_mask = build_attention_mask(position_ids, key_positions,
+                                             window=self.sliding_window, sink_tokens=self.sink_tokens)
+        if attn_mask is not None and attn_mask.dtype != torch.bool:
+            attn_mask = attn_mask.to(q.dtype)
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, is_causal=attn_mask is None)
+
+        out = out.transpose(1, 2).reshape(batch_size, seq_len, self.d_model)
+        return self.out_proj(out)
+
+
+def convert_legacy_attention_mask(attention_mask: torch.Tensor, batch_size: int, n_heads: int) -> torch.Tensor:
+    """nn.MultiheadAttention attn_mask (bool True = blocked, or additive) to SDPA format"""
+    if attention_mask.dtype == torch.bool:
+        attention_mask = ~attention_mask
+    if attention_mask.dim() == 3:
+        # [batch_size * n_heads, q_len, k_len]
+        attention_mask = attention_mask.view(batch_size, n_heads, *attention_mask.shape[-2:])
+    return attention_mask
+
+
+if __name__ == "__main__":
+    # Test packed attention equals attending documents separately
+    torch.manual_seed(0)
+    attention = Oracle850BAttention(32, 4, {"position_encoding": "rope", "rotary_pct": 0.5}).eval()
+
+    lengths = [5, 7, 4]
+    cu_seqlens = torch.tensor([0, 5, 12, 16])
+    x = torch.randn(1, 16, 32)
+
+    document_ids = document_ids_from_cu_seqlens(cu_seqlens, 1, 16)
+    position_ids = position_ids_from_document_ids(document_ids)
+    mask = build_attention_mask(position_ids, position_ids, document_ids, document_ids)
+
+    with torch.no_grad():
+        packed = attention(x, mask, position_ids)
+        separate = torch.cat([attention(part) for part in x.split(lengths, dim=1)], dim=1)
+
+    print(f"document_ids: {document_ids.tolist()}")
+    print(f"position_ids: {position_ids.tolist()}")
+    print(f"packed vs separate max abs diff: {(packed - separate).abs().max().item():.2e}")
+
+    # Test sliding-window decode with a capped cache equals full recompute
+    from .kv_cache import SlidingWindowKVCache
+
+    config = {"position_encoding": "rope", "sliding_window": 6, "attention_sink_tokens": 2}
+    attention = Oracle850BAttention(32, 4, config).eval()
+    cache = SlidingWindowKVCache(num_layers=1, window=6, sink_tokens=2)
+    x = torch.randn(1, 24, 32)
+
+    with torch.no_grad():
+        full = attention(x)
+        steps = [attention(x[:, :8], kv_cache=cache)]
+        steps += [attention(x[:, t:t + 1], kv_cache=cache) for t in range(8, 24)]
+        incremental = torch.cat(steps, dim=1)
+
+    print(f"cached keys: {cache.keys[0].shape[2]} (window 6 + 2 sinks)")
+    print(f"windowed decode vs full max abs diff: {(incremental - full).abs().max().item():.2e}")
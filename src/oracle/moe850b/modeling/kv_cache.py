@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Oracle850B KV Cache
+Dense, sliding-window (with attention sinks) and slot-pooled key/value caches for decoding
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+
+import torch
+
+
+class DynamicKVCache:
+    """Per-layer keys/values that grow with every decoded token.
+
+    Keys and values are stored as [batch_size, n_heads, cached_len, head_dim]
+    together with their positions [batch_size, cached_len], so attention masks
+    are built from positions rather than cache indices.
+    """
+
+    def __init__(self, num_layers: int):
+        self.num_layers = num_layers
+        self.keys: List[Optional[torch.Tensor]] = [None] * num_layers
+        self.values: List[Optional[torch.Tensor]] = [None] * num_layers
+        self.positions: List[Optional[torch.Tensor]] = [None] * num_layers
+        self.seen_tokens = 0
+
+    def get_seq_length(self) -> int:
+        """Tokens processed so far (including ones evicted from the cache)"""
+        return self.seen_tokens
+
+    def next_position_ids(self, batch_size: int, seq_len: int, device: torch.device) -> torch.Tensor:
+        """Positions [batch_size, seq_len] of the next tokens fed to the model"""
+        offset = self.seen_tokens
+        return torch.arange(offset, offset + seq_len, device=device).expand(batch_size, seq_len)
+
+    def update(self, layer_idx: int, keys: torch.Tensor, values: torch.Tensor,
+               positions: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Append new keys/values, return everything the new queries attend to"""
+        if layer_idx == 0:
+            self.seen_tokens += keys.shape[2]
+
+        if self.keys[layer_idx] is not None:
+            keys = torch.cat([self.keys[layer_idx], keys], dim=2)
+            values = torch.cat([self.values[layer_idx], values], dim=2)
+            positions = torch.cat([self.positions[layer_idx], positions], dim=1)
+
+        self._store(layer_idx, keys, values, positions)
+        return keys, values, positions
+
+    def _store(self, layer_idx: int, keys: torch.Tensor, values: torch.Tensor, positions: torch.Tensor):
+        self.keys[layer_idx] = keys
+        self.values[layer_idx] = values
+        self.positions[layer_idx] = positions
+
+    def crop(self, seq_length: int):
+        """Drop the most recent tokens so that seq_length tokens remain processed"""
+        num_dropped = self.seen_tokens - seq_length
+        if num_dropped <= 0:
+            return
+        for layer_idx in range(self.num_layers):
+            if self.keys[layer_idx] is None:
+                continue
+            cached_len = self.keys[layer_idx].shape[2]
+            if num_dropped > cached_len:
+                raise ValueError(f"Cannot crop {num_dropped} tokens, only {cached_len} are cached")
+            keep = cached_len - num_dropped
+            self._store(layer_idx, self.keys[layer_idx][:, :, :keep],
+                        self.values[layer_idx][:, :, :keep], self.positions[layer_idx][:, :keep])
+        self.seen_tokens = seq_length
+
+    def nbytes(self) -> int:
+        """Memory held by cached keys and values"""
+        return sum(t.numel() * t.element_size() for t in self.keys + self.values if t is not None)
+
+
+class SlidingWindowKVCache(DynamicKVCache):
+    """KV cache capped at the attention window plus sink tokens.
+
+    The first `sink_tokens` entries (e.g. the <|oracle_sys|> prefix) are kept
+    forever, otherwise only the last `window` tokens survive, so memory stays
+    flat however long the context grows.
+
+    `max_rewind` extra recent tokens are kept beyond the window so that crop()
+    can drop up to that many tokens and still leave a full window (speculative
+    decoding rolls back rejected drafts this way). The attention mask ignores
+    the extra keys, so outputs do not change.
+    """
+
+    def __init__(self, num_layers: int, window: int, sink_tokens: int = 0, max_rewind: int = 0):
+        super().__init__(num_layers)
+        if window <= 0:
+            raise ValueError(f"window must be positive, got {window}")
+        self.window = window
+        self.sink_tokens = sink_tokens
+        self.max_rewind = max_rewind
+
+    def _store(self, layer_idx: int, keys: torch.Tensor, values: torch.Tensor, positions: torch.Tensor):
+        if keys.shape[2] > self.sink_tokens + self.window + self.max_rewind:
+            sink, recent = self.sink_tokens, -(self.window + self.max_rewind)
+            keys = torch.cat([keys[:, :, :sink], keys[:, :, recent:]], dim=2)
+            values = torch.cat([values[:, :, :sink], values[:, :, recent:]], dim=2)
+            positions = torch.cat([positions[:, :sink], positions[:, recent:]], dim=1)
+        super()._store(layer_idx, keys, values, positions)
+
+    def crop(self, seq_length: int):
+        """Drop up to max_rewind recent tokens, keeping a full window behind them"""
+        num_dropped = self.seen_tokens - seq_length
+        if num_dropped > self.max_rewind:
+            raise ValueError(f"Cannot crop {num_dropped} tokens from a sliding window "
+                             f"cache with max_rewind={self.max_rewind}")
+        super().crop(seq_length)
+
+
+class SlotKVCache:
+    """Preallocated KV pool with one slot per running sequence.
+
+    Sequences of different lengths decode in one batch: bind(slots) selects
+    the rows of the next forward, every row writes at its own length and
+    keys past a row's length carry position -1, which the attention mask
+    ignores. Pools are allocated lazily on the first update.
+
+    With a window each slot holds only sink_tokens + window entries: the
+    sinks stay in place and the rest is a ring buffer, so a slot costs the
+    same however long its sequence grows (up to max_seq_len positions).
+    """
+
+    def __init__(self, num_layers: int, num_slots: int, max_seq_len: int,
+                 window: Optional[int] = None, sink_tokens: int = 0):
+        self.num_layers = num_layers
+        self.num_slots = num_slots
+        self.max_seq_len = max_seq_len
+        if window is not None and window <= 0:
+            raise ValueError(f"window must be positive, got {window}")
+        # A window that covers max_seq_len needs no ring buffer
+        self.window = window if window and sink_tokens + window < max_seq_len else None
+        self.sink_tokens = sink_tokens if self.window else 0
+        self.capacity = self.sink_tokens + self.window if self.window else max_seq_len
+        self.keys: List[Optional[torch.Tensor]] = [None] * num_layers
+        self.values: List[Optional[torch.Tensor]] = [None] * num_layers
+        self.positions: Optional[torch.Tensor] = None  # [num_slots, capacity (+1 scratch with a window)]
+        self.lengths = [0] * num_slots
+        self.free_slots = list(range(num_slots - 1, -1, -1))
+        self.active: List[int] = []
+        self._write_index: Optional[torch.Tensor] = None
+        self._kv_positions: Optional[torch.Tensor] = None
+        self._kv_len = 0
+
+    def allocate(self) -> int:
+        """Reserve an empty slot for a new sequence"""
+        if not self.free_slots:
+            raise RuntimeError(f"All {self.num_slots} KV cache slots are in use")
+        return self.free_slots.pop()
+
+    def free(self, slot: int):
+        """Release a slot, its stale keys are masked out by position -1"""
+        self.lengths[slot] = 0
+        if self.positions is not None:
+            self.positions[slot] = -1
+        self.free_slots.append(slot)
+
+    def _ensure_pools(self, layer_idx: int, keys: torch.Tensor, values: torch.Tensor):
+        n_heads, head_dim = keys.shape[-3], keys.shape[-1]
+        # With a window, a trailing scratch column absorbs tokens overwritten within the same write
+        storage_len = self.capacity + 1 if self.window else self.capacity
+        if self.keys[layer_idx] is None:
+            shape = (self.num_slots, n_heads, storage_len, head_dim)
+            self.keys[layer_idx] = keys.new_zeros(shape)
+            self.values[layer_idx] = values.new_zeros(shape)
+        if self.positions is None:
+            self.positions = torch.full((self.num_slots, storage_len), -1,
+                                        dtype=torch.long, device=keys.device)
+
+    def _storage_index(self, token_index: torch.Tensor, end: torch.Tensor) -> torch.Tensor:
+        """Storage column of tokens [rows, n] written to sequences ending at end [rows]"""
+        if not self.window:
+            return token_index
+        ring = self.sink_tokens + (token_index - self.sink_tokens) % self.window
+        index = torch.where(token_index < self.sink_tokens, token_index, ring)
+        keep = (token_index < self.sink_tokens) | (token_index >= end.unsqueeze(1) - self.window)
+        return torch.where(keep, index, torch.full_like(index, self.capacity))
+
+    def readable_length(self, slot: int) -> int:
+        """Leading tokens of a slot whose keys/values are still held (see read)"""
+        length = self.lengths[slot]
+        return length if length <= self.capacity else self.sink_tokens
+
+    def load_prefix(self, slot: int, keys: List[torch.Tensor], values: List[torch.Tensor], start: int = 0):
+        """Copy precomputed keys/values ([n_heads, n, head_dim] per layer) into a slot at start"""
+        end = start + keys[0].shape[1]
+        if end > self.max_seq_len:
+            raise ValueError(f"Prefix exceeds KV cache max_seq_len={self.max_seq_len}")
+        for layer_idx in range(self.num_layers):
+            self._ensure_pools(layer_idx, keys[layer_idx], values[layer_idx])
+        device = self.positions.device
+        token_index = torch.arange(start, end, device=device)
+        index = self._storage_index(token_index.unsqueeze(0), torch.tensor([end], device=device))[0]
+        for layer_idx in range(self.num_layers):
+            self.keys[layer_idx][slot, :, index] = keys[layer_idx]
+            self.values[layer_idx][slot, :, index] = values[layer_idx]
+        self.positions[slot, index] = token_index
+        self.lengths[slot] = end
+
+    def read(self, slot: int, start: int, end: int) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """Copies of a slot's keys/values for tokens [start, end), [n_heads, n, head_dim] per layer"""
+        if end > self.readable_length(slot):
+            raise ValueError(f"Tokens [{start}, {end}) are no longer held by the sliding-window slot")
+        return ([k[slot, :, start:end].clone() for k in self.keys],
+                [v[slot, :, start:end].clone() for v in self.values])
+
+    def bind(self, slots: List[int]) -> "SlotKVCache":
+        """Select the slots (batch rows, in order) of the next forward"""
+        self.active = list(slots)
+        return self
+
+    def get_seq_length(self) -> int:
+        return max((self.lengths[s] for s in self.active), default=0)
+
+    def next_position_ids(self, batch_size: int, seq_len: int, device: torch.device) -> torch.Tensor:
+        offsets = torch.tensor([self.lengths[s] for s in self.active], device=device)
+        return offsets.unsqueeze(1) + torch.arange(seq_len, device=device)
+
+    def update(self, layer_idx: int, keys: torch.Tensor, values: torch.Tensor,
+               positions: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Write new keys/values into the bound slots, return the slots' caches.
+
+        With a window the new keys are returned next to the slots' previous
+        contents (read before the ring buffer overwrites them), so queries of
+        a long prefill still see the whole window.
+        """
+        batch_size, n_heads, seq_len, head_dim = keys.shape
+        slots = torch.tensor(self.active, device=keys.device)
+        rows = slots.unsqueeze(1)
+        self._ensure_pools(layer_idx, keys, values)
+
+        if layer_idx == 0:
+            lengths = [self.lengths[s] for s in self.active]
+            if max(lengths) + seq_len > self.max_seq_len:
+                raise ValueError(f"Sequence exceeds KV cache max_seq_len={self.max_seq_len}")
+            offsets = torch.tensor(lengths, device=keys.device)
+            self._write_index = self._storage_index(offsets.unsqueeze(1) + torch.arange(seq_len, device=keys.device),
+                                                    offsets + seq_len)
+            self._kv_len = max(lengths) + seq_len
+            if self.window:
+                self._kv_positions = torch.cat([self.positions[slots, :self.capacity], positions], dim=1)
+            self.positions[rows, self._write_index] = positions
+            for s in self.active:
+                self.lengths[s] += seq_len
+
+        if self.window:
+            cached_keys = self.keys[layer_idx][slots, :, :self.capacity]
+            cached_values = self.values[layer_idx][slots, :, :self.capacity]
+        self.keys[layer_idx][rows, :, self._write_index] = keys.transpose(1, 2)
+        self.values[layer_idx][rows, :, self._write_index] = values.transpose(1, 2)
+
+        if self.window:
+            return (torch.cat([cached_keys, keys], dim=2), torch.cat([cached_values, values], dim=2),
+                    self._kv_positions)
+        kv_len = self._kv_len
+        return (self.keys[layer_idx][slots, :, :kv_len], self.values[layer_idx][slots, :, :kv_len],
+                self.positions[slots, :kv_len])
+
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in self.keys + self.values if t is not None)
+
+
+def create_kv_cache(config: Dict[str, Any], max_rewind: int = 0) -> DynamicKVCache:
+    """Cache matching the attention mode of a model config
+
+    max_rewind is how many tokens crop() may roll back under a sliding window.
+    """
+    num_layers = config["dense"]["n_layers"]
+    window = config.get("sliding_window")
+    if window:
+        return SlidingWindowKVCache(num_layers, window, config.get("attention_sink_tokens", 0), max_rewind)
+    return DynamicKVCache(num_layers)
+
+
+def create_slot_kv_cache(config: Dict[str, Any], num_slots: int, max_seq_len: int) -> SlotKVCache:
+    """Slot pool for serving, capped at the attention window like create_kv_cache"""
+    return SlotKVCache(config["dense"]["n_layers"], num_slots, max_seq_len,
+                       config.get("sliding_window"), config.get("attention_sink_tokens", 0))
+
+
+if __name__ == "__main__":
+    # Test that the sliding-window cache stays bounded
+    cache = SlidingWindowKVCache(num_layers=1, window=8, sink_tokens=2)
+    for step in range(32):
+        k = torch.randn(1, 2, 1, 4)
+        cache.update(0, k, k, torch.tensor([[step]]))
+
+    print(f"seen tokens: {cache.get_seq_length()}")
+    print(f"cached positions: {cache.positions[0].tolist()}")
+    print(f"cache bytes: {cache.nbytes()}")
+
+    # Test that a windowed slot pool holds only sinks + window per slot
+    pool = SlotKVCache(num_layers=1, num_slots=2, max_seq_len=1024, window=8, sink_tokens=2)
+    slot = pool.allocate()
+    for step in range(32):
+        k = torch.randn(1, 2, 1, 4)
+        pool.bind([slot]).update(0, k, k, torch.tensor([[step]]))
+
+    print(f"slot positions: {sorted(pool.positions[slot, :pool.capacity].tolist())}")
+    print(f"slot pool bytes: {pool.nbytes()}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Precision Policy
+Train/infer dtypes for parameters, router, norms and lm_head
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import contextlib
+from typing import Dict, Any, Optional
+
+import torch
+import torch.nn as nn
+
+
+DTYPES = {
+    "fp32": torch.float32,
+    "float32": torch.float32,
+    "bf16": torch.bfloat16,
+    "bfloat16": torch.bfloat16,
+    "fp16": torch.float16,
+    "float16": torch.float16,
+}
+
+
+def resolve_dtype(name: str, device: Optional[str] = None) -> torch.dtype:
+    """Resolve a config dtype name, "auto" picks bf16 unless the GPU lacks it"""
+    if name == "auto":
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if device.startswith("cuda") and not torch.cuda.is_bf16_supported():
+            return torch.float16
+        return torch.bfloat16
+    if name not in DTYPES:
+        raise ValueError(f"Unknown dtype: {name}")
+    return DTYPES[name]
+
+
+class PrecisionPolicy:
+    """Per-component dtypes and optional autocast for Oracle850B"""
+
+    def __init__(self, param_dtype: torch.dtype = torch.float32,
+                 router_dtype: torch.dtype = torch.float32,
+                 norm_dtype: torch.dtype = torch.float32,
+                 lm_head_dtype: Optional[torch.dtype] = None,
+                 autocast_dtype: Optional[torch.dtype] = None):
+        self.param_dtype = param_dtype
+        self.router_dtype = router_dtype
+        self.norm_dtype = norm_dtype
+        self.lm_head_dtype = lm_head_dtype or param_dtype
+        self.autocast_dtype = autocast_dtype
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], mode: str = "infer",
+                    device: Optional[str] = None) -> "PrecisionPolicy":
+        """Build policy from config["fp"].
+
+        train: fp32 master parameters, compute under autocast in the train dtype.
+        infer: parameters stored in the infer dtype.
+        Router and norms stay fp32 unless "router"/"norm" override them.
+        """
+        fp = config.get("fp", {})
+        if mode not in ("train", "infer"):
+            raise ValueError(f"Unknown precision mode: {mode}")
+
+        compute_dtype = resolve_dtype(fp.get(mode, "fp32"), device)
+        router_dtype = resolve_dtype(fp.get("router", "fp32"), device)
+        norm_dtype = resolve_dtype(fp.get("norm", "fp32"), device)
+        lm_head_dtype = resolve_dtype(fp["lm_head"], device) if "lm_head" in fp else None
+
+        if mode == "train":
+            autocast_dtype = compute_dtype if compute_dtype != torch.float32 else None
+            return cls(torch.float32, router_dtype, torch.float32,
+                       lm_head_dtype or torch.float32, autocast_dtype)
+        return cls(compute_dtype, router_dtype, norm_dtype, lm_head_dtype)
+
+    def apply(self, model: nn.Module) -> nn.Module:
+        """Cast model components in place"""
+        from .router import LoadBalancedRouter
+        from .transformer_moe import MoERouter
+
+        model.to(self.param_dtype)
+        for module in model.modules():
+            if isinstance(module, (MoERouter, LoadBalancedRouter)):
+                module.router.to(self.router_dtype)
+            elif isinstance(module, nn.LayerNorm):
+                module.to(self.norm_dtype)
+        lm_head = getattr(model, "lm_head", None)
+        embedding = getattr(model, "token_embedding", None)
+        # A tied lm_head shares the embedding weight: both stay in param_dtype
+        tied = lm_head is not None and embedding is not None and lm_head.weight is embedding.weight
+        if lm_head is not None and not tied:
+            lm_head.to(self.lm_head_dtype)
+        return model
+
+    def autocast(self, device_type: str):
+        """Autocast context for the forward pass (no-op without autocast dtype)"""
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=device_type, dtype=self.autocast_dtype)
+
+    def __repr__(self) -> str:
+        return (f"PrecisionPolicy(param={self.param_dtype}, router={self.router_dtype}, "
+                f"norm={self.norm_dtype}, lm_head={self.lm_head_dtype}, autocast={self.autocast_dtype})")
+
+
+if __name__ == "__main__":
+    # Test memory and router agreement: fp32 vs infer policy
+    import copy
+    from .transformer_moe import Oracle850BTransformer
+
+    config = {
+        "dense": {"d_model": 256, "n_layers": 2, "n_heads": 4, "d_ff": 512},
+        "moe": {"experts": 8, "router": {"k": 2, "load_balancing_loss": 0.01}},
+        "vocab_size": 1024,
+        "max_seq_len": 128,
+        "fp": {"train": "bf16", "infer": "auto"},
+    }
+
+    torch.manual_seed(0)
+    reference = Oracle850BTransformer(config, precision=PrecisionPolicy())
+    model = copy.deepcopy(reference)
+    model.precision = PrecisionPolicy.from_config(config, mode="infer")
+    model.precision.apply(model)
+
+    def nbytes(m):
+        return sum(p.numel() * p.element_size() for p in m.parameters())
+
+    x = torch.randn(1, 64, 256).to(torch.bfloat16)
+    ref_router = reference.layers[0].moe.router
+    router = model.layers[0].moe.router
+    with torch.no_grad():
+        expected = ref_router(x.float())[1]
+        agreement = (expected == router(x)[1]).float().mean().item()
+        router.router.to(torch.bfloat16)
+        agreement_bf16 = (expected == router(x)[1]).float().mean().item()
+
+    print(model.precision)
+    print(f"Parameters: {nbytes(reference) / 2**20:.1f} MiB -> {nbytes(model) / 2**20:.1f} MiB")
+    print(f"Router top-k agreement: fp32 router {agreement:.3f}, bf16 router {agreement_bf16:.3f}")
+
+    # Tied lm_head must not recast the shared embedding
+    tied = Oracle850BTransformer(dict(config, tie_word_embeddings=True, fp={"infer": "bf16", "lm_head": "fp32"}))
+    assert next(tied.parameters()).dtype == torch.float32
+    PrecisionPolicy.from_config(tied.config, mode="infer").apply(tied)
+    assert tied.lm_head.weight is tied.token_embedding.weight
+    print(f"Tied embeddings: embedding {tied.token_embedding.weight.dtype}, lm_head {tied.lm_head.weight.dtype}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Weight-Only Quantization
+Per-channel int8 and group-wise int4 experts with on-the-fly dequantization
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Dict, Tuple
+
+
+EXPERT_PROJECTIONS = ("w1", "w2", "w3")
+
+
+def quantize_int8_per_channel(weight: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Symmetric int8 quantization with one scale per output channel"""
+    # weight: [out_features, in_features]
+    weight = weight.float()
+    scales = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+    qweight = torch.round(weight / scales.unsqueeze(1)).clamp(-127, 127).to(torch.int8)
+    return qweight, scales
+
+
+def dequantize_int8_per_channel(qweight: torch.Tensor, scales: torch.Tensor,
+                                dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """Dequantize int8 per-channel weight"""
+    return qweight.to(dtype) * scales.to(dtype).unsqueeze(1)
+
+
+def quantize_int4_groupwise(weight: torch.Tensor, group_size: int = 128) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Symmetric int4 quantization with one scale per group of input channels.
+
+    Two nibbles are packed per uint8: even input channels in the low bits.
+    """
+    out_features, in_features = weight.shape
+    if in_features % group_size != 0 or group_size % 2 != 0:
+        raise ValueError(f"in_features={in_features} is not divisible by group_size={group_size}")
+
+    groups = weight.float().view(out_features, in_features // group_size, group_size)
+    scales = groups.abs().amax(dim=-1).clamp(min=1e-8) / 7  # [out_features, n_groups]
+    q = torch.round(groups / scales.unsqueeze(-1)).clamp(-8, 7).to(torch.int16) + 8
+    q = q.view(out_features, in_features).to(torch.uint8)
+
+    qweight = q[:, 0::2] | (q[:, 1::2] << 4)  # [out_features, in_features // 2]
+    return qweight, scales
+
+
+def dequantize_int4_groupwise(qweight: torch.Tensor, scales: torch.Tensor, group_size: int = 128,
+                              dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """Unpack and dequantize int4 group-wise weight"""
+    out_features = qweight.shape[0]
+    q = torch.stack([qweight & 0x0F, qweight >> 4], dim=-1).view(out_features, -1)
+    q = q.to(dtype) - 8
+    q = q.view(out_features, -1, group_size) * scales.to(dtype).unsqueeze(-1)
+    return q.view(out_features, -1)
+
+
+class QuantizedLinear(nn.Module):
+    """Bias-free linear layer with weight-only int8/int4 storage"""
+
+    def __init__(self, in_features: int, out_features: int, bits: int = 8, group_size: int = 128):
+        super().__init__()
+        if bits not in (8, 4):
+            raise ValueError(f"Unsupported bits: {bits}")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size
+
+        if bits == 8:
+            self.register_buffer("qweight", torch.zeros(out_features, in_features, dtype=torch.int8))
+            self.register_buffer("scales", torch.ones(out_features))
+        else:
+            self.register_buffer("qweight", torch.zeros(out_features, in_features // 2, dtype=torch.uint8))
+            self.register_buffer("scales", torch.ones(out_features, in_features // group_size))
+
+    @classmethod
+    def from_linear(cls, linear: nn.Linear, bits: int = 8, group_size: int = 128) -> "QuantizedLinear":
+        """Quantize an existing nn.Linear"""
+        if linear.bias is not None:
+            raise ValueError("QuantizedLinear does not support bias")
+        module = cls(linear.in_features, linear.out_features, bits, group_size)
+        weight = linear.weight.detach()
+        if bits == 8:
+            qweight, scales = quantize_int8_per_channel(weight)
+        else:
+            qweight, scales = quantize_int4_groupwise(weight, group_size)
+        module.qweight = qweight.to(weight.device)
+        module.scales = scales.to(device=weight.device, dtype=weight.dtype)
+        return module
+
+    def dequantize(self, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        """Full-precision weight [out_features, in_features]"""
+        if self.bits == 8:
+            return dequantize_int8_per_channel(self.qweight, self.scales, dtype)
+        return dequantize_int4_groupwise(self.qweight, self.scales, self.group_size, dtype)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """Dequantize-on-the-fly matmul (fused CPU kernels for bf16 when available)"""
+        if self.bits == 8:
+            if (x.device.type == "cpu" and x.dtype in (torch.bfloat16, torch.float16)
+                    and hasattr(torch.ops.aten, "_weight_int8pack_mm")):
+                # Fused CPU int8 kernel, weight never materialized in full precision
+                flat = x.reshape(-1, self.in_features)
+                out = torch.ops.aten._weight_int8pack_mm(flat, self.qweight, self.scales.to(x.dtype))
+                return out.view(*x.shape[:-1], self.out_features)
+            return F.linear(x, self.qweight.to(x.dtype)) * self.scales.to(x.dtype)
+        if x.device.type == "cpu" and x.dtype == torch.bfloat16:
+            packed = self._cpu_int4_pack()
+            if packed is not None:
+                # Fused CPU int4 kernel on a lazily repacked copy of qweight
+                weight, scale_and_zeros = packed
+                flat = x.reshape(-1, self.in_features)
+                out = torch.ops.aten._weight_int4pack_mm_for_cpu(flat, weight, self.group_size, scale_and_zeros)
+                return out.view(*x.shape[:-1], self.out_features)
+        return F.linear(x, self.dequantize(x.dtype))
+    
+    def _cpu_int4_pack(self):
+        """Repack int4 weight for the fused CPU kernel, cached per qweight version"""
+        if not hasattr(torch.ops.aten, "_weight_int4pack_mm_for_cpu"):
+            return None
+        key = (self.qweight.data_ptr(), self.qweight._version, self.scales._version)
+        if getattr(self, "_int4_pack_key", None) != key:
+            q = torch.stack([self.qweight & 0x0F, self.qweight >> 4], dim=-1)
+            q = q.view(self.out_features, self.in_features).to(torch.int32)
+            try:
+                weight = torch.ops.aten._convert_weight_to_int4pack_for_cpu(q, 1)
+            except RuntimeError:
+                weight = None
+            if weight is not None:
+                scales = self.scales.t().to(torch.bfloat16)
+                scale_and_zeros = torch.stack([scales, torch.zeros_like(scales)], dim=-1).contiguous()
+                self._int4_pack = (weight, scale_and_zeros)
+            else:
+                self._int4_pack = None
+            self._int4_pack_key = key
+        return self._int4_pack
+
+    def extra_repr(self) -> str:
+        return (f"in_features={self.in_features}, out_features={self.out_features}, "
+                f"bits={self.bits}, group_size={self.group_size}")
+
+
+def quantize_expert_state(state: Dict[str, torch.Tensor], bits: int = 8,
+                          group_size: int = 128) -> Dict[str, torch.Tensor]:
+    """Quantize expert projections in a flat state dict.
+
+    `...experts.N.w1.weight` becomes `...experts.N.w1.qweight` + `...experts.N.w1.scales`,
+    matching the buffers of QuantizedLinear; other tensors pass through.
+    """
+    quantized = {}
+    for name, tensor in state.items():
+        parts = name.split(".")
+        if (len(parts) >= 4 and parts[-1] == "weight" and parts[-2] in EXPERT_PROJECTIONS
+                and parts[-4] == "experts"):
+            prefix = name[:-len(".weight")]
+            if bits == 8:
+                qweight, scales = quantize_int8_per_channel(tensor)
+            else:
+                qweight, scales = quantize_int4_groupwise(tensor, group_size)
+            quantized[f"{prefix}.qweight"] = qweight
+            quantized[f"{prefix}.scales"] = scales.to(tensor.dtype)
+        else:
+            quantized[name] = tensor
+    return quantized
+
+
+def quantize_moe_experts(model: nn.Module, bits: int = 8, group_size: int = 128) -> nn.Module:
+    """Swap w1/w2/w3 of every MoEExpert in `model` for QuantizedLinear"""
+    from .transformer_moe import MoEExpert
+
+    for module in model.modules():
+        if isinstance(module, MoEExpert):
+            module.quantize(bits, group_size)
+    return model
+
+
+def module_nbytes(module: nn.Module) -> int:
+    """Parameter + buffer memory of a module"""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+if __name__ == "__main__":
+    # Test quantization error
+    torch.manual_seed(0)
+    linear = nn.Linear(1024, 512, bias=False)
+    x = torch.randn(4, 1024)
+    reference = linear(x)
+
+    for bits in (8, 4):
+        qlinear = QuantizedLinear.from_linear(linear, bits=bits, group_size=128)
+        error = (qlinear(x) - reference).abs().max().item()
+        print(f"int{bits}: max abs error {error:.4f}, "
+              f"{module_nbytes(linear) / module_nbytes(qlinear):.2f}x smaller")
@@ -29,7 +29,9 @@ class LoadBalancedRouter(nn.Module):
     def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """Forward pass with load balancing"""
         # x: [batch_size, seq_len, d_model]
-        logits = self.router(x)  # [batch_size, seq_len, num_experts]
+        # Routing runs in the router dtype (fp32) even under autocast
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            logits = self.router(x.to(self.router.weight.dtype))  # [batch_size, seq_len, num_experts]
         
         # Top-k selection
         top_k_logits, top_k_indices = torch.topk(logits, self.top_k, dim=-1)
@@ -59,9 +61,10 @@ class LoadBalancedRouter(nn.Module):
 class ExpertCapacityManager:
     """Manage expert capacity and routing"""
     
-    def __init__(self, num_experts: int, capacity_factor: float = 1.25):
+    def __init__(self, num_experts: int, capacity_factor: float = 1.25, top_k: int = 2):
         self.num_experts = num_experts
         self.capacity_factor = capacity_factor
+        self.top_k = top_k
         
     def compute_capacity(self, seq_len: int) -> int:
         """Compute capacity for experts"""
@@ -69,35 +72,28 @@ class ExpertCapacityManager:
     
     def route_tokens(self, router_probs: torch.Tensor, 
                     top_k_indices: torch.Tensor,
-                    capacity: int) -> Dict[int, torch.Tensor]:
-        """Route tokens to experts with capacity constraints"""
-        batch_size, seq_len, _ = router_probs.shape
-        
-        # Flatten for routing
-        flat_probs = router_probs.view(-1, self.num_experts)
-        flat_indices = top_k_indices.view(-1, self.top_k)
-        
-        # Route tokens to experts
-        expert_assignments = {}
-        
-        for expert_idx in range(self.num_experts):
-            # Find tokens assigned to this expert
-            expert_mask = (flat_indices == expert_idx).any(dim=-1)
-            
-            if expert_mask.any():
-                # Get token indices for this expert
-                token_indices = torch.where(expert_mask)[0]
-                
-                # Apply capacity constraint
-                if len(token_indices) > capacity:
-                    # Select top tokens by probability
-                    expert_probs = flat_probs[token_indices, expert_idx]
-                    _, top_tokens = torch.topk(expert_probs, capacity)
-                    token_indices = token_indices[top_tokens]
-                
-                expert_assignments[expert_idx] = token_indices
-        
-        return expert_assignments
+                    capacity: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Route tokens to experts with capacity constraints.
+        
+        Sync-free: every expert gets a fixed [capacity] slot list holding its
+        highest-probability tokens, padded slots are marked invalid.
+        Returns (token_indices [num_experts, capacity], valid [num_experts, capacity]).
+        """
+        # router_probs, top_k_indices: [batch_size, seq_len, top_k]
+        flat_probs = router_probs.reshape(-1, self.top_k)
+        flat_indices = top_k_indices.reshape(-1, self.top_k)
+        num_tokens = flat_indices.shape[0]
+        capacity = min(capacity, num_tokens)
+        
+        # Per-expert token scores, -inf where the token is not assigned
+        scores = flat_probs.new_full((num_tokens, self.num_experts), float("-inf"))
+        scores = scores.scatter(1, flat_indices, flat_probs)
+        
+        # Select top tokens by probability for every expert at once
+        top_scores, token_indices = torch.topk(scores.t(), capacity, dim=-1)
+        valid = top_scores > float("-inf")
+        
+        return token_indices, valid
 
 
 class Oracle850BRouter(nn.Module):
@@ -118,10 +114,11 @@ class Oracle850BRouter(nn.Module):
             d_model, num_experts, top_k, load_balancing_loss
         )
         self.capacity_manager = ExpertCapacityManager(
-            num_experts, config["moe"].get("capacity_factor", 1.25)
+            num_experts, config["moe"].get("capacity_factor", 1.25), top_k
         )
         
-    def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor,
+                                                Tuple[torch.Tensor, torch.Tensor]]:
         """Forward pass through router"""
         # Get routing decisions
         probs, indices, load_balancing_loss = self.router(x)
@@ -155,4 +152,5 @@ if __name__ == "__main__":
     probs, indices, loss, assignments = router(x)
     print(f"Router output shapes: {probs.shape}, {indices.shape}")
     print(f"Load balancing loss: {loss.item():.4f}")
-    print(f"Expert assignments: {len(assignments)} experts")
+    token_indices, valid = assignments
+    print(f"Expert assignments: {token_indices.shape}, routed: {valid.sum().item()}")
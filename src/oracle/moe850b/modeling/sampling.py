@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Batched Sampling
+Per-slot sampling parameters and one-pass penalties/temperature/top-k/top-p/stop matching for a decode batch
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+NO_TOKEN = -2      # empty position of the generated-token tail
+STOP_PADDING = -1  # left padding of right-aligned stop sequences (matches anything)
+BANNED_LOGIT = -1e30  # additive bias of tokens a constraint does not allow
+
+
+class BatchedSampler:
+    """Sampling state for a pool of slots and batched next-token selection.
+
+    Parameters are written once per sequence (add) into slot-indexed
+    tensors, so a decode step over any subset of slots is pure tensor ops:
+    repetition penalty (CTRL-style, over prompt and generated tokens),
+    presence penalty (generated tokens), temperature, per-row top-k and
+    top-p, then inverse-CDF sampling with one uniform number per row (seeded
+    rows draw theirs from their own generator). Temperature 0 rows take the
+    argmax of the penalized logits. Only the top max(k) logits are sorted
+    when every row has top-k; top-p rows first try the top `candidates`
+    logits and fall back to a full sort when those do not reach top_p.
+    An all-greedy batch skips sampling.
+
+    Stop sequences are token-id sequences matched against the tail of the
+    generated tokens; sample() reports which rows completed one and its
+    length, the caller trims them from the output.
+
+    A constraint restricts a slot to the tokens allowed by an automaton:
+    any object with `vocab_size`, `initial_state`, `allowed(state, device)`
+    (bool [vocab_size] mask, cached per state by the constraint) and
+    `advance(state, token_id)`. The slot's current mask is kept as an
+    additive bias (0 or BANNED_LOGIT) in a [num_slots, vocab_size] pool, so
+    masking a step is one add over the batch (cheaper than masked_fill on
+    CPU); after sampling, constrained rows advance their state and convert
+    the next mask into their bias row in place.
+    """
+
+    def __init__(self, num_slots: int, vocab_size: int, device: torch.device,
+                 max_stop_sequences: int = 4, max_stop_len: int = 32, candidates: int = 1024):
+        self.num_slots = num_slots
+        self.candidates = candidates
+        self.vocab_size = vocab_size
+        self.device = device
+        self.max_stop_sequences = max_stop_sequences
+        self.max_stop_len = max_stop_len
+
+        self.temperature = torch.ones(num_slots, device=device)
+        self.top_k = torch.zeros(num_slots, dtype=torch.long, device=device)
+        self.top_p = torch.ones(num_slots, device=device)
+        self.repetition_penalty = torch.ones(num_slots, device=device)
+        self.presence_penalty = torch.zeros(num_slots, device=device)
+        self.stop_ids = torch.full((num_slots, max_stop_sequences, max_stop_len), STOP_PADDING,
+                                   dtype=torch.long, device=device)
+        self.stop_lens = torch.zeros(num_slots, max_stop_sequences, dtype=torch.long, device=device)
+        self.tail = torch.full((num_slots, max_stop_len), NO_TOKEN, dtype=torch.long, device=device)
+        # Token presence pools, allocated on the first sequence with a penalty
+        self.prompt_mask: Optional[torch.Tensor] = None    # [num_slots, vocab_size] bool
+        self.output_counts: Optional[torch.Tensor] = None  # [num_slots, vocab_size] int32
+
+        self.generators: Dict[int, torch.Generator] = {}
+        # Allowed-token bias of constrained slots, allocated on the first constraint
+        self.token_bias: Optional[torch.Tensor] = None     # [num_slots, vocab_size] float
+        self.constraints: Dict[int, Tuple[Any, int]] = {}  # slot -> (constraint, state)
+        self.penalized = set()
+        self.with_stops = set()
+        # Host copies for shape decisions without device syncs
+        self.slot_top_k = [0] * num_slots
+        self.slot_greedy = [False] * num_slots
+
+    def add(self, slot: int, temperature: float = 1.0, top_k: int = 0, top_p: float = 1.0,
+            repetition_penalty: float = 1.0, presence_penalty: float = 0.0,
+            prompt_ids: Optional[List[int]] = None, stop_token_ids: Optional[List[List[int]]] = None,
+            generator: Optional[torch.Generator] = None, constraint: Any = None):
+        """Reset a slot for a new sequence"""
+        stop_token_ids = [ids for ids in stop_token_ids or [] if ids]
+        if len(stop_token_ids) > self.max_stop_sequences:
+            raise ValueError(f"At most {self.max_stop_sequences} stop sequences are supported")
+        if any(len(ids) > self.max_stop_len for ids in stop_token_ids):
+            raise ValueError(f"Stop sequences longer than {self.max_stop_len} tokens are not supported")
+        if constraint is not None and constraint.vocab_size != self.vocab_size:
+            raise ValueError(f"Constraint vocabulary ({constraint.vocab_size}) does not match "
+                             f"the model vocabulary ({self.vocab_size})")
+
+        top_k = top_k if 0 < top_k < self.vocab_size else 0
+        self.temperature[slot] = temperature
+        self.top_k[slot] = top_k
+        self.slot_top_k[slot] = top_k
+        self.slot_greedy[slot] = temperature == 0
+        self.top_p[slot] = top_p
+        self.repetition_penalty[slot] = repetition_penalty
+        self.presence_penalty[slot] = presence_penalty
+        self.tail[slot] = NO_TOKEN
+
+        self.stop_ids[slot] = STOP_PADDING
+        self.stop_lens[slot] = 0
+        for i, ids in enumerate(stop_token_ids):
+            self.stop_ids[slot, i, self.max_stop_len - len(ids):] = torch.tensor(ids, device=self.device)
+            self.stop_lens[slot, i] = len(ids)
+        self._toggle(self.with_stops, slot, bool(stop_token_ids))
+
+        penalized = repetition_penalty != 1.0 or presence_penalty != 0.0
+        self._toggle(self.penalized, slot, penalized)
+        if penalized:
+            if self.prompt_mask is None:
+                self.prompt_mask = torch.zeros(self.num_slots, self.vocab_size, dtype=torch.bool,
+                                               device=self.device)
+                self.output_counts = torch.zeros(self.num_slots, self.vocab_size, dtype=torch.int32,
+                                                 device=self.device)
+            self.prompt_mask[slot] = False
+            self.output_counts[slot] = 0
+            if prompt_ids:
+                self.prompt_mask[slot, torch.tensor(prompt_ids, device=self.device)] = True
+
+        if generator is not None:
+            self.generators[slot] = generator
+        else:
+            self.generators.pop(slot, None)
+
+        self._clear_constraint(slot)
+        if constraint is not None:
+            if self.token_bias is None:
+                self.token_bias = torch.zeros(self.num_slots, self.vocab_size, device=self.device)
+            state = constraint.initial_state
+            self.constraints[slot] = (constraint, state)
+            self._set_mask(slot, constraint.allowed(state, self.device))
+
+    def remove(self, slot: int):
+        """Forget a finished sequence"""
+        self.generators.pop(slot, None)
+        self._clear_constraint(slot)
+        self.penalized.discard(slot)
+        self.with_stops.discard(slot)
+
+    def _clear_constraint(self, slot: int):
+        if self.constraints.pop(slot, None) is not None:
+            self.token_bias[slot] = 0.0
+
+    def _set_mask(self, slot: int, allowed: torch.Tensor):
+        # 1/0 -> 0/BANNED_LOGIT without a temporary
+        self.token_bias[slot].copy_(allowed).sub_(1.0).mul_(-BANNED_LOGIT)
+
+    @staticmethod
+    def _toggle(members: set, slot: int, enabled: bool):
+        if enabled:
+            members.add(slot)
+        else:
+            members.discard(slot)
+
+    def sample(self, logits: torch.Tensor, slots: List[int]) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Next tokens for logits [batch, vocab] of the given slots.
+
+        Returns (tokens [batch], stopped [batch] bool, stop_len [batch]);
+        stop_len is the token length of the completed stop sequence.
+        """
+        index = torch.tensor(slots, device=self.device)
+        logits = logits.float()
+
+        if self.penalized.intersection(slots):
+            generated = self.output_counts[index] > 0
+            seen = generated | self.prompt_mask[index]
+            penalty = self.repetition_penalty[index].unsqueeze(-1)
+            logits = torch.where(seen, torch.where(logits > 0, logits / penalty, logits * penalty), logits)
+            logits = logits - self.presence_penalty[index].unsqueeze(-1) * generated
+
+        constrained = [row for row, slot in enumerate(slots) if slot in self.constraints]
+        if constrained:
+            logits = logits + self.token_bias[index]
+
+        if all(self.slot_greedy[slot] for slot in slots):
+            tokens = logits.argmax(dim=-1)
+        else:
+            tokens = self._sample_rows(logits, index, slots)
+
+        if self.penalized.intersection(slots):
+            self.output_counts.index_put_((index, tokens), torch.ones_like(tokens, dtype=torch.int32),
+                                          accumulate=True)
+
+        if constrained:
+            chosen = tokens.tolist()
+            for row in constrained:
+                slot = slots[row]
+                constraint, state = self.constraints[slot]
+                next_state = constraint.advance(state, chosen[row])
+                if next_state != state:  # self-loops (inside strings, digits) keep the bias row
+                    self.constraints[slot] = (constraint, next_state)
+                    self._set_mask(slot, constraint.allowed(next_state, self.device))
+
+        stopped = torch.zeros_like(tokens, dtype=torch.bool)
+        stop_len = torch.zeros_like(tokens)
+        if self.with_stops.intersection(slots):
+            tail = torch.cat([self.tail[index, 1:], tokens.unsqueeze(-1)], dim=-1)
+            self.tail[index] = tail
+            stop_ids = self.stop_ids[index]
+            matched = ((stop_ids == tail.unsqueeze(1)) | (stop_ids == STOP_PADDING)).all(dim=-1)
+            stop_lens = self.stop_lens[index]
+            matched &= stop_lens > 0
+            stopped = matched.any(dim=-1)
+            stop_len = torch.where(matched, stop_lens, torch.zeros_like(stop_lens)).amax(dim=-1)
+        return tokens, stopped, stop_len
+
+    def _sample_rows(self, logits: torch.Tensor, index: torch.Tensor, slots: List[int]) -> torch.Tensor:
+        temperature = self.temperature[index]
+        greedy = (temperature == 0).unsqueeze(-1)
+        scaled = logits / torch.where(greedy.squeeze(-1), torch.ones_like(temperature), temperature).unsqueeze(-1)
+        top_k = self.top_k[index].unsqueeze(-1)
+        top_p = self.top_p[index].unsqueeze(-1)
+
+        # Candidates in descending order: top max(k) when every row has top-k, otherwise
+        # try the top `candidates` and fall back to a full sort unless they cover top_p
+        top_ks = [self.slot_top_k[slot] for slot in slots]
+        width = max(top_ks) if all(top_ks) else min(self.candidates, self.vocab_size)
+        while True:
+            if width < self.vocab_size:
+                sorted_logits, sorted_idx = scaled.topk(width, dim=-1)
+            else:
+                sorted_logits, sorted_idx = scaled.sort(dim=-1, descending=True)
+            ranks = torch.arange(width, device=self.device)
+            sorted_logits = sorted_logits.masked_fill((top_k > 0) & (ranks >= top_k), float("-inf"))
+            # top-k rows renormalize over the kept k, others over the whole vocabulary
+            lse = sorted_logits.logsumexp(dim=-1, keepdim=True)
+            if not all(top_ks):
+                lse = torch.where(top_k > 0, lse, scaled.logsumexp(dim=-1, keepdim=True))
+            probs = (sorted_logits - lse).exp()
+            cdf = probs.cumsum(dim=-1)
+            if width == self.vocab_size or all(top_ks):
+                break
+            covered = greedy | ((top_k > 0) & (top_k <= width)) | ((top_k == 0) & (cdf[:, -1:] >= top_p))
+            if bool(covered.all()):
+                break
+            width = self.vocab_size
+
+        # Keep the smallest prefix whose mass reaches top_p (always at least one token)
+        keep = (cdf - probs < top_p) | (top_p >= 1.0)
+        mass = torch.where(keep, cdf, torch.zeros_like(cdf)).amax(dim=-1, keepdim=True)
+        cdf = torch.where(keep, cdf, torch.full_like(cdf, float("inf")))
+
+        uniform = torch.rand(len(slots), 1, device=self.device)
+        for row, slot in enumerate(slots):
+            generator = self.generators.get(slot)
+            if generator is not None:
+                uniform[row] = torch.rand(1, generator=generator, device=self.device)
+        choice = torch.searchsorted(cdf, uniform * mass, right=True).clamp_(max=width - 1)
+        tokens = sorted_idx.gather(-1, choice).squeeze(-1)
+        return torch.where(greedy.squeeze(-1), logits.argmax(dim=-1), tokens)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Speculative Decoding
+Mini-config draft model proposes tokens, the full model verifies them in one forward
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+
+from .generation import logits_to_probs, sample_from_probs
+
+
+class SpeculativeStats:
+    """Counters for acceptance rate and tokens per verifier forward"""
+
+    def __init__(self):
+        self.drafted = 0
+        self.accepted = 0
+        self.generated = 0
+        self.target_forwards = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+    @property
+    def tokens_per_target_forward(self) -> float:
+        return self.generated / self.target_forwards if self.target_forwards else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "generated": self.generated,
+            "target_forwards": self.target_forwards,
+            "acceptance_rate": self.acceptance_rate,
+            "tokens_per_target_forward": self.tokens_per_target_forward,
+        }
+
+
+class SpeculativeState:
+    """Committed tokens and both KV caches of one sequence"""
+
+    def __init__(self, tokens: torch.Tensor, target_cache, draft_cache):
+        self.tokens = tokens
+        self.target_cache = target_cache
+        self.draft_cache = draft_cache
+
+
+class SpeculativeDecoder:
+    """Speculative sampling (Leviathan et al. / Chen et al.).
+
+    The draft model samples `lookahead` tokens autoregressively, the target
+    scores all of them in a single forward and accepts token x with
+    probability min(1, p(x) / q(x)). The first rejected position is resampled
+    from normalize(max(p - q, 0)); if everything is accepted a bonus token is
+    sampled from the target. The output distribution equals sampling from
+    the target alone.
+    """
+
+    def __init__(self, target: nn.Module, draft: nn.Module, lookahead: int = 4):
+        if target.vocab_size != draft.vocab_size:
+            raise ValueError(f"Draft vocab_size={draft.vocab_size} != target vocab_size={target.vocab_size}")
+        if lookahead < 1:
+            raise ValueError(f"lookahead must be >= 1, got {lookahead}")
+        self.target = target
+        self.draft = draft
+        self.lookahead = lookahead
+        self.stats = SpeculativeStats()
+
+    @torch.inference_mode()
+    def start(self, input_ids: torch.Tensor) -> SpeculativeState:
+        """Prefill both models with the prompt [1, prompt_len]"""
+        if input_ids.shape[0] != 1:
+            raise ValueError("Speculative decoding supports batch_size=1")
+
+        # A round crops at most `lookahead` rejected tokens from either cache
+        state = SpeculativeState(input_ids, self.target.create_kv_cache(max_rewind=self.lookahead),
+                                 self.draft.create_kv_cache(max_rewind=self.lookahead))
+        # Invariant: caches hold everything except the last committed token,
+        # whose logits are (re)computed at the start of the next round
+        if input_ids.shape[1] > 1:
+            self.target(input_ids[:, :-1], kv_cache=state.target_cache, return_logits=False)
+            self.draft(input_ids[:, :-1], kv_cache=state.draft_cache, return_logits=False)
+        return state
+
+    @torch.inference_mode()
+    def step(self, state: SpeculativeState, max_new_tokens: Optional[int] = None,
+             temperature: float = 1.0, top_k: int = 0, top_p: float = 1.0,
+             generator: Optional[torch.Generator] = None) -> torch.Tensor:
+        """One draft/verify round, returns the 1..lookahead+1 committed tokens [1, n]"""
+        sampling = (temperature, top_k, top_p)
+        lookahead = min(self.lookahead, max_new_tokens or self.lookahead)
+        tokens, target_cache, draft_cache = state.tokens, state.target_cache, state.draft_cache
+
+        # Draft: feed the uncached tail, then sample lookahead tokens
+        draft_tokens, draft_probs = [], []
+        draft_input = tokens[:, draft_cache.get_seq_length():]
+        for _ in range(lookahead):
+            logits = self.draft(draft_input, kv_cache=draft_cache, return_logits="last")[:, -1]
+            probs = logits_to_probs(logits, *sampling)
+            draft_input = sample_from_probs(probs, generator)
+            draft_tokens.append(draft_input)
+            draft_probs.append(probs)
+        draft_tokens = torch.cat(draft_tokens, dim=1)  # [1, lookahead]
+        draft_probs = torch.cat(draft_probs, dim=0)    # [lookahead, vocab_size]
+
+        # Verify: one target forward over the uncached tail + all drafts
+        cached = target_cache.get_seq_length()
+        verify_input = torch.cat([tokens[:, cached:], draft_tokens], dim=1)
+        logits = self.target(verify_input, kv_cache=target_cache)[0, -(lookahead + 1):]
+        target_probs = logits_to_probs(logits, *sampling)  # [lookahead + 1, vocab_size]
+        self.stats.target_forwards += 1
+
+        # Accept/reject left to right
+        positions = torch.arange(lookahead, device=draft_tokens.device)
+        drafted = draft_tokens[0]
+        p = target_probs[positions, drafted]
+        q = draft_probs[positions, drafted]
+        uniform = torch.rand(lookahead, generator=generator, device=p.device)
+        rejected = (uniform * q > p).nonzero()
+        num_accepted = rejected[0, 0].item() if len(rejected) else lookahead
+
+        if num_accepted < lookahead:
+            residual = (target_probs[num_accepted] - draft_probs[num_accepted]).clamp(min=0)
+            if residual.sum() <= 0:
+                residual = target_probs[num_accepted]
+            next_token = sample_from_probs((residual / residual.sum()).unsqueeze(0), generator)
+        else:
+            next_token = sample_from_probs(target_probs[-1:], generator)
+
+        new_tokens = torch.cat([draft_tokens[:, :num_accepted], next_token], dim=1)
+        self.stats.drafted += lookahead
+        self.stats.accepted += num_accepted
+        self.stats.generated += new_tokens.shape[1]
+        state.tokens = torch.cat([tokens, new_tokens], dim=1)
+
+        # Roll both caches back to the committed prefix (minus the last token)
+        committed = state.tokens.shape[1] - 1
+        target_cache.crop(committed)
+        draft_cache.crop(min(committed, draft_cache.get_seq_length()))
+        return new_tokens
+
+    def generate(self, input_ids: torch.Tensor, max_new_tokens: int = 128,
+                 temperature: float = 1.0, top_k: int = 0, top_p: float = 1.0,
+                 eos_token_id: Optional[int] = None,
+                 generator: Optional[torch.Generator] = None) -> torch.Tensor:
+        """Prompt + generated tokens [1, prompt_len + new_len] (batch size 1)"""
+        state = self.start(input_ids)
+        prompt_len = input_ids.shape[1]
+
+        while state.tokens.shape[1] - prompt_len < max_new_tokens:
+            remaining = max_new_tokens - (state.tokens.shape[1] - prompt_len)
+            new_tokens = self.step(state, remaining, temperature, top_k, top_p, generator)
+
+            if eos_token_id is not None and (new_tokens == eos_token_id).any():
+                eos_at = (state.tokens[0, prompt_len:] == eos_token_id).nonzero()[0, 0].item()
+                return state.tokens[:, :prompt_len + eos_at + 1]
+
+        return state.tokens[:, :prompt_len + max_new_tokens]
+
+
+if __name__ == "__main__":
+    # Test greedy speculative decoding reproduces plain target decoding
+    from .generation import generate
+    from .transformer_moe import Oracle850BTransformer
+
+    def tiny_config(n_layers: int):
+        return {
+            "dense": {"d_model": 64, "n_layers": n_layers, "n_heads": 4, "d_ff": 128},
+            "moe": {"experts": 4, "router": {"k": 2, "load_balancing_loss": 0.01}},
+            "vocab_size": 256,
+            "max_seq_len": 128,
+        }
+
+    torch.manual_seed(0)
+    target = Oracle850BTransformer(tiny_config(4)).eval()
+    draft = Oracle850BTransformer(tiny_config(1)).eval()
+    prompt = torch.randint(0, 256, (1, 8))
+
+    reference = generate(target, prompt, max_new_tokens=24, temperature=0)
+    decoder = SpeculativeDecoder(target, draft, lookahead=4)
+    output = decoder.generate(prompt, max_new_tokens=24, temperature=0)
+
+    print(f"greedy speculative matches target: {torch.equal(output, reference)}")
+    print(f"stats: {decoder.stats.to_dict()}")
+
+    # Self-speculation (draft == target) accepts every drafted token
+    decoder = SpeculativeDecoder(target, target, lookahead=4)
+    decoder.generate(prompt, max_new_tokens=24, temperature=1.0, generator=torch.Generator().manual_seed(0))
+    print(f"draft == target acceptance rate: {decoder.stats.acceptance_rate:.2f}")
+
+    # Rejected drafts roll back a sliding-window cache without shrinking the window
+    for window in (6, 3):
+        windowed = dict(tiny_config(4), sliding_window=window, attention_sink_tokens=2)
+        target = Oracle850BTransformer(windowed).eval()
+        draft = Oracle850BTransformer(dict(tiny_config(1), sliding_window=window, attention_sink_tokens=2)).eval()
+        reference = generate(target, prompt, max_new_tokens=24, temperature=0)
+        decoder = SpeculativeDecoder(target, draft, lookahead=4)
+        output = decoder.generate(prompt, max_new_tokens=24, temperature=0)
+        print(f"greedy speculative matches target (window={window}): {torch.equal(output, reference)}")
+        assert torch.equal(output, reference)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Host Sync Instrumentation
+Count device->host synchronizations per forward pass
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import collections
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+import torch.nn as nn
+from torch.overrides import TorchFunctionMode
+
+
+# Ops that read tensor values on the host or produce data-dependent shapes
+_SYNC_OPS = {
+    torch.Tensor.item,
+    torch.Tensor.tolist,
+    torch.Tensor.__bool__,
+    torch.Tensor.__int__,
+    torch.Tensor.__float__,
+    torch.Tensor.__index__,
+    torch.Tensor.nonzero,
+    torch.Tensor.masked_select,
+    torch.Tensor.unique,
+    torch.Tensor.bincount,
+    torch.Tensor.cpu,
+    torch.Tensor.numpy,
+    torch.nonzero,
+    torch.argwhere,
+    torch.masked_select,
+    torch.unique,
+    torch.bincount,
+}
+
+
+def _is_bool_index(index: Any) -> bool:
+    """Boolean mask indexing has a data-dependent output shape"""
+    if isinstance(index, tuple):
+        return any(_is_bool_index(i) for i in index)
+    return isinstance(index, torch.Tensor) and index.dtype == torch.bool
+
+
+def _is_sync(func: Callable, args: tuple, kwargs: Dict[str, Any]) -> bool:
+    """Check whether a torch call forces a device->host sync"""
+    if func in _SYNC_OPS:
+        return True
+    if func in (torch.Tensor.__getitem__, torch.Tensor.__setitem__):
+        return len(args) > 1 and _is_bool_index(args[1])
+    if func is torch.where:
+        # Single-argument torch.where is nonzero(as_tuple=True)
+        return len(args) + len(kwargs) == 1
+    if func in (torch.repeat_interleave, torch.Tensor.repeat_interleave):
+        repeats = args[1] if len(args) > 1 else kwargs.get("repeats")
+        return isinstance(repeats, torch.Tensor) and kwargs.get("output_size") is None
+    return False
+
+
+class HostSyncCounter(TorchFunctionMode):
+    """CPU-side counter of host syncs, usable as a context manager or module hook"""
+
+    def __init__(self, cuda_debug_mode: Optional[str] = None):
+        super().__init__()
+        self.cuda_debug_mode = cuda_debug_mode
+        self.count = 0
+        self.events = collections.Counter()
+        self.per_forward: List[int] = []
+        self._prev_cuda_mode = None
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if _is_sync(func, args, kwargs):
+            self.count += 1
+            self.events[getattr(func, "__name__", str(func))] += 1
+        return func(*args, **kwargs)
+
+    def __enter__(self):
+        if self.cuda_debug_mode is not None and torch.cuda.is_available():
+            # Also let CUDA flag syncs we do not know by name
+            self._prev_cuda_mode = torch.cuda.get_sync_debug_mode()
+            torch.cuda.set_sync_debug_mode(self.cuda_debug_mode)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._prev_cuda_mode is not None:
+            torch.cuda.set_sync_debug_mode(self._prev_cuda_mode)
+            self._prev_cuda_mode = None
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def reset(self):
+        """Reset all counters"""
+        self.count = 0
+        self.events.clear()
+        self.per_forward.clear()
+
+    def attach(self, module: nn.Module) -> Callable[[], None]:
+        """Count syncs for every forward of `module`, returns a detach function"""
+        start = {}
+
+        def pre_hook(mod, inputs):
+            start["count"] = self.count
+            self.__enter__()
+
+        def post_hook(mod, inputs, output):
+            self.__exit__(None, None, None)
+            self.per_forward.append(self.count - start["count"])
+
+        handles = [
+            module.register_forward_pre_hook(pre_hook),
+            module.register_forward_hook(post_hook)
+        ]
+
+        def detach():
+            for handle in handles:
+                handle.remove()
+
+        return detach
+
+
+def count_host_syncs(fn: Callable, *args, **kwargs) -> HostSyncCounter:
+    """Run `fn` once and return the populated counter"""
+    counter = HostSyncCounter()
+    with counter:
+        fn(*args, **kwargs)
+    return counter
+
+
+if __name__ == "__main__":
+    # Regression check: capacity dispatch (train mode) must stay sync-free,
+    # dropless dispatch reads the bucket sizes back exactly once per layer
+    from .transformer_moe import MoELayer
+
+    layer = MoELayer(64, 16, 128, top_k=2, dispatch="capacity").train()
+    x = torch.randn(2, 32, 64)
+
+    counter = count_host_syncs(layer, x)
+    print(f"capacity dispatch syncs: {counter.count} {dict(counter.events)}")
+    assert counter.count == 0, f"capacity dispatch issued host syncs: {dict(counter.events)}"
+
+    layer.eval()
+    with torch.no_grad():
+        counter = count_host_syncs(layer, x)
+    print(f"dropless dispatch syncs: {counter.count} {dict(counter.events)}")
+    assert counter.count == 1, f"dropless dispatch expected one host sync: {dict(counter.events)}"
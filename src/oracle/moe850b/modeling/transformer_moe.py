@@ -8,8 +8,26 @@ Author: MagistrTheOne|Краснодар|2025
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Union
 import math
+from torch.utils.checkpoint import checkpoint
+
+from .attention import (
+    Oracle850BAttention, build_attention_mask, convert_legacy_attention_mask,
+    document_ids_from_cu_seqlens, position_ids_from_document_ids
+)
+from .kv_cache import DynamicKVCache, create_kv_cache
+from .precision import PrecisionPolicy
+from .vocab_parallel import (
+    VocabParallelEmbedding, VocabParallelLMHead, copy_to_parallel_region, vocab_parallel_cross_entropy
+)
+
+
+class OracleLayerNorm(nn.LayerNorm):
+    """LayerNorm computed in its parameter dtype (fp32 under mixed precision)"""
+    
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return super().forward(x.to(self.weight.dtype)).to(x.dtype)
 
 
 class MoERouter(nn.Module):
@@ -27,7 +45,9 @@ class MoERouter(nn.Module):
     def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         """Forward pass through router"""
         # x: [batch_size, seq_len, d_model]
-        logits = self.router(x)  # [batch_size, seq_len, num_experts]
+        # Routing runs in the router dtype (fp32) even under autocast
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            logits = self.router(x.to(self.router.weight.dtype))  # [batch_size, seq_len, num_experts]
         
         # Top-k selection
         top_k_logits, top_k_indices = torch.topk(logits, self.top_k, dim=-1)
@@ -50,6 +70,15 @@ class MoEExpert(nn.Module):
         self.w2 = nn.Linear(d_ff, d_model, bias=False)
         self.w3 = nn.Linear(d_model, d_ff, bias=False)
         
+    def quantize(self, bits: int = 8, group_size: int = 128):
+        """Replace w1/w2/w3 with weight-only quantized projections"""
+        from .quantization import QuantizedLinear
+        
+        for name in ("w1", "w2", "w3"):
+            linear = getattr(self, name)
+            if isinstance(linear, nn.Linear):
+                setattr(self, name, QuantizedLinear.from_linear(linear, bits, group_size))
+        
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Forward pass through expert"""
         if self.activation == "swiglu":
@@ -59,15 +88,26 @@ class MoEExpert(nn.Module):
 
 
 class MoELayer(nn.Module):
-    """MoE layer with multiple experts"""
+    """MoE layer with multiple experts.
+    
+    dispatch="dropless" (default) routes every assignment and is exact for
+    inference. dispatch="capacity" is an opt-in for torch.compile training
+    runs: it drops overflowing assignments and only takes effect in train
+    mode, eval mode always falls back to dropless dispatch.
+    """
     
     def __init__(self, d_model: int, num_experts: int, d_ff: int, 
-                 top_k: int = 2, capacity_factor: float = 1.25):
+                 top_k: int = 2, capacity_factor: float = 1.25,
+                 dispatch: str = "dropless", min_capacity: int = 4):
         super().__init__()
+        if dispatch not in ("dropless", "capacity"):
+            raise ValueError(f"Unknown MoE dispatch mode: {dispatch}")
         self.d_model = d_model
         self.num_experts = num_experts
         self.top_k = top_k
         self.capacity_factor = capacity_factor
+        self.dispatch = dispatch
+        self.min_capacity = min_capacity
         
         # Router
         self.router = MoERouter(d_model, num_experts, top_k)
@@ -77,48 +117,119 @@ class MoELayer(nn.Module):
             MoEExpert(d_model, d_ff) for _ in range(num_experts)
         ])
         
+    def expert_capacity(self, num_tokens: int) -> int:
+        """Static per-expert, per-sequence bucket size for capacity dispatch"""
+        capacity = math.ceil(self.capacity_factor * num_tokens * self.top_k / self.num_experts)
+        return max(capacity, min(num_tokens, self.min_capacity))
+    
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Forward pass through MoE layer"""
+        if self.dispatch == "capacity" and self.training:
+            return self._forward_capacity(x)
+        
+        return self._forward_dropless(x)
+    
+    def _forward_dropless(self, x: torch.Tensor) -> torch.Tensor:
+        """Variable-size dispatch without token dropping.
+        
+        Assignments are grouped by expert with a sort; the bucket sizes are
+        read back once per layer (a single host sync) instead of once per expert.
+        """
         batch_size, seq_len, d_model = x.shape
+        num_tokens = batch_size * seq_len
         
         # Get routing decisions
         probs, indices = self.router(x)  # [batch_size, seq_len, top_k]
         
-        # Calculate capacity
-        capacity = int(self.capacity_factor * seq_len)
-        
-        # Initialize output
-        output = torch.zeros_like(x)
-        
-        # Process each expert
-        for expert_idx in range(self.num_experts):
-            # Find tokens assigned to this expert
-            expert_mask = (indices == expert_idx).any(dim=-1)  # [batch_size, seq_len]
-            
-            if expert_mask.any():
-                # Get tokens for this expert
-                expert_tokens = x[expert_mask]  # [num_tokens, d_model]
-                
-                # Apply expert
-                expert_output = self.experts[expert_idx](expert_tokens)
-                
-                # Get routing weights for this expert
-                expert_probs = probs[expert_mask]  # [num_tokens, top_k]
-                expert_weights = expert_probs[:, (indices[expert_mask] == expert_idx).nonzero(as_tuple=True)[1]]
-                
-                # Weighted output
-                weighted_output = expert_output * expert_weights.unsqueeze(-1)
-                
-                # Scatter back to output
-                output[expert_mask] += weighted_output
-        
-        return output
-
+        flat_x = x.reshape(num_tokens, d_model)
+        flat_experts = indices.reshape(-1)
+        flat_probs = probs.reshape(-1)
+        
+        # Group assignments by expert
+        order = torch.argsort(flat_experts, stable=True)
+        token_idx = order // self.top_k
+        counts = flat_experts.new_zeros(self.num_experts).scatter_add_(
+            0, flat_experts, torch.ones_like(flat_experts)
+        ).tolist()
+        
+        # Apply experts to their contiguous slices
+        expert_inputs = flat_x[token_idx].split(counts)
+        expert_out = torch.cat([
+            expert(tokens) if count else tokens
+            for expert, tokens, count in zip(self.experts, expert_inputs, counts)
+        ])
+        
+        # Weighted scatter back to tokens
+        weighted = expert_out * flat_probs[order].to(x.dtype).unsqueeze(-1)
+        output = flat_x.new_zeros(num_tokens, d_model).index_add(0, token_idx, weighted)
+        
+        return output.view(batch_size, seq_len, d_model)
+    
+    def _forward_capacity(self, x: torch.Tensor) -> torch.Tensor:
+        """Static-shape dispatch: every expert gets a fixed-capacity bucket per sequence.
+        
+        No host syncs and no Python branches on tensor values, so the layer
+        traces into a single torch.compile graph. Assignments that overflow
+        a bucket are dropped (GShard-style). Train-only: never use it behind
+        a KV cache, since cached and recomputed tokens are routed differently.
+        
+        Buckets are filled per sequence in token order, and token t may only
+        use the capacity of its prefix (expert_capacity(t + 1)), so whether it
+        is dropped depends only on tokens <= t of the same sequence: appending
+        tokens or batching other sequences never changes earlier outputs.
+        """
+        batch_size, seq_len, d_model = x.shape
+        num_tokens = batch_size * seq_len
+        num_assignments = seq_len * self.top_k
+        capacity = self.expert_capacity(seq_len)
+        
+        # Get routing decisions
+        probs, indices = self.router(x)  # [batch_size, seq_len, top_k]
+        
+        # Assignments token-major within each sequence: [batch_size, seq_len * top_k]
+        flat_x = x.reshape(num_tokens, d_model)
+        flat_experts = indices.reshape(batch_size, num_assignments)
+        flat_probs = probs.reshape(batch_size, num_assignments)
+        token_idx = torch.arange(num_tokens, device=x.device).repeat_interleave(self.top_k)
+        
+        # Position of each assignment inside its expert bucket of the same sequence
+        one_hot = F.one_hot(flat_experts, self.num_experts)  # [batch_size, seq_len * top_k, num_experts]
+        position = (torch.cumsum(one_hot, dim=1) - 1).gather(2, flat_experts.unsqueeze(-1)).squeeze(-1)
+        
+        # Causal capacity limit of every assignment's prefix: expert_capacity(1..seq_len)
+        # on device, float64 in the same operation order so it rounds like the host formula
+        prefix_len = torch.arange(1, seq_len + 1, device=x.device)
+        limit = torch.ceil(prefix_len.double() * self.capacity_factor * self.top_k / self.num_experts).long()
+        limit = torch.maximum(limit, prefix_len.clamp(max=self.min_capacity)).repeat_interleave(self.top_k)
+        keep = position < limit
+        
+        # Slots [num_experts, batch_size, capacity], overflow goes to a trailing scratch slot
+        scratch = self.num_experts * batch_size * capacity
+        sequence_idx = torch.arange(batch_size, device=x.device).unsqueeze(-1)
+        slot = (flat_experts * batch_size + sequence_idx) * capacity + position
+        slot = torch.where(keep, slot, torch.full_like(slot, scratch)).reshape(-1)
+        
+        # Dispatch into [num_experts, batch_size * capacity, d_model]
+        buckets = flat_x.new_zeros(scratch + 1, d_model).index_add(0, slot, flat_x[token_idx])
+        buckets = buckets[:scratch].view(self.num_experts, batch_size * capacity, d_model)
+        
+        # Apply experts on fixed-shape buckets
+        expert_out = torch.stack([
+            expert(buckets[expert_idx]) for expert_idx, expert in enumerate(self.experts)
+        ]).view(scratch, d_model)
+        expert_out = torch.cat([expert_out, expert_out.new_zeros(1, d_model)], dim=0)
+        
+        # Combine weighted outputs back per token
+        weights = (flat_probs * keep).reshape(-1).to(x.dtype).unsqueeze(-1)
+        output = flat_x.new_zeros(num_tokens, d_model).index_add(0, token_idx, expert_out[slot] * weights)
+        
+        return output.view(batch_size, seq_len, d_model)
 
 class Oracle850BTransformer(nn.Module):
     """Oracle850B MoE Transformer Model"""
     
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], precision: Optional[PrecisionPolicy] = None,
+                 vocab_parallel_group: Optional[Any] = None):
         super().__init__()
         self.config = config
         
@@ -134,9 +245,20 @@ class Oracle850BTransformer(nn.Module):
         self.num_experts = config["moe"]["experts"]
         self.top_k = config["moe"]["router"]["k"]
         
+        # Output head options
+        self.tie_word_embeddings = config.get("tie_word_embeddings", False)
+        self.vocab_parallel = config.get("vocab_parallel", False)
+        
         # Embeddings
-        self.token_embedding = nn.Embedding(self.vocab_size, self.d_model)
-        self.position_embedding = nn.Embedding(self.max_seq_len, self.d_model)
+        if self.vocab_parallel:
+            self.token_embedding = VocabParallelEmbedding(self.vocab_size, self.d_model, vocab_parallel_group)
+        else:
+            self.token_embedding = nn.Embedding(self.vocab_size, self.d_model)
+        
+        # Positions: learned absolute embedding or RoPE inside attention
+        self.position_encoding = config.get("position_encoding", "learned")
+        if self.position_encoding == "learned":
+            self.position_embedding = nn.Embedding(self.max_seq_len, self.d_model)
         
         # Transformer layers
         self.layers = nn.ModuleList([
@@ -144,30 +266,171 @@ class Oracle850BTransformer(nn.Module):
         ])
         
         # Output
-        self.ln_f = nn.LayerNorm(self.d_model, eps=config.get("rmsnorm_eps", 1e-5))
-        self.lm_head = nn.Linear(self.d_model, self.vocab_size, bias=False)
+        self.ln_f = OracleLayerNorm(self.d_model, eps=config.get("rmsnorm_eps", 1e-5))
+        if self.vocab_parallel:
+            self.lm_head = VocabParallelLMHead(self.d_model, self.vocab_size, vocab_parallel_group)
+        else:
+            self.lm_head = nn.Linear(self.d_model, self.vocab_size, bias=False)
+        if self.tie_word_embeddings:
+            self.lm_head.weight = self.token_embedding.weight
+        self.lm_head_chunk_size = config.get("lm_head_chunk_size", 1024)
+        
+        # fp32 unless a policy is given; loaders apply config["fp"] (create_oracle850b_model)
+        self.precision = precision or PrecisionPolicy()
+        self.precision.apply(self)
         
     def forward(self, input_ids: torch.Tensor, 
-                attention_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
-        """Forward pass"""
+                attention_mask: Optional[torch.Tensor] = None,
+                return_logits: Union[bool, str] = True,
+                **packing) -> torch.Tensor:
+        """Forward pass.
+        
+        return_logits: True/"all" -> [batch_size, seq_len, vocab_size],
+        "last" -> [batch_size, 1, vocab_size] (generation), False -> final hidden states.
+        packing: position_ids / cu_seqlens / document_ids / kv_cache, see forward_hidden.
+        """
+        hidden = self.forward_hidden(input_ids, attention_mask, **packing)
+        
+        if return_logits is False:
+            return hidden
+        if return_logits == "last":
+            hidden = hidden[:, -1:]
+        elif return_logits not in (True, "all"):
+            raise ValueError(f"Unknown return_logits mode: {return_logits}")
+        
+        return self.lm_head(hidden.to(self.lm_head.weight.dtype))
+    
+    def compute_loss(self, input_ids: torch.Tensor,
+                     labels: Optional[torch.Tensor] = None,
+                     attention_mask: Optional[torch.Tensor] = None,
+                     ignore_index: int = -100,
+                     cu_seqlens: Optional[torch.Tensor] = None,
+                     document_ids: Optional[torch.Tensor] = None,
+                     position_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Next-token cross-entropy without materializing [batch_size, seq_len, vocab_size]"""
+        if labels is None:
+            labels = input_ids
+        
         batch_size, seq_len = input_ids.shape
+        if cu_seqlens is not None:
+            document_ids = document_ids_from_cu_seqlens(cu_seqlens, batch_size, seq_len)
+        if document_ids is not None:
+            # Last token of a packed document does not predict the next document
+            labels = labels.clone()
+            labels[:, 1:] = labels[:, 1:].masked_fill(document_ids[:, 1:] != document_ids[:, :-1], ignore_index)
         
-        # Embeddings
-        token_emb = self.token_embedding(input_ids)
-        pos_ids = torch.arange(seq_len, device=input_ids.device)
-        pos_emb = self.position_embedding(pos_ids)
+        hidden = self.forward_hidden(input_ids, attention_mask, position_ids=position_ids,
+                                     document_ids=document_ids)
+        
+        # Shift: position t predicts token t + 1
+        if self.vocab_parallel:
+            return chunked_cross_entropy(
+                hidden[:, :-1], self.lm_head.weight, labels[:, 1:],
+                chunk_size=self.lm_head_chunk_size, ignore_index=ignore_index,
+                vocab_start=self.lm_head.vocab_start, group=self.lm_head.group
+            )
+        return chunked_cross_entropy(
+            hidden[:, :-1], self.lm_head.weight, labels[:, 1:],
+            chunk_size=self.lm_head_chunk_size, ignore_index=ignore_index
+        )
+    
+    def forward_hidden(self, input_ids: torch.Tensor,
+                       attention_mask: Optional[torch.Tensor] = None,
+                       position_ids: Optional[torch.Tensor] = None,
+                       cu_seqlens: Optional[torch.Tensor] = None,
+                       document_ids: Optional[torch.Tensor] = None,
+                       kv_cache: Optional[DynamicKVCache] = None) -> torch.Tensor:
+        """Final normalized hidden states [batch_size, seq_len, d_model].
+        
+        Packed batches pass cu_seqlens (flattened cumulative lengths) or
+        document_ids [batch_size, seq_len]: attention becomes block-diagonal
+        causal and positions restart at every document.
+        attention_mask keeps the nn.MultiheadAttention attn_mask format and
+        replaces the causal mask when given.
+        kv_cache (see create_kv_cache) continues decoding after the cached tokens.
+        """
+        batch_size, seq_len = input_ids.shape
         
-        x = token_emb + pos_emb
+        if cu_seqlens is not None:
+            document_ids = document_ids_from_cu_seqlens(cu_seqlens, batch_size, seq_len)
+        if position_ids is None:
+            if document_ids is not None:
+                position_ids = position_ids_from_document_ids(document_ids)
+            elif kv_cache is not None:
+                position_ids = kv_cache.next_position_ids(batch_size, seq_len, input_ids.device)
+            else:
+                position_ids = torch.arange(seq_len, device=input_ids.device).expand(batch_size, seq_len)
+        
+        # Attention mask: None means causal (sliding-window causal when configured)
+        if attention_mask is not None:
+            attn_mask = convert_legacy_attention_mask(attention_mask, batch_size, self.n_heads)
+        elif document_ids is not None:
+            attn_mask = build_attention_mask(
+                position_ids, position_ids, document_ids, document_ids,
+                window=self.config.get("sliding_window"),
+                sink_tokens=self.config.get("attention_sink_tokens", 0)
+            )
+        else:
+            attn_mask = None
+        
+        # Embeddings
+        x = self.token_embedding(input_ids)
+        if self.position_encoding == "learned":
+            x = x + self.position_embedding(position_ids)
         
         # Transformer layers
-        for layer in self.layers:
-            x = layer(x, attention_mask)
+        with self.precision.autocast(input_ids.device.type):
+            for layer_idx, layer in enumerate(self.layers):
+                x = layer(x, attn_mask, position_ids, kv_cache, layer_idx)
         
         # Output
-        x = self.ln_f(x)
-        logits = self.lm_head(x)
-        
-        return logits
+        return self.ln_f(x)
+    
+    def create_kv_cache(self, max_rewind: int = 0) -> DynamicKVCache:
+        """Empty KV cache for generation (capped at the window with sliding_window)"""
+        return create_kv_cache(self.config, max_rewind)
+
+
+def _chunk_loss_sum(hidden: torch.Tensor, weight: torch.Tensor, labels: torch.Tensor,
+                    ignore_index: int, vocab_start: int = 0, group: Optional[Any] = None,
+                    vocab_parallel: bool = False) -> torch.Tensor:
+    """Summed cross-entropy for one chunk of positions"""
+    if vocab_parallel:
+        hidden = copy_to_parallel_region(hidden, group)
+        logits = F.linear(hidden.to(weight.dtype), weight)
+        return vocab_parallel_cross_entropy(logits, labels, vocab_start, group, ignore_index).sum()
+    
+    logits = F.linear(hidden.to(weight.dtype), weight).float()
+    return F.cross_entropy(logits, labels, ignore_index=ignore_index, reduction="sum")
+
+
+def chunked_cross_entropy(hidden: torch.Tensor, weight: torch.Tensor, labels: torch.Tensor,
+                          chunk_size: int = 1024, ignore_index: int = -100,
+                          vocab_start: Optional[int] = None, group: Optional[Any] = None) -> torch.Tensor:
+    """Mean cross-entropy of lm_head(hidden) over sequence chunks.
+    
+    Only [chunk_size, vocab_size] logits exist at a time; under autograd each
+    chunk is checkpointed so backward recomputes its logits instead of keeping them.
+    With `vocab_start` set, `weight` is this rank's vocab shard and the softmax
+    is computed across `group`.
+    """
+    vocab_parallel = vocab_start is not None
+    shard_args = (vocab_start or 0, group, vocab_parallel)
+    hidden = hidden.reshape(-1, hidden.shape[-1])
+    labels = labels.reshape(-1)
+    
+    loss_sum = hidden.new_zeros((), dtype=torch.float32)
+    for start in range(0, hidden.shape[0], chunk_size):
+        h = hidden[start:start + chunk_size]
+        y = labels[start:start + chunk_size]
+        if torch.is_grad_enabled() and (h.requires_grad or weight.requires_grad):
+            loss_sum = loss_sum + checkpoint(_chunk_loss_sum, h, weight, y, ignore_index, *shard_args,
+                                             use_reentrant=False)
+        else:
+            loss_sum = loss_sum + _chunk_loss_sum(h, weight, y, ignore_index, *shard_args)
+    
+    num_valid = (labels != ignore_index).sum().clamp(min=1)
+    return loss_sum / num_valid
 
 
 class Oracle850BLayer(nn.Module):
@@ -182,24 +445,28 @@ class Oracle850BLayer(nn.Module):
         self.top_k = config["moe"]["router"]["k"]
         
         # Self-attention
-        self.attention = nn.MultiheadAttention(
-            self.d_model, self.n_heads, batch_first=True
-        )
+        self.attention = Oracle850BAttention(self.d_model, self.n_heads, config)
         
         # MoE FFN
         self.moe = MoELayer(
-            self.d_model, self.num_experts, self.d_ff, self.top_k
+            self.d_model, self.num_experts, self.d_ff, self.top_k,
+            capacity_factor=config["moe"].get("capacity_factor", 1.25),
+            dispatch=config["moe"].get("dispatch", "dropless"),
+            min_capacity=config["moe"].get("min_capacity", 4)
         )
         
         # Layer norms
-        self.ln1 = nn.LayerNorm(self.d_model, eps=config.get("rmsnorm_eps", 1e-5))
-        self.ln2 = nn.LayerNorm(self.d_model, eps=config.get("rmsnorm_eps", 1e-5))
+        self.ln1 = OracleLayerNorm(self.d_model, eps=config.get("rmsnorm_eps", 1e-5))
+        self.ln2 = OracleLayerNorm(self.d_model, eps=config.get("rmsnorm_eps", 1e-5))
         
     def forward(self, x: torch.Tensor, 
-                attention_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
-        """Forward pass through layer"""
+                attention_mask: Optional[torch.Tensor] = None,
+                position_ids: Optional[torch.Tensor] = None,
+                kv_cache: Optional[DynamicKVCache] = None,
+                layer_idx: int = 0) -> torch.Tensor:
+        """Forward pass through layer (attention_mask in SDPA format, None = causal)"""
         # Self-attention
-        attn_out, _ = self.attention(x, x, x, attn_mask=attention_mask)
+        attn_out = self.attention(x, attention_mask, position_ids, kv_cache, layer_idx)
         x = x + attn_out
         x = self.ln1(x)
         
@@ -211,14 +478,16 @@ class Oracle850BLayer(nn.Module):
         return x
 
 
-def create_oracle850b_model(config_path: str) -> Oracle850BTransformer:
-    """Create Oracle850B model from config"""
+def create_oracle850b_model(config_path: str, mode: str = "infer",
+                            device: Optional[str] = None) -> Oracle850BTransformer:
+    """Create Oracle850B model from config with the train/infer precision policy"""
     import json
     
     with open(config_path, 'r') as f:
         config = json.load(f)
     
-    return Oracle850BTransformer(config)
+    precision = PrecisionPolicy.from_config(config, mode=mode, device=device)
+    return Oracle850BTransformer(config, precision=precision)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Oracle850B Vocabulary-Parallel Embedding and Output Head
+Vocab sharded across a process group with distributed softmax/cross-entropy
+Author: MagistrTheOne|Краснодар|2025
+"""
+
+import math
+from typing import Optional, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributed as dist
+
+
+def vocab_range(vocab_size: int, rank: int, world_size: int) -> Tuple[int, int]:
+    """[start, end) of the vocab shard owned by `rank`"""
+    if vocab_size % world_size != 0:
+        raise ValueError(f"vocab_size={vocab_size} is not divisible by world_size={world_size}")
+    shard = vocab_size // world_size
+    return rank * shard, (rank + 1) * shard
+
+
+class _CopyToParallelRegion(torch.autograd.Function):
+    """Identity forward, all-reduce of the gradient backward"""
+
+    @staticmethod
+    def forward(ctx, x, group):
+        ctx.group = group
+        return x
+
+    @staticmethod
+    def backward(ctx, grad):
+        grad = grad.contiguous()
+        dist.all_reduce(grad, group=ctx.group)
+        return grad, None
+
+
+class _ReduceFromParallelRegion(torch.autograd.Function):
+    """All-reduce forward, identity backward"""
+
+    @staticmethod
+    def forward(ctx, x, group):
+        x = x.contiguous()
+        dist.all_reduce(x, group=group)
+        return x
+
+    @staticmethod
+    def backward(ctx, grad):
+        return grad, None
+
+
+class _GatherFromParallelRegion(torch.autograd.Function):
+    """All-gather along the last dim forward, keep the local slice backward"""
+
+    @staticmethod
+    def forward(ctx, x, group):
+        ctx.group = group
+        ctx.rank = dist.get_rank(group)
+        ctx.local_size = x.shape[-1]
+        world_size = dist.get_world_size(group)
+        parts = [torch.empty_like(x) for _ in range(world_size)]
+        dist.all_gather(parts, x.contiguous(), group=group)
+        return torch.cat(parts, dim=-1)
+
+    @staticmethod
+    def backward(ctx, grad):
+        start = ctx.rank * ctx.local_size
+        return grad[..., start:start + ctx.local_size].contiguous(), None
+
+
+class _VocabParallelCrossEntropy(torch.autograd.Function):
+    """Cross-entropy over vocab-sharded logits, never gathering the full vocab"""
+
+    @staticmethod
+    def forward(ctx, local_logits, target, vocab_start, group, ignore_index):
+        # local_logits: [num_tokens, local_vocab] float32, target: [num_tokens]
+        local_vocab = local_logits.shape[-1]
+
+        # Global max for numerical stability
+        logits_max = local_logits.max(dim=-1).values
+        dist.all_reduce(logits_max, op=dist.ReduceOp.MAX, group=group)
+        shifted = local_logits - logits_max.unsqueeze(-1)
+
+        # Target logit lives on exactly one rank
+        outside = (target < vocab_start) | (target >= vocab_start + local_vocab)
+        local_target = (target - vocab_start).masked_fill(outside, 0)
+        predicted = shifted.gather(-1, local_target.unsqueeze(-1)).squeeze(-1).masked_fill(outside, 0.0)
+        dist.all_reduce(predicted, group=group)
+
+        # Global softmax denominator
+        exp_logits = shifted.exp()
+        sum_exp = exp_logits.sum(dim=-1)
+        dist.all_reduce(sum_exp, group=group)
+
+        ignored = target == ignore_index
+        loss = (sum_exp.log() - predicted).masked_fill(ignored, 0.0)
+
+        softmax = exp_logits / sum_exp.unsqueeze(-1)
+        ctx.save_for_backward(softmax, outside, local_target, ignored)
+        return loss
+
+    @staticmethod
+    def backward(ctx, grad_loss):
+        softmax, outside, local_target, ignored = ctx.saved_tensors
+        grad = softmax.clone()
+        grad.scatter_add_(-1, local_target.unsqueeze(-1), -(~outside).to(grad.dtype).unsqueeze(-1))
+        grad = grad * grad_loss.masked_fill(ignored, 0.0).unsqueeze(-1)
+        return grad, None, None, None, None
+
+
+def copy_to_parallel_region(x: torch.Tensor, group: Optional[dist.ProcessGroup] = None) -> torch.Tensor:
+    """Replicated input to a vocab-parallel op (gradients are summed across ranks)"""
+    return _CopyToParallelRegion.apply(x, group)
+
+
+def vocab_parallel_cross_entropy(local_logits: torch.Tensor, target: torch.Tensor, vocab_start: int,
+                                 group: Optional[dist.ProcessGroup] = None,
+                                 ignore_index: int = -100) -> torch.Tensor:
+    """Per-token cross-entropy [num_tokens] from this rank's logits shard"""
+    return _VocabParallelCrossEntropy.apply(local_logits.float(), target, vocab_start, group, ignore_index)
+
+
+class VocabParallelEmbedding(nn.Module):
+    """Token embedding with rows sharded across the process group"""
+
+    def __init__(self, vocab_size: int, d_model: int, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        self.vocab_size = vocab_size
+        self.d_model = d_model
+        self.group = group
+        self.vocab_start, self.vocab_end = vocab_range(
+            vocab_size, dist.get_rank(group), dist.get_world_size(group)
+        )
+        self.weight = nn.Parameter(torch.empty(self.vocab_end - self.vocab_start, d_model))
+        nn.init.normal_(self.weight)
+
+    def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        outside = (input_ids < self.vocab_start) | (input_ids >= self.vocab_end)
+        local_ids = (input_ids - self.vocab_start).masked_fill(outside, 0)
+        embeddings = F.embedding(local_ids, self.weight).masked_fill(outside.unsqueeze(-1), 0.0)
+        return _ReduceFromParallelRegion.apply(embeddings, self.group)
+
+    def extra_repr(self) -> str:
+        return f"vocab={self.vocab_start}:{self.vocab_end}/{self.vocab_size}, d_model={self.d_model}"
+
+
+class VocabParallelLMHead(nn.Module):
+    """Output projection with vocab rows sharded across the process group"""
+
+    def __init__(self, d_model: int, vocab_size: int, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        self.d_model = d_model
+        self.vocab_size = vocab_size
+        self.group = group
+        self.vocab_start, self.vocab_end = vocab_range(
+            vocab_size, dist.get_rank(group), dist.get_world_size(group)
+        )
+        self.weight = nn.Parameter(torch.empty(self.vocab_end - self.vocab_start, d_model))
+        nn.init.kaiming_uniform_(self.weight, a=math.sqrt(5))
+
+    def local_logits(self, hidden: torch.Tensor) -> torch.Tensor:
+        """Logits for this rank's vocab shard [..., vocab_size // world_size]"""
+        hidden = copy_to_parallel_region(hidden, self.group)
+        return F.linear(hidden.to(self.weight.dtype), self.weight)
+
+    def forward(self, hidden: torch.Tensor) -> torch.Tensor:
+        """Full logits gathered from all shards [..., vocab_size]"""
+        return _GatherFromParallelRegion.apply(self.local_logits(hidden), self.group)
+
+    def extra_repr(self) -> str:
+        return f"d_model={self.d_model}, vocab={self.vocab_start}:{self.vocab_end}/{self.vocab_size}"
+
+
+def _gloo_worker(rank: int, world_size: int, init_file: str):
+    """Compare the sharded path against a single-process reference"""
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size)
+
+    vocab_size, d_model = 64, 16
+    torch.manual_seed(0)
+    full_weight = torch.randn(vocab_size, d_model)
+    input_ids = torch.randint(0, vocab_size, (2, 8))
+    target = torch.randint(0, vocab_size, (16,))
+    target[3] = -100
+
+    # Reference: tied embedding + lm_head on one process
+    ref_weight = full_weight.clone().requires_grad_()
+    hidden_ref = F.embedding(input_ids, ref_weight).view(16, d_model)
+    ref_logits = F.linear(hidden_ref, ref_weight)
+    ref_loss = F.cross_entropy(ref_logits, target, ignore_index=-100)
+    ref_loss.backward()
+
+    # Sharded and tied
+    embedding = VocabParallelEmbedding(vocab_size, d_model)
+    lm_head = VocabParallelLMHead(d_model, vocab_size)
+    with torch.no_grad():
+        embedding.weight.copy_(full_weight[embedding.vocab_start:embedding.vocab_end])
+    lm_head.weight = embedding.weight
+
+    hidden = embedding(input_ids).view(16, d_model)
+    logits = lm_head(hidden)
+    losses = vocab_parallel_cross_entropy(lm_head.local_logits(hidden), target, lm_head.vocab_start)
+    loss = losses.sum() / (target != -100).sum()
+    loss.backward()
+
+    ref_grad = ref_weight.grad[embedding.vocab_start:embedding.vocab_end]
+    checks = {
+        "logits": (logits - ref_logits).abs().max().item(),
+        "loss": abs(loss.item() - ref_loss.item()),
+        "grad": (embedding.weight.grad - ref_grad).abs().max().item(),
+    }
+    assert all(err < 1e-4 for err in checks.values()), checks
+    if rank == 0:
+        print(f"vocab-parallel (world_size={world_size}) matches reference: {checks}")
+
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    # Test with gloo on CPU
+    import os
+    import tempfile
+    import torch.multiprocessing as mp
+
+    world_size = 2
+    init_file = os.path.join(tempfile.mkdtemp(), "gloo_init")
+    mp.spawn(_gloo_worker, args=(world_size, init_file), nprocs=world_size)